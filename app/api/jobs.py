@@ -0,0 +1,83 @@
+# app/api/jobs.py
+import json
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from core.config import config_store
+from core.logging import get_logger
+from models.orm import LLMJob
+from models.schemas import GenerateRequest, JobResponse
+from services.job_service import job_service
+
+logger = get_logger(__name__)
+router = APIRouter()
+
+
+def _job_response(job: LLMJob) -> JobResponse:
+    return JobResponse(
+        id=job.id,
+        model=job.model,
+        status=job.status,
+        result=job.result,
+        usage=json.loads(job.usage_json) if job.usage_json else None,
+        error=job.error,
+        user_id=job.user_id,
+        attempts=job.attempts,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
+
+
+async def _get_job(job_id: str) -> LLMJob:
+    job = await job_service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.post("/jobs", response_model=JobResponse, status_code=202, tags=["jobs"])
+async def submit_job(req: GenerateRequest):
+    """
+    Поставить генерацию в очередь. Ответ сразу (id и status=queued), результат — через GET /jobs/{id}
+    или GET /jobs/{id}/stream; соединение на время генерации держать не нужно.
+    """
+    try:
+        config_store.get_model_config(req.model)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {req.model}")
+    params = dict(req.params or {})
+    if req.temperature is not None:
+        params["temperature"] = req.temperature
+    if req.top_p is not None:
+        params["top_p"] = req.top_p
+    if req.max_new_tokens is not None:
+        params["max_new_tokens"] = req.max_new_tokens
+    job = await job_service.submit(req.model, req.prompt, params=params, user_id=req.user_id)
+    return _job_response(job)
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse, tags=["jobs"])
+async def get_job(job_id: str):
+    """Статус задачи; result — после status=done (у cancelled/failed — то, что успело сгенерироваться)."""
+    return _job_response(await _get_job(job_id))
+
+
+@router.get("/jobs/{job_id}/stream", response_class=StreamingResponse, tags=["jobs"])
+async def stream_job(job_id: str):
+    """
+    Текст задачи по мере генерации: уже готовое сразу, дальше — новые чанки до завершения.
+    Переподключение безопасно: генерация идёт независимо от клиента.
+    """
+    await _get_job(job_id)
+    return StreamingResponse(job_service.stream(job_id), media_type="text/plain")
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobResponse, tags=["jobs"])
+async def cancel_job(job_id: str):
+    """Отменить задачу: из очереди — сразу, выполняющуюся — на ближайшем decode-шаге."""
+    await _get_job(job_id)
+    job = await job_service.cancel(job_id)
+    logger.info(f"Отмена задачи {job_id} (status={job.status})")
+    return _job_response(job)
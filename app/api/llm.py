@@ -1,5 +1,4 @@
 # app/api/llm.py
-import asyncio
 from fastapi.responses import StreamingResponse
 from models.schemas import GenerateRequest, GenerateResponse
 from models.schemas import (
@@ -13,12 +12,17 @@ from pydantic import BaseModel
 from typing import Optional, Dict, Any
 
 from scripts.text_processing import extract_jenkinsfile_block
+from llm_runners.cancellation import GenerationCancelled
+from services.admission_service import AdmissionError, LANE_INTERACTIVE
 from services.llm_service import llm_service
 from core.logging import get_logger
 
 logger = get_logger(__name__)
 router = APIRouter()
 
+# Nginx-style "Client Closed Request": отвечать уже некому, код нужен для логов
+CLIENT_CLOSED_REQUEST = 499
+
 @router.post("/generate", response_model=GenerateResponse, tags=["llm"])
 async def generate_pipeline(req: GenerateRequest, request: Request):
     """
@@ -38,7 +42,8 @@ async def generate_pipeline(req: GenerateRequest, request: Request):
                 "top_p": req.top_p,
                 "max_new_tokens": req.max_new_tokens,
             },
-            user_id=req.user_id
+            user_id=req.user_id,
+            request=request,
         )
         # result может быть либо строкой, либо dict c деталями (если runner поддерживает)
         
@@ -56,19 +61,19 @@ async def generate_pipeline(req: GenerateRequest, request: Request):
             result=text,
             usage=usage
         )
+    except GenerationCancelled:
+        logger.info(f"Генерация отменена: клиент отключился (model={req.model})")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client disconnected")
+    except AdmissionError:
+        # 429 / 503 отдаёт обработчик в server.py
+        raise
     except Exception as e:
         logger.exception("Ошибка генерации")
         raise HTTPException(status_code=500, detail=f"Ошибка генерации: {e}")
 
-@router.post("/batch_generate", response_model=BatchGenerateResponse, tags=["llm"])
-async def batch_generate(req: BatchGenerateRequest, request: Request):
-    """
-    Параллельная генерация по массиву запросов.
-    """
-    logger.info(f"Batch generation: {len(req.requests)} запрос(ов)")
-    tasks = []
+def _batch_items(req: BatchGenerateRequest) -> list:
+    items = []
     for item in req.requests:
-        # Формируем таск для каждого запроса
         params = dict(item.params or {})
         if item.temperature is not None:
             params["temperature"] = item.temperature
@@ -76,48 +81,52 @@ async def batch_generate(req: BatchGenerateRequest, request: Request):
             params["top_p"] = item.top_p
         if item.max_new_tokens is not None:
             params["max_new_tokens"] = item.max_new_tokens
-        # Корректный порядок возвращается всегда
-        tasks.append(
-            llm_service.generate(
-                model=item.model,
-                prompt=item.prompt,
-                params=params,
-                user_id=item.user_id
-            )
+        items.append({"model": item.model, "prompt": item.prompt, "params": params, "user_id": item.user_id})
+    return items
+
+def _batch_response_item(index: int, item, result) -> BatchGenerateResponseItem:
+    if isinstance(result, Exception):
+        return BatchGenerateResponseItem(model=item.model, prompt=item.prompt, result="", error=str(result), index=index)
+    if isinstance(result, dict):
+        return BatchGenerateResponseItem(
+            model=item.model,
+            prompt=item.prompt,
+            result=result.get("text") or result.get("result") or "",
+            usage=result.get("usage"),
+            index=index,
         )
-    # Выполняем всё параллельно
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    response_items = []
-    for item, result in zip(req.requests, results):
-        if isinstance(result, Exception):
-            response_items.append(BatchGenerateResponseItem(
-                model=item.model,
-                prompt=item.prompt,
-                result="",
-                error=str(result)
-            ))
-        elif isinstance(result, dict):
-            response_items.append(BatchGenerateResponseItem(
-                model=item.model,
-                prompt=item.prompt,
-                result=result.get("text") or result.get("result") or "",
-                usage=result.get("usage"),
-            ))
-        else:
-            response_items.append(BatchGenerateResponseItem(
-                model=item.model,
-                prompt=item.prompt,
-                result=str(result)
-            ))
+    return BatchGenerateResponseItem(model=item.model, prompt=item.prompt, result=str(result), index=index)
+
+@router.post("/batch_generate", response_model=BatchGenerateResponse, tags=["llm"])
+async def batch_generate(req: BatchGenerateRequest, request: Request):
+    """
+    Пакетная генерация: запросы с одной моделью и одинаковыми параметрами идут batched forward'ами.
+    Ответ — после всех элементов, в порядке запроса.
+    """
+    logger.info(f"Batch generation: {len(req.requests)} запрос(ов)")
+    response_items = [None] * len(req.requests)
+    async for index, result in llm_service.generate_batch(_batch_items(req), request=request):
+        response_items[index] = _batch_response_item(index, req.requests[index], result)
     return BatchGenerateResponse(results=response_items)
 
+@router.post("/batch_generate_stream", response_class=StreamingResponse, tags=["llm"])
+async def batch_generate_stream(req: BatchGenerateRequest, request: Request):
+    """
+    Как /batch_generate, но NDJSON: по строке BatchGenerateResponseItem (с index) сразу по готовности элемента.
+    """
+    logger.info(f"Batch generation (stream): {len(req.requests)} запрос(ов)")
+
+    async def ndjson_stream():
+        async for index, result in llm_service.generate_batch(_batch_items(req), request=request):
+            yield _batch_response_item(index, req.requests[index], result).model_dump_json() + "\n"
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
 @router.post("/stream_generate", response_class=StreamingResponse, tags=["llm"])
 async def stream_generate(req: GenerateRequest, request: Request):
     """
     Стриминговая генерация — отдаёт ответ по мере генерации токенов.
     """
-    # Выбор раннера
-    runner = llm_service.get_runner(req.model)
     # Обработаем параметры
     gen_kwargs = dict(req.params or {})
     if req.temperature is not None:
@@ -126,15 +135,23 @@ async def stream_generate(req: GenerateRequest, request: Request):
         gen_kwargs["top_p"] = req.top_p
     if req.max_new_tokens is not None:
         gen_kwargs["max_new_tokens"] = req.max_new_tokens
+    # Слот занимаем до начала стрима, чтобы при перегрузке успеть ответить 429/503
+    ticket = await llm_service.admit(req.model, LANE_INTERACTIVE)
 
     async def event_stream():
         try:
-            async for chunk in runner.generate_stream(req.prompt, **gen_kwargs):
+            async for chunk in llm_service.generate_stream(
+                req.model, req.prompt, params=gen_kwargs, user_id=req.user_id, request=request, ticket=ticket
+            ):
                 # Форматируем как SSE (text/event-stream) — либо просто text-plain
                 # Можно JSON-оборачивать для совместимости с фронтом
                 yield chunk
+        except GenerationCancelled:
+            logger.info(f"Stream генерация отменена (model={req.model})")
         except Exception as e:
             logger.exception("Ошибка stream генерации")
             yield f"\n[ERROR]: {str(e)}"
+        finally:
+            ticket.release()
 
     return StreamingResponse(event_stream(), media_type="text/plain")  # или "text/event-stream"
\ No newline at end of file
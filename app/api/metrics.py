@@ -1,32 +1,167 @@
 # app/api/metrics.py
 from fastapi import APIRouter, Response
 from services.metrics_service import metrics_service
+from services.admission_service import admission_service
+from services.llm_service import llm_service
+from llm_runners.weight_registry import weight_registry
+from services.cpu_budget import cpu_budget
+from services.job_service import job_service
 
 router = APIRouter()
 
+
+class _Exposition:
+    """
+    Текстовый формат Prometheus: # HELP / # TYPE каждого семейства — ровно один раз,
+    все сэмплы семейства (с разными labels) — подряд под ним. Семейства выводятся
+    в порядке первого объявления.
+    """
+    def __init__(self):
+        self._families = {}
+
+    def family(self, name: str, kind: str, help_text: str):
+        if name not in self._families:
+            self._families[name] = (kind, help_text, [])
+
+    def sample(self, name: str, value, **labels):
+        label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        self._families[name][2].append(f'{name}{{{label_str}}} {value}' if label_str else f'{name} {value}')
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, samples) in self._families.items():
+            if not samples:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
 @router.get("/prometheus", response_class=Response, tags=["metrics"])
 async def prometheus_metrics():
     """Возвращает метрики в формате Prometheus."""
     data = await metrics_service.get_metrics()
-    lines = []
-    lines.append(f'# HELP llm_total_requests Total LLM requests')
-    lines.append(f'# TYPE llm_total_requests counter')
-    lines.append(f'llm_total_requests {data["total_requests"]}')
-    lines.append(f'# HELP llm_total_tokens Total generated tokens')
-    lines.append(f'# TYPE llm_total_tokens counter')
-    lines.append(f'llm_total_tokens {data["total_tokens"]}')
-    lines.append(f'# HELP llm_avg_latency_ms Average request latency (ms)')
-    lines.append(f'# TYPE llm_avg_latency_ms gauge')
-    lines.append(f'llm_avg_latency_ms {data["avg_latency_ms"]:.3f}')
+    out = _Exposition()
+    out.family("llm_total_requests", "counter", "Total LLM requests")
+    out.sample("llm_total_requests", data["total_requests"])
+    out.family("llm_total_tokens", "counter", "Total generated tokens")
+    out.sample("llm_total_tokens", data["total_tokens"])
+    out.family("llm_avg_latency_ms", "gauge", "Average request latency (ms)")
+    out.sample("llm_avg_latency_ms", f'{data["avg_latency_ms"]:.3f}')
     # По моделям
+    out.family("llm_model_requests_total", "counter", "Requests per model")
+    out.family("llm_model_tokens_total", "counter", "Tokens per model")
+    out.family("llm_model_avg_latency_ms", "gauge", "Average latency per model (ms)")
+    out.family("llm_model_queue_time_ms_total", "counter", "Time spent waiting in model queue (ms)")
+    out.family("llm_model_rejected_total", "counter", "Requests rejected by admission control")
+    out.family("llm_spec_acceptance_rate", "gauge", "Share of draft tokens accepted by the main model")
+    out.family("llm_spec_tokens_per_forward", "gauge", "Tokens produced per main-model forward (decode speedup)")
+    out.family("llm_lookup_hit_rate", "gauge",
+               "Share of generated tokens copied from the prompt by prompt-lookup drafts")
+    out.family("llm_lookup_tokens_per_forward", "gauge", "Tokens produced per main-model forward with prompt lookup")
+    out.family("llm_decode_ms_per_token", "gauge", "Average decode time per generated token (excluding prefill)")
+    for model, stats in data["models_stats"].items():
+        out.sample("llm_model_requests_total", stats["requests"], model=model)
+        out.sample("llm_model_tokens_total", stats["tokens"], model=model)
+        out.sample("llm_model_avg_latency_ms", f'{stats["avg_latency_ms"]:.3f}', model=model)
+        out.sample("llm_model_queue_time_ms_total", stats.get("total_queue_time_ms", 0), model=model)
+        out.sample("llm_model_rejected_total", stats.get("rejected", 0), model=model)
+        if stats.get("spec_generations"):
+            drafted = stats["spec_drafted"]
+            out.sample("llm_spec_acceptance_rate",
+                       f'{(stats["spec_accepted"] / drafted if drafted else 0.0):.4f}', model=model)
+            out.sample("llm_spec_tokens_per_forward",
+                       f'{stats["spec_tokens_per_forward_sum"] / stats["spec_generations"]:.4f}', model=model)
+        if stats.get("lookup_generations"):
+            produced = stats["lookup_tokens"]
+            out.sample("llm_lookup_hit_rate",
+                       f'{(stats["lookup_accepted"] / produced if produced else 0.0):.4f}', model=model)
+            out.sample("llm_lookup_tokens_per_forward",
+                       f'{stats["lookup_tokens_per_forward_sum"] / stats["lookup_generations"]:.4f}', model=model)
+        for mode in ("compiled", "eager"):
+            if stats.get(f"decode_{mode}_generations"):
+                out.sample("llm_decode_ms_per_token",
+                           f'{stats[f"decode_{mode}_ms_sum"] / stats[f"decode_{mode}_generations"]:.3f}',
+                           model=model, mode=mode)
+    # Кэши генераций
+    out.family("llm_cache_hits_total", "counter", "Generation cache hits")
+    out.family("llm_cache_misses_total", "counter", "Generation cache misses")
+    for cache, c in data.get("cache_stats", {}).items():
+        out.sample("llm_cache_hits_total", c["hits"], cache=cache)
+        out.sample("llm_cache_misses_total", c["misses"], cache=cache)
+    # Текущее состояние очередей
+    out.family("llm_model_active", "gauge", "Generations in progress per model")
+    out.family("llm_model_queue_depth", "gauge", "Requests waiting per model")
+    for model, q in admission_service.stats().items():
+        out.sample("llm_model_active", q["active"], model=model)
+        out.sample("llm_model_queue_depth", q["queued"], model=model)
+    # Загруженные модели и бюджет RAM
+    registry = llm_service.runners.stats()
+    out.family("llm_runner_memory_budget_bytes", "gauge", "RAM budget for loaded models")
+    out.sample("llm_runner_memory_budget_bytes", registry["budget_bytes"])
+    out.family("llm_runner_evictions_total", "counter", "Idle models unloaded to fit a new one")
+    out.sample("llm_runner_evictions_total", registry["evictions"])
+    out.family("llm_runner_memory_bytes", "gauge", "Estimated resident memory per loaded model")
+    for model, r in registry["runners"].items():
+        out.sample("llm_runner_memory_bytes", r["bytes"], model=model)
+    out.family("llm_shared_weights_refs", "gauge", "Runners (model configs) sharing one loaded copy of weights")
+    for w in weight_registry.stats()["weights"]:
+        out.sample("llm_shared_weights_refs", w["refs"], model_path=w["model_path"], type=w["type"])
+    out.family("llm_runner_draining_active", "gauge", "Generations still running on a swapped-out model version")
+    for d in registry["draining"]:
+        out.sample("llm_runner_draining_active", d["active"], model=d["model"])
+    # Hot-swap моделей
+    out.family("llm_model_reload_elapsed_ms", "gauge", "Time spent so far loading the new model version")
+    for model, elapsed_ms in data.get("reloads_in_progress", {}).items():
+        out.sample("llm_model_reload_elapsed_ms", elapsed_ms, model=model)
+    out.family("llm_model_reloads_total", "counter", "Completed model hot-swaps")
+    out.family("llm_model_reload_failures_total", "counter", "Failed model hot-swaps (old version kept)")
+    out.family("llm_model_reload_last_duration_ms", "gauge", "Duration of the last model hot-swap load")
     for model, stats in data["models_stats"].items():
-        lines.append(f'# HELP llm_model_requests_total Requests per model')
-        lines.append(f'# TYPE llm_model_requests_total counter')
-        lines.append(f'llm_model_requests_total{{model="{model}"}} {stats["requests"]}')
-        lines.append(f'# HELP llm_model_tokens_total Tokens per model')
-        lines.append(f'# TYPE llm_model_tokens_total counter')
-        lines.append(f'llm_model_tokens_total{{model="{model}"}} {stats["tokens"]}')
-        lines.append(f'# HELP llm_model_avg_latency_ms Average latency per model (ms)')
-        lines.append(f'# TYPE llm_model_avg_latency_ms gauge')
-        lines.append(f'llm_model_avg_latency_ms{{model="{model}"}} {stats["avg_latency_ms"]:.3f}')
-    return Response("\n".join(lines), media_type="text/plain")
+        if not stats.get("reloads") and not stats.get("reload_failures"):
+            continue
+        out.sample("llm_model_reloads_total", stats["reloads"], model=model)
+        out.sample("llm_model_reload_failures_total", stats["reload_failures"], model=model)
+        out.sample("llm_model_reload_last_duration_ms", stats["last_reload_ms"], model=model)
+    # Пулы llama.cpp контекстов (params.pool_size)
+    out.family("llm_llama_contexts", "gauge", "Size of the llama.cpp context pool")
+    out.family("llm_llama_contexts_busy", "gauge", "llama.cpp contexts checked out by running generations")
+    out.family("llm_llama_context_waits_total", "counter", "Generations that waited for a free llama.cpp context")
+    for model, runner in llm_service.runners.items():
+        pool = getattr(runner, "pool", None)
+        if pool is None or not hasattr(pool, "checkout"):
+            continue
+        p = pool.stats()
+        out.sample("llm_llama_contexts", p["size"], model=model)
+        out.sample("llm_llama_contexts_busy", p["busy"], model=model)
+        out.sample("llm_llama_context_waits_total", p["waits"], model=model)
+    # Раздел ядер CPU между runner'ами (CpuBudgetManager)
+    cpu = cpu_budget.stats()
+    out.family("llm_cpu_oversubscribed_cores", "gauge", "CPU cores assigned to more than one runner")
+    out.sample("llm_cpu_oversubscribed_cores", cpu["oversubscribed_cores"])
+    out.family("llm_cpu_cores", "gauge", "CPU cores assigned to the runner")
+    out.family("llm_cpu_threads", "gauge", "Compute threads per generation of runners with their own thread count (workers, llama.cpp, ONNX)")
+    for r in cpu["runners"]:
+        out.sample("llm_cpu_cores", len(r["cores"]), model=r["model"])
+        if r["isolated"]:
+            out.sample("llm_cpu_threads", r["threads"], model=r["model"])
+    # Фоновые задачи /llm/jobs
+    jobs = job_service.stats()
+    out.family("llm_jobs_queued", "gauge", "Jobs waiting in the queue")
+    out.sample("llm_jobs_queued", jobs["queued"])
+    out.family("llm_jobs_admitting", "gauge", "Jobs taken by job workers and waiting for a model slot")
+    out.sample("llm_jobs_admitting", jobs["admitting"])
+    out.family("llm_jobs_running", "gauge", "Jobs generating after admission")
+    out.sample("llm_jobs_running", jobs["running"])
+    # Процессы-воркеры (params.workers)
+    out.family("llm_workers_alive", "gauge", "Live worker processes per model")
+    out.family("llm_worker_restarts_total", "counter", "Worker process restarts per model")
+    for model, pool in llm_service.worker_stats().items():
+        out.sample("llm_workers_alive", sum(w["alive"] for w in pool["workers"]), model=model)
+        out.sample("llm_worker_restarts_total", pool["restarts"], model=model)
+    return Response(out.render(), media_type="text/plain; version=0.0.4")
@@ -1,5 +1,5 @@
 import json
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, HTTPException, Request
 from torch import select
 from db.database import get_session
 from models.orm import RAGHistory
@@ -7,7 +7,9 @@ from scripts.text_processing import extract_jenkinsfile_block
 from services.retriever_service import retriever_service
 from services.rag_history_service import rag_history_service
 from rag.template import format_context_block, get_prompt_template, truncate_prompt
+from llm_runners.cancellation import GenerationCancelled
 from services.llm_service import llm_service
+from api.llm import CLIENT_CLOSED_REQUEST
 from core.logging import get_logger
 from models.schemas import RAGRequest, RAGResponse
 
@@ -24,16 +26,23 @@ async def rag_generate(req: RAGRequest, request: Request):
         context_block=context_block,
         question=req.question
     )
-    runner = llm_service.get_runner(req.model)
+    runner = await llm_service.get_runner_async(req.model)
     if hasattr(runner, "tokenizer"):
         prompt = truncate_prompt(prompt, runner.tokenizer, max_tokens=2048)
 
-    result = await llm_service.generate(
-        model=req.model,
-        prompt=prompt,
-        params=req.params or {},
-        user_id=req.user_id
-    )
+    try:
+        result = await llm_service.generate(
+            model=req.model,
+            prompt=prompt,
+            params=req.params or {},
+            user_id=req.user_id,
+            request=request,
+        )
+    except GenerationCancelled:
+        logger.info(f"RAG генерация отменена: клиент отключился (model={req.model})")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client disconnected")
+    if isinstance(result, dict):
+        result = result.get("text", "")
     # Логируем историю
     await rag_history_service.log(
         user_id=req.user_id, model=req.model, question=req.question,
@@ -8,6 +8,25 @@ import glob
 
 MODELS_DIR = os.environ.get("MODELS_CONFIG_DIR", "models_configuration")
 
+# Ключи params, которые читает сервисный слой (очереди, кэши и т.п.), а не сам runner.
+# В runner.generate они не передаются.
+SERVICE_PARAMS = {
+    "max_concurrency", "max_queue", "queue_timeout_sec",
+    "workers", "worker_heartbeat_timeout_sec",
+    "pinned", "memory_mb", "preload",
+    "cpu_cores", "cpu_threads", "cpu_set",
+    # Отчёт scripts/tune_llama_cpp.py: для какой машины подобраны параметры
+    "autotune",
+}
+
+# params, изменение которых не требует перезагрузки весов: sampling-параметры генерации
+# и лимиты сервисного слоя. Всё остальное в params (n_ctx, device, draft_model, ...) — параметры загрузки.
+RUNTIME_PARAMS = {
+    "max_new_tokens", "temperature", "top_p", "top_k", "do_sample", "repetition_penalty", "cache",
+    "max_concurrency", "max_queue", "queue_timeout_sec", "worker_heartbeat_timeout_sec",
+    "pinned", "memory_mb", "preload", "autotune",
+}
+
 @final
 class LLMModelConfig(BaseModel):
     name: str
@@ -27,6 +46,15 @@ class AppConfig(BaseModel):
     default_model: str = "deepseek-r1-qwen-14b"   # значение по умолчанию
     # Можно расширить по мере надобности
 
+def load_affecting_changes(old: LLMModelConfig, new: LLMModelConfig) -> set:
+    """Какие изменения конфига требуют перезагрузки весов (пустое множество — достаточно подменить cfg)."""
+    changed = {field for field in ("type", "model_path") if getattr(old, field) != getattr(new, field)}
+    old_params, new_params = old.params or {}, new.params or {}
+    for key in set(old_params) | set(new_params):
+        if key not in RUNTIME_PARAMS and old_params.get(key) != new_params.get(key):
+            changed.add(f"params.{key}")
+    return changed
+
 def load_all_model_configs(dir_path="models_configuration") -> dict:
     configs = {}
     for fname in os.listdir(dir_path):
@@ -115,6 +143,18 @@ class ConfigStore:
             self._save_model_config(model_name)
             self._notify()
 
+    def update_model_params(self, model_name: str, params: Dict[str, Any]):
+        """Merge given keys into model params and save to YAML."""
+        with self._lock:
+            name = model_name.lower()
+            if name not in self._models:
+                raise KeyError(f"Model {model_name} not found")
+            cfg = self._models[name]
+            # Новый dict, а не update на месте: RunnerRegistry сравнивает со своей копией старого конфига
+            cfg.params = {**(cfg.params or {}), **params}
+            self._save_model_config(name)
+            self._notify()
+
     def add_or_update_model(self, cfg: LLMModelConfig, file_path: str = None):
         """Add or update a model config, save to YAML (file_path is optional)."""
         with self._lock:
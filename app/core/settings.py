@@ -31,6 +31,38 @@ class Settings(BaseSettings):
     max_context: int = Field(default=4096, env="MAX_CONTEXT")
     max_history_days: int = Field(default=30, env="MAX_HISTORY_DAYS")
 
+    # Кэш генераций (exact-match): in-memory LRU+TTL и опциональный SQLite-уровень
+    generation_cache_enabled: bool = Field(default=True, env="GENERATION_CACHE_ENABLED")
+    generation_cache_size: int = Field(default=1024, env="GENERATION_CACHE_SIZE")
+    generation_cache_ttl_sec: int = Field(default=24 * 3600, env="GENERATION_CACHE_TTL_SEC")
+    generation_cache_persist: bool = Field(default=False, env="GENERATION_CACHE_PERSIST")
+
+    # Семантический кэш: эмбеддинги prompt'ов через embedder RetrieverService
+    semantic_cache_enabled: bool = Field(default=False, env="SEMANTIC_CACHE_ENABLED")
+    semantic_cache_threshold: float = Field(default=0.97, env="SEMANTIC_CACHE_THRESHOLD")
+    semantic_cache_size: int = Field(default=2048, env="SEMANTIC_CACHE_SIZE")
+
+    # Бюджет RAM для загруженных моделей (МБ); 0 — 90% физической памяти
+    runner_memory_budget_mb: int = Field(default=0, env="RUNNER_MEMORY_BUDGET_MB")
+
+    # Раздел ядер CPU между загруженными моделями: свой набор ядер, число потоков и executor на runner.
+    # cpu_partitions — на сколько моделей делить ядра (0 — по числу загруженных моделей, не меньше default + preload),
+    # params.cpu_cores переопределяет; torch-модели в процессе сервера делят одно число потоков torch (своё — с params.workers);
+    # cpu_pinning — привязка потоков runner'а к его ядрам (sched_setaffinity)
+    cpu_budget_enabled: bool = Field(default=True, env="CPU_BUDGET_ENABLED")
+    cpu_partitions: int = Field(default=0, env="CPU_PARTITIONS")
+    cpu_pinning: bool = Field(default=False, env="CPU_PINNING")
+
+    # Фоновые задачи /llm/jobs: число воркеров, одновременно берущих задачи из очереди
+    job_workers: int = Field(default=2, env="JOB_WORKERS")
+
+    # Загрузка default_model и моделей с params.preload: true при старте + warm-up генерация
+    preload_on_startup: bool = Field(default=True, env="PRELOAD_ON_STARTUP")
+
+    # Кэш квантизованных весов (safetensors) для быстрого холодного старта; загрузки без квантизации не кэшируются
+    artifact_cache_enabled: bool = Field(default=True, env="ARTIFACT_CACHE_ENABLED")
+    artifact_cache_dir: str = Field(default="artifacts", env="ARTIFACT_CACHE_DIR")
+
     # CORS
     cors_origins: Union[str, List[str]] = Field(default="*", env="CORS_ORIGINS")
 
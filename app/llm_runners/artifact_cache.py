@@ -0,0 +1,116 @@
+# app/llm_runners/artifact_cache.py
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Optional
+
+import torch
+import transformers
+from transformers import AutoModelForCausalLM
+
+from core.logging import get_logger
+from core.settings import settings
+
+logger = get_logger(__name__)
+
+# Маркер готового артефакта: пишется последним, без него каталог считается недостроенным
+MANIFEST = "artifact.json"
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, torch.dtype):
+        return str(value)
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    return value
+
+
+def _source_fingerprint(model_path: str) -> Optional[Dict[str, Any]]:
+    """Для локального каталога — размеры и mtime весов, чтобы перезаписанная модель не брала старый артефакт."""
+    if not os.path.isdir(model_path):
+        return None
+    files = sorted(f for f in os.listdir(model_path) if f.endswith((".safetensors", ".bin", ".json")))
+    return {f: [os.path.getsize(os.path.join(model_path, f)), int(os.path.getmtime(os.path.join(model_path, f)))]
+            for f in files}
+
+
+def artifact_key(model_path: str, load_kwargs: Dict[str, Any], revision: Optional[str] = None) -> str:
+    """Ключ: путь/HF id модели, revision, dtype и quantization config (+ версия transformers)."""
+    raw = json.dumps({
+        "model_path": model_path,
+        "revision": revision or "main",
+        "source": _source_fingerprint(model_path),
+        "torch_dtype": _jsonable(load_kwargs.get("torch_dtype")),
+        "quantization_config": _jsonable(load_kwargs.get("quantization_config")),
+        "transformers": transformers.__version__,
+    }, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def artifact_path(key: str, cache_dir: Optional[str] = None) -> str:
+    return os.path.join(cache_dir or settings.artifact_cache_dir, key)
+
+
+def needs_artifact(load_kwargs: Dict[str, Any]) -> bool:
+    """
+    Кэшировать есть смысл, только если загрузка пересчитывает веса — квантизация (quantization_config).
+    Смена dtype не кэшируется: каст при загрузке дешёвый, а артефакт был бы полной копией весов
+    (fp32 копия 7B модели — ~28 GB на диске).
+    """
+    return load_kwargs.get("quantization_config") is not None
+
+
+def _save_artifact(model, path: str, manifest: Dict[str, Any]):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    try:
+        shutil.rmtree(tmp, ignore_errors=True)
+        model.save_pretrained(tmp, safe_serialization=True)
+        with open(os.path.join(tmp, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        logger.info(f"[ArtifactCache] Saved artifact for {manifest['model_path']} to {path}")
+    except Exception as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        logger.warning(f"[ArtifactCache] Failed to save artifact for {manifest['model_path']}: {e}")
+
+
+def load_causal_lm(model_path: str, load_kwargs: Dict[str, Any], revision: Optional[str] = None,
+                   enabled: Optional[bool] = None, cache_dir: Optional[str] = None, **extra):
+    """
+    AutoModelForCausalLM.from_pretrained через кэш артефактов:
+    - артефакт есть — веса уже квантизованы, safetensors читаются через mmap
+    - нет — обычная загрузка (с квантизацией), затем save_pretrained(safe_serialization=True) в кэш
+    extra — прочие kwargs from_pretrained (trust_remote_code и т.п.).
+    """
+    enabled = settings.artifact_cache_enabled if enabled is None else enabled
+    if revision:
+        extra["revision"] = revision
+    if not enabled or not needs_artifact(load_kwargs):
+        return AutoModelForCausalLM.from_pretrained(model_path, **load_kwargs, **extra)
+
+    key = artifact_key(model_path, load_kwargs, revision)
+    path = artifact_path(key, cache_dir)
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        # quantization_config уже записан в config.json артефакта
+        cached_kwargs = {k: v for k, v in load_kwargs.items() if k != "quantization_config"}
+        cached_extra = {k: v for k, v in extra.items() if k != "revision"}
+        try:
+            model = AutoModelForCausalLM.from_pretrained(path, **cached_kwargs, **cached_extra)
+            logger.info(f"[ArtifactCache] Loaded {model_path} from artifact {key}")
+            return model
+        except Exception as e:
+            logger.warning(f"[ArtifactCache] Artifact {key} is unusable ({e}), rebuilding")
+            shutil.rmtree(path, ignore_errors=True)
+
+    model = AutoModelForCausalLM.from_pretrained(model_path, **load_kwargs, **extra)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _save_artifact(model, path, {
+        "model_path": model_path,
+        "revision": revision,
+        "torch_dtype": _jsonable(load_kwargs.get("torch_dtype")),
+        "quantization_config": _jsonable(load_kwargs.get("quantization_config")),
+        "transformers": transformers.__version__,
+    })
+    return model
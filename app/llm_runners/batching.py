@@ -0,0 +1,308 @@
+# app/llm_runners/batching.py
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from core.logging import get_logger
+from llm_runners.cancellation import CancellationToken, GenerationCancelled
+
+logger = get_logger(__name__)
+
+# kwargs generate, которые планировщик воспроизводит сам; с любыми другими запрос идёт в model.generate
+BATCHED_GENERATE_KWARGS = {
+    "max_new_tokens", "do_sample", "temperature", "top_p", "top_k", "repetition_penalty",
+}
+
+
+@dataclass
+class _Sequence:
+    """Одна генерация внутри общего батча."""
+    prompt: str
+    input_ids: List[int]
+    max_new_tokens: int
+    do_sample: bool
+    temperature: float
+    top_p: float
+    top_k: int
+    repetition_penalty: float
+    future: Future
+    cancel_token: Optional[CancellationToken] = None
+    generated: List[int] = field(default_factory=list)
+    t_submit: float = field(default_factory=time.monotonic)
+    t_admit: Optional[float] = None
+
+
+def _to_legacy(past) -> Tuple[Tuple[torch.Tensor, torch.Tensor], ...]:
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+    return past
+
+
+def _left_pad(t: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    pad = length - t.shape[dim]
+    if pad <= 0:
+        return t
+    shape = list(t.shape)
+    shape[dim] = pad
+    return torch.cat([t.new_zeros(shape), t], dim=dim)
+
+
+class ContinuousBatchScheduler:
+    """
+    Continuous batching для HF causal-моделей:
+    - Все in-flight запросы раннера декодируются одним padded-батчем (один forward на шаг)
+    - Новые последовательности принимаются на границе decode-шага (prefill + merge KV-кэша);
+      в том же шаге уже активные получают свой decode, поэтому поток новых запросов их не останавливает
+    - Sampling как у HF generate: repetition_penalty, temperature, top_k, top_p (BATCHED_GENERATE_KWARGS)
+    - Завершённые (EOS / max_new_tokens) сразу вытесняются из батча
+    - Каждый вызывающий получает свой Future с текстом и usage
+    """
+    def __init__(self, model, tokenizer, device, max_batch_size: int = 8, name: str = ""):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.name = name
+        self.eos_token_id = tokenizer.eos_token_id
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else self.eos_token_id
+        self._pending: Deque[_Sequence] = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        # Состояние текущего батча (живёт только в потоке планировщика)
+        self._active: List[_Sequence] = []
+        self._past = None
+        self._attn: Optional[torch.Tensor] = None
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+        logger.info(f"[Batcher] Started for model={name}, max_batch_size={self.max_batch_size}")
+
+    @staticmethod
+    def supports(gen_kwargs: Dict[str, Any]) -> bool:
+        """Можно ли выполнить генерацию с такими kwargs в общем батче без расхождения с model.generate."""
+        return all(k in BATCHED_GENERATE_KWARGS for k in gen_kwargs)
+
+    def submit(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **gen_kwargs) -> Future:
+        """Поставить prompt в очередь. Результат: {"text", "usage"}; отмена -> GenerationCancelled."""
+        unsupported = set(gen_kwargs) - BATCHED_GENERATE_KWARGS
+        if unsupported:
+            raise ValueError(f"Not supported by continuous batching: {', '.join(sorted(unsupported))}")
+        future: Future = Future()
+        input_ids = self.tokenizer.encode(prompt)
+        seq = _Sequence(
+            prompt=prompt,
+            input_ids=input_ids,
+            max_new_tokens=int(gen_kwargs.get("max_new_tokens") or 256),
+            do_sample=bool(gen_kwargs.get("do_sample", True)),
+            temperature=float(gen_kwargs.get("temperature") or 0.0),
+            top_p=float(gen_kwargs.get("top_p") or 1.0),
+            top_k=int(gen_kwargs.get("top_k") or 0),
+            repetition_penalty=float(gen_kwargs.get("repetition_penalty") or 1.0),
+            future=future,
+            cancel_token=cancel_token,
+        )
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError(f"Batch scheduler for {self.name} is stopped")
+            self._pending.append(seq)
+            self._cond.notify()
+        return future
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    # --- цикл планировщика ---
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._active and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    pending = list(self._pending) + self._active
+                    self._pending.clear()
+                    break
+                admitted = []
+                while self._pending and len(self._active) + len(admitted) < self.max_batch_size:
+                    seq = self._pending.popleft()
+                    if seq.cancel_token and seq.cancel_token.cancelled:
+                        seq.future.set_exception(GenerationCancelled())
+                        continue
+                    admitted.append(seq)
+            if not admitted and not self._active:
+                continue
+            try:
+                with torch.inference_mode():
+                    if admitted:
+                        self._admit(admitted)
+                        # Завершённые сразу после prefill (max_new_tokens=1, EOS) не должны попасть в decode
+                        self._evict_finished()
+                    if self._active:
+                        self._decode_step()
+                self._evict_finished()
+            except Exception as e:
+                logger.exception(f"[Batcher] Step failed for model={self.name}")
+                for seq in self._active + admitted:
+                    if not seq.future.done():
+                        seq.future.set_exception(e)
+                self._reset_batch()
+        for seq in pending:
+            if not seq.future.done():
+                seq.future.set_exception(RuntimeError("Batch scheduler stopped"))
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._active = []
+        self._past = None
+        self._attn = None
+
+    def _admit(self, admitted: List[_Sequence]):
+        """Prefill новых последовательностей и слияние с текущим батчем."""
+        now = time.monotonic()
+        max_len = max(len(s.input_ids) for s in admitted)
+        ids = torch.full((len(admitted), max_len), self.pad_token_id, dtype=torch.long)
+        attn = torch.zeros((len(admitted), max_len), dtype=torch.long)
+        for i, seq in enumerate(admitted):
+            seq.t_admit = now
+            n = len(seq.input_ids)
+            ids[i, max_len - n:] = torch.tensor(seq.input_ids, dtype=torch.long)
+            attn[i, max_len - n:] = 1
+        ids = ids.to(self.model.device)
+        attn = attn.to(self.model.device)
+        position_ids = (attn.cumsum(-1) - 1).clamp(min=0)
+        out = self.model(
+            input_ids=ids,
+            attention_mask=attn,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+        new_past = _to_legacy(out.past_key_values)
+        next_tokens = self._sample(out.logits[:, -1, :], admitted)
+        for seq, tok in zip(admitted, next_tokens):
+            seq.generated.append(tok)
+
+        if not self._active:
+            self._active = list(admitted)
+            self._past = new_past
+            self._attn = attn
+            return
+        # Выравниваем KV-кэши по длине (левый паддинг) и склеиваем по batch
+        old_len = self._attn.shape[1]
+        length = max(old_len, max_len)
+        merged = []
+        for (k_old, v_old), (k_new, v_new) in zip(self._past, new_past):
+            merged.append((
+                torch.cat([_left_pad(k_old, length, 2), _left_pad(k_new, length, 2)], dim=0),
+                torch.cat([_left_pad(v_old, length, 2), _left_pad(v_new, length, 2)], dim=0),
+            ))
+        self._past = tuple(merged)
+        self._attn = torch.cat([_left_pad(self._attn, length, 1), _left_pad(attn, length, 1)], dim=0)
+        self._active.extend(admitted)
+
+    def _decode_step(self):
+        """Один decode-шаг для всех активных последовательностей."""
+        last = torch.tensor([[s.generated[-1]] for s in self._active], dtype=torch.long, device=self.model.device)
+        attn = torch.cat([self._attn, self._attn.new_ones((len(self._active), 1))], dim=1)
+        position_ids = (attn.sum(-1, keepdim=True) - 1)
+        out = self.model(
+            input_ids=last,
+            attention_mask=attn,
+            position_ids=position_ids,
+            past_key_values=DynamicCache.from_legacy_cache(self._past),
+            use_cache=True,
+        )
+        self._past = _to_legacy(out.past_key_values)
+        self._attn = attn
+        next_tokens = self._sample(out.logits[:, -1, :], self._active)
+        for seq, tok in zip(self._active, next_tokens):
+            seq.generated.append(tok)
+
+    def _is_finished(self, seq: _Sequence) -> bool:
+        return (
+            (seq.cancel_token is not None and seq.cancel_token.cancelled)
+            or (self.eos_token_id is not None and seq.generated and seq.generated[-1] == self.eos_token_id)
+            or len(seq.generated) >= seq.max_new_tokens
+        )
+
+    def _evict_finished(self):
+        keep = []
+        for i, seq in enumerate(self._active):
+            if self._is_finished(seq):
+                self._finish(seq)
+            else:
+                keep.append(i)
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self._reset_batch()
+            return
+        index = torch.tensor(keep, dtype=torch.long, device=self._attn.device)
+        self._active = [self._active[i] for i in keep]
+        self._attn = self._attn.index_select(0, index)
+        self._past = tuple(
+            (k.index_select(0, index), v.index_select(0, index)) for k, v in self._past
+        )
+        # Обрезаем колонки, которые стали паддингом для всех оставшихся
+        used = self._attn.any(dim=0).nonzero()
+        start = int(used[0]) if used.numel() else 0
+        if start > 0:
+            self._attn = self._attn[:, start:]
+            self._past = tuple((k[:, :, start:, :], v[:, :, start:, :]) for k, v in self._past)
+
+    def _finish(self, seq: _Sequence):
+        if seq.cancel_token is not None and seq.cancel_token.cancelled:
+            # Отменённая последовательность освобождает слот батча на этом же шаге
+            if not seq.future.done():
+                seq.future.set_exception(GenerationCancelled())
+            return
+        t_end = time.monotonic()
+        output = self.tokenizer.decode(seq.generated, skip_special_tokens=True)
+        if not seq.future.done():
+            seq.future.set_result({
+                # Как и pipeline("text-generation"): prompt + продолжение
+                "text": seq.prompt + output,
+                "usage": {
+                    "tokens_prompt": len(seq.input_ids),
+                    "tokens_result": len(seq.generated),
+                    "latency_ms": int((t_end - seq.t_submit) * 1000),
+                    "queue_ms": int(((seq.t_admit or t_end) - seq.t_submit) * 1000),
+                },
+            })
+
+    def _sample(self, logits: torch.Tensor, seqs: List[_Sequence]) -> List[int]:
+        """Порядок как у logits processors HF generate: repetition_penalty, затем temperature, top_k, top_p."""
+        tokens = []
+        logits = logits.float()
+        for row, seq in zip(logits, seqs):
+            if seq.repetition_penalty != 1.0:
+                seen = torch.tensor(seq.input_ids + seq.generated, dtype=torch.long, device=row.device).unique()
+                score = row[seen]
+                row = row.clone()
+                row[seen] = torch.where(score < 0, score * seq.repetition_penalty, score / seq.repetition_penalty)
+            if not seq.do_sample or seq.temperature <= 0:
+                tokens.append(int(row.argmax()))
+                continue
+            row = row / seq.temperature
+            if 0 < seq.top_k < row.shape[-1]:
+                kth = torch.topk(row, seq.top_k).values[-1]
+                row = row.masked_fill(row < kth, float("-inf"))
+            probs = torch.softmax(row, dim=-1)
+            if seq.top_p < 1.0:
+                sorted_probs, sorted_idx = probs.sort(descending=True)
+                cumulative = sorted_probs.cumsum(-1)
+                cutoff = cumulative - sorted_probs > seq.top_p
+                sorted_probs[cutoff] = 0.0
+                probs = torch.zeros_like(probs).scatter(0, sorted_idx, sorted_probs)
+            tokens.append(int(torch.multinomial(probs / probs.sum(), 1)))
+        return tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"active": len(self._active), "pending": len(self._pending)}
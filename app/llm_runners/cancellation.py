@@ -0,0 +1,26 @@
+# app/llm_runners/cancellation.py
+import threading
+
+
+class GenerationCancelled(Exception):
+    """Генерация прервана (клиент отключился или запрос отменён)."""
+
+
+class CancellationToken:
+    """
+    Thread-safe флаг отмены: выставляется из event loop,
+    проверяется раннером в потоке генерации на каждом decode-шаге.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise GenerationCancelled()
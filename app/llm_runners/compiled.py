@@ -0,0 +1,104 @@
+# app/llm_runners/compiled.py
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+import torch
+from transformers import CompileConfig, StaticCache, StoppingCriteria
+
+# Длины static KV-кэша (prompt + max_new_tokens округляется вверх до ближайшей):
+# каждая длина — отдельный скомпилированный граф decode-шага, поэтому их немного
+DEFAULT_CACHE_BUCKETS = (256, 512, 1024, 2048)
+
+
+def cache_bucket(length: int, buckets: Sequence[int]) -> Optional[int]:
+    """Наименьший bucket >= length; None — запрос длиннее самого большого bucket'а (идёт eager-путём)."""
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    return None
+
+
+def enable_compile(model, buckets: Sequence[int], mode: Optional[str] = None, fullgraph: bool = True):
+    """
+    Включить в model.generate() компиляцию decode-шага через generation_config.compile_config.
+    HF компилирует forward только для шагов decode и только со static (compileable) кэшем:
+    prefill и обычные вызовы с DynamicCache остаются eager.
+    """
+    if not getattr(model, "_supports_static_cache", False):
+        raise RuntimeError(f"{type(model).__name__} does not support static KV cache")
+    quantizer = getattr(model, "hf_quantizer", None)
+    if quantizer is not None and not quantizer.is_compileable:
+        raise RuntimeError(f"quantization {type(quantizer).__name__} is not compatible with torch.compile")
+    on_cuda = model.device.type == "cuda"
+    # reduce-overhead = CUDA graphs; на CPU от них толку нет
+    config = CompileConfig(fullgraph=fullgraph, dynamic=False, mode=mode or ("reduce-overhead" if on_cuda else "default"))
+    # По умолчанию HF авто-компилирует только на CUDA
+    config._compile_all_devices = not on_cuda
+    model.generation_config.compile_config = config
+    # Граф на каждый bucket (с запасом), иначе после cache_size_limit перекомпиляций dynamo откатится в eager
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 2 * len(buckets) + 2)
+    return config
+
+
+class StaticCachePool:
+    """
+    Переиспользуемые StaticCache по bucket'ам: адреса тензоров кэша стабильны между запросами
+    (нужно CUDA graphs), а одновременные генерации получают разные экземпляры.
+    """
+    def __init__(self, model, buckets: Sequence[int]):
+        self.model = model
+        self.buckets: List[int] = sorted(int(b) for b in buckets)
+        self._free: Dict[int, List[StaticCache]] = {b: [] for b in self.buckets}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, bucket: int):
+        with self._lock:
+            free = self._free[bucket]
+            cache = free.pop() if free else None
+        if cache is None:
+            cache = StaticCache(
+                config=self.model.config,
+                max_batch_size=1,
+                max_cache_len=bucket,
+                device=self.model.device,
+                dtype=self.model.dtype,
+            )
+        try:
+            yield cache
+        finally:
+            cache.reset()
+            with self._lock:
+                self._free[bucket].append(cache)
+
+    def clear(self):
+        with self._lock:
+            self._free = {b: [] for b in self.buckets}
+
+
+class DecodeTimer(StoppingCriteria):
+    """
+    Время decode-шагов одной генерации: stopping criteria вызываются после каждого шага,
+    первый вызов — после prefill, поэтому decode = от первого до последнего вызова.
+    Для speculative/assisted decoding шаг даёт несколько токенов — там не используется.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.t_first = None
+        self.t_last = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        now = time.perf_counter()
+        if self.t_first is None:
+            self.t_first = now
+        self.t_last = now
+        self.calls += 1
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
+    @property
+    def ms_per_token(self) -> Optional[float]:
+        if self.calls < 2:
+            return None
+        return round((self.t_last - self.t_first) * 1000 / (self.calls - 1), 3)
@@ -0,0 +1,145 @@
+# app/llm_runners/hf_family.py
+import glob
+import os
+import re
+from typing import Any, Dict, Optional
+
+import psutil
+import torch
+from transformers import BitsAndBytesConfig
+
+from core.logging import get_logger
+from llm_runners.transformers import TransformersRunner
+
+logger = get_logger(__name__)
+
+# Запас RAM/VRAM сверх размера весов: активации, KV-кэш, фрагментация
+MEMORY_HEADROOM = 1.2
+
+
+class HFFamilyRunner(TransformersRunner):
+    """
+    Общая база семейств HF-моделей (DeepSeek, Mistral, CodeLlama, StarCoder, Llama2):
+    - тот же async generate/generate_stream, batching, кэши и метрики, что у TransformersRunner
+    - выбор конфигурации загрузки под VRAM (fp16 / 8bit / 4bit с CPU offload) и RAM (fp32 / bf16 на CPU)
+    - params.torch_dtype, device_map, quantization_config переопределяют автоматический выбор;
+      params.cpu_quantization: 4bit — bitsandbytes 4bit на CPU
+    - build_prompt / generate_pipeline для генерации Jenkinsfile по описанию проекта
+    Наследники задают только family, default_model_id и params_b (размер модели в млрд параметров).
+    """
+    family = "HF model"
+    default_model_id: Optional[str] = None
+    # Для оценки памяти, если весов нет на диске (HF id)
+    params_b = 7.0
+    min_vram_gb = 4
+    trust_remote_code = True
+
+    def __init__(self, cfg):
+        if not cfg.model_path and self.default_model_id:
+            cfg = cfg.model_copy(update={"model_path": self.default_model_id})
+        super().__init__(cfg)
+
+    def _weights_gb(self, bytes_per_param: int) -> float:
+        """Размер весов в заданной точности: по safetensors на диске (считаются как fp16/bf16) или по params_b."""
+        files = glob.glob(os.path.join(self.cfg.model_path, "*.safetensors")) if os.path.isdir(self.cfg.model_path) else []
+        if files:
+            return sum(os.path.getsize(f) for f in files) / 2 * bytes_per_param / (1024 ** 3)
+        return self.params_b * bytes_per_param
+
+    def _select_load_kwargs(self, params: dict) -> Dict[str, Any]:
+        device = self.device
+        vram_gb = self._vram_gb()
+        logger.info(f"[{type(self).__name__}] Выбор конфигурации загрузки. Устройство: {device.type}, VRAM: {vram_gb:.1f} GB.")
+        if device.type == "cuda":
+            if vram_gb >= max(12, self._weights_gb(2) * MEMORY_HEADROOM):
+                load_kwargs = {"torch_dtype": torch.float16, "device_map": "auto"}
+                logger.info("CUDA: torch.float16, device_map='auto'. Вся модель влезет на GPU.")
+            elif vram_gb >= 6:
+                load_kwargs = {
+                    "device_map": "auto",
+                    "quantization_config": BitsAndBytesConfig(load_in_8bit=True, llm_int8_enable_fp32_cpu_offload=True),
+                }
+                logger.info("CUDA 6-12GB: 8bit quant, device_map='auto', CPU offload.")
+            elif vram_gb >= self.min_vram_gb:
+                load_kwargs = {
+                    "device_map": "auto",
+                    "quantization_config": BitsAndBytesConfig(
+                        load_in_4bit=True,
+                        bnb_4bit_compute_dtype=torch.float16,
+                        bnb_4bit_use_double_quant=True,
+                        llm_int8_enable_fp32_cpu_offload=True,
+                    ),
+                }
+                logger.info("CUDA 4-6GB: 4bit quant, агрессивный CPU offload.")
+            else:
+                err_msg = (f"VRAM слишком мало ({vram_gb:.1f} GB). {self.family} требует минимум "
+                           f"{self.min_vram_gb}GB (4bit quant).")
+                logger.error(err_msg)
+                raise RuntimeError(err_msg)
+        elif device.type == "mps":
+            load_kwargs = {"torch_dtype": torch.float16, "device_map": "mps"}
+            logger.info("Конфигурация для MPS: torch.float16, device_map='mps'.")
+        elif params.get("cpu_quantization") == "4bit":
+            load_kwargs = {
+                "device_map": "cpu",
+                "quantization_config": BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_compute_dtype=torch.float32,
+                    bnb_4bit_use_double_quant=True,
+                ),
+            }
+            logger.info("CPU: 4bit quant через BitsAndBytes (медленно, но экономно).")
+        else:
+            # CPU: fp32 быстрее всего, если влезает в RAM; иначе bf16 (вдвое меньше)
+            ram_gb = psutil.virtual_memory().total / (1024 ** 3)
+            if self._weights_gb(4) * MEMORY_HEADROOM <= ram_gb:
+                load_kwargs = {"torch_dtype": torch.float32, "device_map": "cpu"}
+                logger.info(f"CPU: fp32, RAM {ram_gb:.1f} GB.")
+            else:
+                load_kwargs = {"torch_dtype": torch.bfloat16, "device_map": "cpu"}
+                logger.info(f"CPU: bf16, fp32 не влезает в RAM {ram_gb:.1f} GB.")
+                if self._weights_gb(2) * MEMORY_HEADROOM > ram_gb:
+                    logger.warning(f"Очень мало RAM для {self.family} на CPU ({ram_gb:.1f} GB). Возможен OutOfMemory!")
+        return self._explicit_load_kwargs(params, load_kwargs)
+
+    def build_prompt(self, request: dict) -> str:
+        instruction = request.get("instruction", "Generate a Jenkins pipeline for the given project configuration")
+        project = request.get("input", {}).get("project", {})
+        parts = [instruction.strip(), ""]
+        if project.get("type"):
+            parts.append(f"Project type: {project['type']}")
+        if project.get("buildTool"):
+            parts.append(f"Build tool: {project['buildTool']}")
+        if "testFrameworks" in project and project["testFrameworks"]:
+            parts.append(f"Test frameworks: {', '.join(project['testFrameworks'])}")
+        if "dockerfilePresent" in project:
+            parts.append(f"Dockerfile present: {project['dockerfilePresent']}")
+        if "files" in project:
+            files_short = ', '.join(project["files"][:5])
+            if len(project["files"]) > 5:
+                files_short += f", ... (+{len(project['files'])-5} files)"
+            parts.append(f"Project files: {files_short}")
+        if "dependencies" in project and project["dependencies"]:
+            deps_short = ', '.join(project["dependencies"][:8])
+            if len(project["dependencies"]) > 8:
+                deps_short += f", ... (+{len(project['dependencies'])-8} deps)"
+            parts.append(f"Dependencies: {deps_short}")
+        if "scripts" in project and project["scripts"]:
+            script_lines = []
+            for name, scripts in project["scripts"].items():
+                script_lines.append(f"{name.capitalize()} (unix): {scripts.get('unix','')}; (windows): {scripts.get('windows','')}")
+            parts.append("Project scripts:\n" + "\n".join(script_lines))
+        prompt = "\n".join(parts).strip()
+        logger.debug(f"Собран промпт для {self.family}:\n{prompt}")
+        return prompt
+
+    async def generate_pipeline(self, request: dict, **gen_kwargs) -> str:
+        result = await self.generate(self.build_prompt(request), **gen_kwargs)
+        return self._extract_pipeline_code(result["text"])
+
+    @staticmethod
+    def _extract_pipeline_code(text: str) -> str:
+        match = re.search(r'(pipeline\s*\{.*)', text, flags=re.DOTALL)
+        if match:
+            return match.group(1).strip()
+        return text.strip()
@@ -0,0 +1,103 @@
+# app/llm_runners/kv_prefix_cache.py
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Короче этого prefill экономит меньше, чем стоит копирование кэша
+MIN_PREFIX_TOKENS = 8
+
+
+class _Entry:
+    def __init__(self, ids: List[int], past, nbytes: int):
+        self.ids = ids
+        self.past = past  # legacy tuple ((k, v), ...) — не мутируется
+        self.nbytes = nbytes
+
+
+class PrefixKVCache:
+    """
+    Предпосчитанные past_key_values для фиксированных префиксов prompt'а (HF causal LM).
+    - Префиксы: заголовки PROMPT_TEMPLATES, инструкция build_prompt и params.prefix_cache_prefixes
+    - Ограничен по памяти (LRU по байтам тензоров)
+    - Живёт вместе с загруженной моделью: при reload создаётся заново
+    """
+    def __init__(self, prefixes: Sequence[str], max_bytes: int):
+        # Длинные префиксы проверяем первыми
+        self.prefixes = sorted(set(prefixes), key=len, reverse=True)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def find_prefix(self, prompt: str) -> Optional[str]:
+        return next((p for p in self.prefixes if prompt.startswith(p)), None)
+
+    def _build(self, model, tokenizer, prefix: str) -> Optional[_Entry]:
+        ids = tokenizer(prefix, return_tensors="pt").input_ids.to(model.device)
+        if ids.shape[1] < MIN_PREFIX_TOKENS:
+            return None
+        with torch.inference_mode():
+            out = model(input_ids=ids, use_cache=True)
+        past = out.past_key_values
+        if hasattr(past, "to_legacy_cache"):
+            past = past.to_legacy_cache()
+        nbytes = sum(t.numel() * t.element_size() for layer in past for t in layer)
+        logger.info(f"[PrefixKVCache] Built prefix of {ids.shape[1]} tokens ({nbytes / 2**20:.1f} MB)")
+        return _Entry(ids[0].tolist(), past, nbytes)
+
+    def _get_or_build(self, model, tokenizer, prefix: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is not None:
+                self._entries.move_to_end(prefix)
+                return entry
+        # Один поток строит, остальные ждут готовый результат
+        with self._build_lock:
+            with self._lock:
+                entry = self._entries.get(prefix)
+            if entry is not None:
+                return entry
+            entry = self._build(model, tokenizer, prefix)
+            if entry is None or entry.nbytes > self.max_bytes:
+                return entry
+            with self._lock:
+                self._entries[prefix] = entry
+                self._bytes += entry.nbytes
+                while self._bytes > self.max_bytes and self._entries:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+            return entry
+
+    def lookup(self, model, tokenizer, prompt: str, input_ids: Sequence[int]) -> Optional[Tuple[DynamicCache, int]]:
+        """
+        Свежий DynamicCache с префиксом prompt'а и длина префикса в токенах, либо None.
+        input_ids — токены полного prompt'а (их начало должно совпасть с токенами префикса).
+        """
+        prefix = self.find_prefix(prompt)
+        if prefix is None:
+            return None
+        entry = self._get_or_build(model, tokenizer, prefix)
+        n = len(entry.ids) if entry else 0
+        # На стыке префикс/суффикс токенизация может слиться — тогда кэш неприменим
+        if not entry or len(input_ids) <= n or list(input_ids[:n]) != entry.ids:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # from_legacy_cache не копирует тензоры, но generate() только дописывает (torch.cat),
+        # поэтому закэшированный префикс остаётся нетронутым
+        return DynamicCache.from_legacy_cache(entry.past), n
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
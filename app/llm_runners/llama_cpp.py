@@ -1,104 +1,206 @@
 import asyncio
+import contextlib
 import time
 from threading import RLock
+from typing import Optional
+from llm_runners.cancellation import CancellationToken, GenerationCancelled
+from llm_runners.llama_pool import LlamaContextPool, effective_pool_size
+from llm_runners.llama_state_cache import LlamaPrefixStateCache, restore_prefix
+from llm_runners.speculative import CountingPromptLookup
+from llm_runners.streaming import stream_from_thread
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# params, передаваемые в Llama как есть (подбираются scripts/tune_llama_cpp.py)
+LLAMA_TUNING_PARAMS = ("n_batch", "n_threads_batch", "use_mlock", "numa")
 
 class LlamaCppRunner:
     """
     Production-ready llama.cpp runner:
-    - Поддержка hot-reload
+    - Hot-reload: LLMService грузит новый экземпляр в фоне и подменяет его атомарно (double buffering)
     - Thread-safe и async
     - Интеграция с метриками
     - Авто-оптимизация ресурсов
+    - Кэш prefill-состояния общих префиксов prompt'а (params.prefix_cache, prefix_cache_ram_mb,
+      prefix_cache_dir, prefix_cache_disk_mb, prefix_cache_prefixes)
+    - Prompt lookup decoding: черновик из n-грамм prompt'а (params.prompt_lookup_num_tokens,
+      prompt_lookup_max_ngram)
+    - Пул контекстов (params.pool_size, n_ctx на контекст): параллельные генерации на общих mmap-весах,
+      каждый запрос берёт свой контекст; без params.max_concurrency admission пускает pool_size запросов.
+      С n_gpu_layers пул — один контекст (GPU-слои дублировались бы в VRAM каждым контекстом)
     """
+    # Свой executor и доля ядер CPU от CpuBudgetManager (выставляет LLMService)
+    executor = None
+    cpu_allocation = None
+
     def __init__(self, cfg):
         self.cfg = cfg
+        self.pool: Optional[LlamaContextPool] = None
+        # Первый контекст пула: tokenize и прочие вызовы без генерации
         self.model = None
+        self.prefix_cache: Optional[LlamaPrefixStateCache] = None
+        self.prefixes = []
+        self.prompt_lookup: Optional[CountingPromptLookup] = None
         self._lock = RLock()
         self._load_model()
-        from core.config import config_store
-        config_store.subscribe(self._on_config_change)
-
-    def _on_config_change(self, _):
-        asyncio.create_task(self.reload())
-
-    async def reload(self):
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, self._reload_sync)
 
-    def _reload_sync(self):
+    def unload(self):
+        """Освободить контекст и веса (вытеснение из RunnerRegistry)."""
         with self._lock:
-            self._load_model()
+            if self.pool is not None:
+                self.pool.close()
+            if self.prefix_cache:
+                self.prefix_cache.clear_ram()
+            self.pool = self.model = None
+            self.prefix_cache = None
+        logger.info(f"[LlamaCppRunner] Unloaded {self.cfg.name}")
 
     def _load_model(self):
         from llama_cpp import Llama
         with self._lock:
             params = dict(self.cfg.params or {})
-            # авто-детект числа потоков (можно расширить)
+            pool_size = effective_pool_size(params)
+            if pool_size < int(params.get("pool_size", 1) or 1):
+                logger.warning(f"[LlamaCppRunner] {self.cfg.name}: pool_size={params['pool_size']} capped to "
+                               f"{pool_size} because n_gpu_layers={params['n_gpu_layers']} (each context would "
+                               f"hold its own copy of the offloaded layers in VRAM)")
+            # авто-детект числа потоков: ядра делятся между контекстами пула
             import os
             if "n_threads" not in params:
                 try:
-                    params["n_threads"] = min(os.cpu_count() or 8, 16)
+                    params["n_threads"] = max(1, min(os.cpu_count() or 8, 16) // pool_size)
                 except Exception:
                     params["n_threads"] = 8
+            self.prompt_lookup = None
+            if params.get("prompt_lookup_num_tokens"):
+                from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+                self.prompt_lookup = CountingPromptLookup(LlamaPromptLookupDecoding(
+                    num_pred_tokens=int(params["prompt_lookup_num_tokens"]),
+                    max_ngram_size=int(params.get("prompt_lookup_max_ngram", 2)),
+                ))
             # поддержка других параметров: n_ctx, n_gpu_layers и т.д.
-            self.model = Llama(
+            # use_mmap: все контексты пула читают одни и те же страницы GGUF из page cache
+            self.pool = LlamaContextPool(lambda: Llama(
                 model_path=self.cfg.model_path,
                 n_ctx=params.get("n_ctx", 4096),
                 n_threads=params.get("n_threads", 8),
-                n_gpu_layers=params.get("n_gpu_layers", 0)
-            )
+                n_gpu_layers=params.get("n_gpu_layers", 0),
+                use_mmap=True,
+                draft_model=self.prompt_lookup,
+                **{k: params[k] for k in LLAMA_TUNING_PARAMS if params.get(k) is not None},
+            ), pool_size)
+            self.model = self.pool.primary
+            logger.info(f"[LlamaCppRunner] {self.cfg.name}: {pool_size} context(s), "
+                        f"n_ctx={params.get('n_ctx', 4096)}, n_threads={params['n_threads']}")
+            self._init_prefix_cache(params)
+
+    def _init_prefix_cache(self, params):
+        if not params.get("prefix_cache", True):
+            self.prefix_cache = None
+            return
+        from rag.template import get_static_prefixes
+        self.prefixes = list(params.get("prefix_cache_prefixes") or []) + get_static_prefixes()
+        # Длинные префиксы проверяем первыми
+        self.prefixes.sort(key=len, reverse=True)
+        disk_mb = params.get("prefix_cache_disk_mb")
+        self.prefix_cache = LlamaPrefixStateCache(
+            model_path=self.cfg.model_path,
+            ram_budget_bytes=int(params.get("prefix_cache_ram_mb", 512)) * 1024 * 1024,
+            cache_dir=params.get("prefix_cache_dir"),
+            disk_budget_bytes=int(disk_mb) * 1024 * 1024 if disk_mb else None,
+        )
 
-    async def generate(self, prompt: str, **kwargs):
+    def _prepare_prefix(self, llm, prompt: str) -> int:
+        """Восстановить state общего префикса в контекст llm; ошибки кэша не должны ронять генерацию."""
+        if not self.prefix_cache:
+            return 0
+        try:
+            return restore_prefix(llm, self.prefix_cache, prompt, self.prefixes)
+        except Exception as e:
+            logger.warning(f"[LlamaCppRunner] Prefix cache skipped for {self.cfg.name}: {e}")
+            return 0
+
+    async def generate(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **kwargs):
         loop = asyncio.get_running_loop()
         # обработка параметров temperature, top_p, max_new_tokens
         def sync_gen():
             t_start = time.monotonic()
-            try:
-                result = self.model(
+            # Идём по stream'у, чтобы отмена срабатывала на границе токена
+            chunks = []
+            counting = self.prompt_lookup.counting() if self.prompt_lookup else contextlib.nullcontext()
+            with self.pool.checkout() as llm, counting as spec:
+                cached_tokens = self._prepare_prefix(llm, prompt)
+                for chunk in llm(
                     prompt,
                     max_tokens=kwargs.get("max_new_tokens", 256),
                     temperature=kwargs.get("temperature", getattr(self.cfg, "temperature", 0.7)),
-                    top_p=kwargs.get("top_p", getattr(self.cfg, "top_p", 0.95))
-                )
-                t_end = time.monotonic()
-                text = result["choices"][0]["text"]
-                # Токены (llama-cpp выдает stats)
-                prompt_tokens = result.get("usage", {}).get("prompt_tokens", 0)
-                result_tokens = result.get("usage", {}).get("completion_tokens", 0)
-                latency_ms = int((t_end - t_start) * 1000)
-                # Логируем метрики
-                try:
-                    from services.metrics_service import metrics_service
-                    asyncio.create_task(metrics_service.record_request(
-                        model=self.cfg.name,
-                        tokens=prompt_tokens + result_tokens,
-                        latency_ms=latency_ms
-                    ))
-                except Exception:
-                    pass
-                return text
-            except Exception as e:
-                # Логируем ошибку
-                try:
-                    from services.metrics_service import metrics_service
-                    asyncio.create_task(metrics_service.record_error(
-                        model=self.cfg.name
-                    ))
-                except Exception:
-                    pass
-                raise e
-        return await loop.run_in_executor(None, sync_gen)
-    
-    async def generate_stream(self, prompt: str, **kwargs):
-        loop = asyncio.get_running_loop()
+                    top_p=kwargs.get("top_p", getattr(self.cfg, "top_p", 0.95)),
+                    stream=True
+                ):
+                    if cancel_token and cancel_token.cancelled:
+                        break
+                    chunks.append(chunk["choices"][0]["text"])
+                prompt_tokens = len(llm.tokenize(prompt.encode("utf-8")))
+            t_end = time.monotonic()
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            res = {
+                "text": "".join(chunks),
+                "tokens_prompt": prompt_tokens,
+                # llama-cpp отдаёт по одному токену на чанк
+                "tokens_result": len(chunks),
+                "latency_ms": int((t_end - t_start) * 1000),
+                "tokens_prefix_cached": cached_tokens,
+            }
+            if spec is not None:
+                spec.new_tokens = len(chunks)
+                res.update(spec.usage("lookup"))
+            return res
+
+        from services.metrics_service import metrics_service
+        try:
+            res = await loop.run_in_executor(self.executor, sync_gen)
+        except GenerationCancelled:
+            raise
+        except Exception:
+            # Логируем ошибку
+            await metrics_service.record_error(model=self.cfg.name)
+            raise
+        # Логируем метрики
+        await metrics_service.record_request(
+            model=self.cfg.name,
+            tokens=res["tokens_prompt"] + res["tokens_result"],
+            latency_ms=res["latency_ms"]
+        )
+        if "lookup_drafted" in res:
+            await metrics_service.record_speculation(
+                model=self.cfg.name,
+                drafted=res["lookup_drafted"],
+                accepted=res["lookup_accepted"],
+                tokens_per_forward=res["lookup_tokens_per_forward"],
+                new_tokens=res["tokens_result"],
+                kind="lookup",
+            )
+        usage = {k: v for k, v in res.items() if k != "text"}
+        return {"text": res["text"], "usage": usage}
+
+    async def generate_stream(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **kwargs):
         def sync_stream():
-            for chunk in self.model(
-                prompt,
-                max_tokens=kwargs.get("max_new_tokens", 256),
-                temperature=kwargs.get("temperature", getattr(self.cfg, "temperature", 0.7)),
-                top_p=kwargs.get("top_p", getattr(self.cfg, "top_p", 0.95)),
-                stream=True
-            ):
-                yield chunk["choices"][0]["text"]
-        for chunk in await loop.run_in_executor(None, lambda: list(sync_stream())):
+            # Контекст занят до конца stream'а (или до закрытия генератора, если клиент ушёл)
+            with self.pool.checkout() as llm:
+                self._prepare_prefix(llm, prompt)
+                for chunk in llm(
+                    prompt,
+                    max_tokens=kwargs.get("max_new_tokens", 256),
+                    temperature=kwargs.get("temperature", getattr(self.cfg, "temperature", 0.7)),
+                    top_p=kwargs.get("top_p", getattr(self.cfg, "top_p", 0.95)),
+                    stream=True
+                ):
+                    if cancel_token and cancel_token.cancelled:
+                        return
+                    yield chunk["choices"][0]["text"]
+        # Чанки уходят клиенту по мере генерации, а не после неё.
+        # При закрытии генератора (клиент ушёл) мост сам прекращает итерацию stream'а.
+        async for chunk in stream_from_thread(sync_stream, executor=self.executor):
             yield chunk
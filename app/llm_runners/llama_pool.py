@@ -0,0 +1,89 @@
+# app/llm_runners/llama_pool.py
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def effective_pool_size(params) -> int:
+    """
+    Число контекстов пула: params.pool_size, но не больше 1 при n_gpu_layers != 0 —
+    выгруженные на GPU слои у каждого Llama свои, N контекстов держали бы N копий в VRAM.
+    """
+    pool_size = max(1, int(params.get("pool_size", 1) or 1))
+    if params.get("n_gpu_layers"):
+        return 1
+    return pool_size
+
+
+class LlamaContextPool:
+    """
+    Пул llama.cpp контекстов одной GGUF-модели:
+    - каждый Llama открывает файл через mmap (use_mmap по умолчанию), страницы весов в page cache общие,
+      поэтому N контекстов не дублируют веса в RAM — у каждого только свой KV-кэш (n_ctx) и буферы
+    - но каждый контекст — отдельная загрузка модели: старт и hot-swap идут ~N раз дольше, а слои,
+      выгруженные на GPU (n_gpu_layers), копируются в VRAM каждым контекстом; поэтому
+      при n_gpu_layers пул ограничен одним контекстом (effective_pool_size)
+    - запрос берёт свободный контекст через checkout() и держит его до конца генерации;
+      один контекст никогда не используется двумя потоками одновременно
+    - если все заняты, checkout ждёт освобождения (timeout — TimeoutError)
+    """
+    def __init__(self, factory: Callable[[], Any], size: int):
+        self.size = max(1, int(size))
+        self._contexts: List[Any] = []
+        self._free: List[Any] = []
+        self._cond = threading.Condition()
+        self.waits = 0
+        try:
+            for _ in range(self.size):
+                self._contexts.append(factory())
+        except Exception:
+            self.close()
+            raise
+        self._free = list(self._contexts)
+
+    @property
+    def primary(self):
+        """Контекст для операций без состояния генерации (tokenize/detokenize)."""
+        return self._contexts[0] if self._contexts else None
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if not self._free:
+                self.waits += 1
+            while not self._free:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No free llama.cpp context")
+                if not self._contexts:
+                    raise RuntimeError("llama.cpp context pool is closed")
+                self._cond.wait(remaining)
+            ctx = self._free.pop()
+        try:
+            yield ctx
+        finally:
+            with self._cond:
+                if ctx in self._contexts:
+                    self._free.append(ctx)
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            contexts, self._contexts, self._free = self._contexts, [], []
+            self._cond.notify_all()
+        for ctx in contexts:
+            if hasattr(ctx, "close"):
+                try:
+                    ctx.close()
+                except Exception as e:
+                    logger.warning(f"[LlamaContextPool] Failed to close context: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"size": self.size, "busy": len(self._contexts) - len(self._free), "waits": self.waits}
@@ -0,0 +1,179 @@
+# app/llm_runners/llama_state_cache.py
+import hashlib
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class LlamaPrefixStateCache:
+    """
+    Кэш llama.cpp state (KV + logits) для фиксированных префиксов prompt'а:
+    - ключ: hash(model_path + token ids префикса)
+    - RAM: LRU с бюджетом по байтам (LlamaState.llama_state_size)
+    - Disk (опционально): файлы в cache_dir, прогретые префиксы переживают рестарт.
+      Формат — np.savez без pickle: JSON-заголовок, input_ids, scores и сырые байты
+      llama state; читается с allow_pickle=False, поэтому подложенный в cache_dir
+      файл не может исполнить код
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, model_path: str, ram_budget_bytes: int, cache_dir: Optional[str] = None,
+                 disk_budget_bytes: Optional[int] = None):
+        self.model_path = model_path
+        self.ram_budget_bytes = ram_budget_bytes
+        self.cache_dir = cache_dir
+        self.disk_budget_bytes = disk_budget_bytes
+        self._ram: "OrderedDict[str, object]" = OrderedDict()
+        self._ram_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, tokens: Sequence[int]) -> str:
+        h = hashlib.sha1(self.model_path.encode("utf-8"))
+        h.update(",".join(map(str, tokens)).encode("ascii"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.llstate")
+
+    @staticmethod
+    def _size(state) -> int:
+        return int(getattr(state, "llama_state_size", 0) or 0)
+
+    def get(self, key: str):
+        with self._lock:
+            state = self._ram.get(key)
+            if state is not None:
+                self._ram.move_to_end(key)
+                self.hits += 1
+                return state
+        if self.cache_dir and os.path.exists(self._path(key)):
+            try:
+                state = self._read(self._path(key))
+                os.utime(self._path(key))
+                self._put_ram(key, state)
+                self.hits += 1
+                return state
+            except Exception as e:
+                logger.warning(f"[LlamaStateCache] Failed to read {self._path(key)}: {e}")
+        self.misses += 1
+        return None
+
+    def put(self, key: str, state):
+        self._put_ram(key, state)
+        if not self.cache_dir:
+            return
+        try:
+            tmp = self._path(key) + ".tmp"
+            self._write(tmp, state)
+            os.replace(tmp, self._path(key))
+            self._trim_disk()
+        except Exception as e:
+            logger.warning(f"[LlamaStateCache] Failed to write state for {key}: {e}")
+
+    def _write(self, path: str, state):
+        header = {
+            "format": self.FORMAT_VERSION,
+            "model_path": self.model_path,
+            "n_tokens": int(state.n_tokens),
+            "llama_state_size": int(state.llama_state_size),
+            "seed": getattr(state, "seed", None),
+        }
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                header=np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+                input_ids=np.asarray(state.input_ids),
+                scores=np.asarray(state.scores),
+                llama_state=np.frombuffer(bytes(state.llama_state), dtype=np.uint8),
+            )
+
+    def _read(self, path: str):
+        from llama_cpp import LlamaState
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            if header.get("format") != self.FORMAT_VERSION or header.get("model_path") != self.model_path:
+                raise ValueError(f"state file does not match this cache (header: {header})")
+            fields = {
+                "input_ids": data["input_ids"],
+                "scores": data["scores"],
+                "n_tokens": header["n_tokens"],
+                "llama_state": data["llama_state"].tobytes(),
+                "llama_state_size": header["llama_state_size"],
+                "seed": header.get("seed"),
+            }
+        # seed есть не во всех версиях llama-cpp-python
+        accepted = inspect.signature(LlamaState.__init__).parameters
+        return LlamaState(**{k: v for k, v in fields.items() if k in accepted})
+
+    def _put_ram(self, key: str, state):
+        size = self._size(state)
+        if size > self.ram_budget_bytes:
+            return
+        with self._lock:
+            if key in self._ram:
+                self._ram_bytes -= self._size(self._ram.pop(key))
+            self._ram[key] = state
+            self._ram_bytes += size
+            while self._ram_bytes > self.ram_budget_bytes and self._ram:
+                _, evicted = self._ram.popitem(last=False)
+                self._ram_bytes -= self._size(evicted)
+
+    def _trim_disk(self):
+        if not self.disk_budget_bytes:
+            return
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(".llstate")]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        for f in files:
+            if total <= self.disk_budget_bytes:
+                break
+            total -= os.path.getsize(f)
+            os.remove(f)
+
+    def clear_ram(self):
+        with self._lock:
+            self._ram.clear()
+            self._ram_bytes = 0
+
+
+def restore_prefix(model, cache: LlamaPrefixStateCache, prompt: str, prefixes: List[str]) -> int:
+    """
+    Подготовить контекст llama.cpp так, чтобы prefill шёл только по уникальному суффиксу.
+    Возвращает число токенов префикса, которые не придётся считать (0 — префикс не найден).
+    Вызывать в потоке, который затем сам вызовет model(prompt).
+    """
+    prefix = next((p for p in prefixes if prompt.startswith(p)), None)
+    if not prefix:
+        return 0
+    tokens = model.tokenize(prefix.encode("utf-8"), add_bos=True)
+    full = model.tokenize(prompt.encode("utf-8"), add_bos=True)
+    # На стыке префикс/суффикс токенизация может слиться — тогда кэш неприменим
+    if len(full) <= len(tokens) or list(full[:len(tokens)]) != list(tokens):
+        return 0
+    # Контекст уже содержит этот префикс (прошлый запрос) — llama.cpp переиспользует его сам
+    if model.n_tokens >= len(tokens) and list(model._input_ids[:len(tokens)]) == list(tokens):
+        return len(tokens)
+    key = cache.key(tokens)
+    state = cache.get(key)
+    if state is None:
+        model.reset()
+        model.eval(tokens)
+        state = model.save_state()
+        cache.put(key, state)
+        logger.info(f"[LlamaStateCache] Warmed prefix of {len(tokens)} tokens ({cache._size(state)} bytes)")
+    else:
+        model.load_state(state)
+    return len(tokens)
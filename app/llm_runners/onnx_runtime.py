@@ -0,0 +1,277 @@
+# app/llm_runners/onnx_runtime.py
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+import transformers
+from transformers import AutoTokenizer, StoppingCriteriaList, TextIteratorStreamer
+
+from core.logging import get_logger
+from core.settings import settings
+from llm_runners.artifact_cache import MANIFEST, _source_fingerprint
+from llm_runners.cancellation import CancellationToken
+from llm_runners.streaming import stream_from_thread
+from llm_runners.transformers import CancelOnTokenCriteria, TransformersRunner
+
+logger = get_logger(__name__)
+
+# Каталог экспортов внутри settings.artifact_cache_dir
+ONNX_SUBDIR = "onnx"
+QUANTIZED_SUFFIX = "quantized"
+
+
+def _cpu_flags() -> set:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def dynamic_quantization_config():
+    """Динамическая int8-квантизация (веса int8, активации квантуются на лету) под набор инструкций CPU."""
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    flags = _cpu_flags()
+    if "avx512_vnni" in flags:
+        return AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    if "avx512f" in flags:
+        return AutoQuantizationConfig.avx512(is_static=False, per_channel=False)
+    if "asimd" in flags:
+        return AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+    return AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+
+
+class OnnxRunner:
+    """
+    CPU-инференс через ONNX Runtime (optimum.onnxruntime):
+    - экспорт HF-модели в ONNX с KV-кэшем (use_cache), causal LM или seq2seq (params.seq2seq: true — CodeT5+)
+    - params.quantize: int8 — динамическая int8-квантизация экспортированных графов
+    - экспорт кэшируется в settings.artifact_cache_dir/onnx/<key>, повторный старт только грузит сессии
+    - params.n_threads — intra-op потоки ONNX Runtime, params.provider — execution provider
+    Интерфейс как у TransformersRunner: async generate/generate_stream, unload().
+    onnxruntime и optimum импортируются лениво (как Llama в LlamaCppRunner): без них не работают только модели type: onnx.
+    """
+    # Тот же белый список kwargs generate, что и у PyTorch-пути
+    filter_generate_kwargs = TransformersRunner.filter_generate_kwargs
+    # Свой executor и доля ядер CPU (выставляет LLMService)
+    executor = None
+    cpu_allocation = None
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        params = cfg.params or {}
+        self.seq2seq = bool(params.get("seq2seq", False))
+        self.quantize = str(params.get("quantize") or "").lower() in ("int8", "true", "1")
+        self.model = None
+        self.tokenizer = None
+        self._load()
+        logger.info(
+            f"[OnnxRunner] Initialized for model: {getattr(cfg, 'name', '<missing>')} at {cfg.model_path} "
+            f"(seq2seq={self.seq2seq}, int8={self.quantize})")
+
+    @property
+    def model_cls(self):
+        from optimum.onnxruntime import ORTModelForCausalLM, ORTModelForSeq2SeqLM
+        return ORTModelForSeq2SeqLM if self.seq2seq else ORTModelForCausalLM
+
+    def _export_key(self) -> str:
+        import optimum
+        raw = json.dumps({
+            "model_path": self.cfg.model_path,
+            "revision": (self.cfg.params or {}).get("revision") or "main",
+            "source": _source_fingerprint(self.cfg.model_path),
+            "seq2seq": self.seq2seq,
+            "quantize": self.quantize,
+            "optimum": optimum.__version__,
+            "transformers": transformers.__version__,
+        }, sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _export_dir(self) -> str:
+        return os.path.join(settings.artifact_cache_dir, ONNX_SUBDIR, self._export_key())
+
+    def _session_options(self):
+        import onnxruntime as ort
+        params = self.cfg.params or {}
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if params.get("n_threads"):
+            options.intra_op_num_threads = int(params["n_threads"])
+        return options
+
+    def _file_names(self, path: str) -> Dict[str, str]:
+        """Имена ONNX-файлов для from_pretrained: квантизованные, если экспорт квантизован."""
+        def pick(base):
+            name = f"{base}_{QUANTIZED_SUFFIX}.onnx" if self.quantize else f"{base}.onnx"
+            return name if os.path.exists(os.path.join(path, name)) else None
+        if not self.seq2seq:
+            return {"file_name": pick("model")}
+        names = {
+            "encoder_file_name": pick("encoder_model"),
+            "decoder_file_name": pick("decoder_model"),
+            "decoder_with_past_file_name": pick("decoder_with_past_model"),
+        }
+        return {k: v for k, v in names.items() if v}
+
+    def _export(self, path: str):
+        """Экспорт (и квантизация) во временный каталог; manifest пишется последним, затем атомарный rename."""
+        import optimum
+        from optimum.onnxruntime import ORTQuantizer
+        params = self.cfg.params or {}
+        tmp = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        t_start = time.monotonic()
+        try:
+            model = self.model_cls.from_pretrained(
+                self.cfg.model_path, export=True, use_cache=True, revision=params.get("revision"))
+            model.save_pretrained(tmp)
+            AutoTokenizer.from_pretrained(self.cfg.model_path, revision=params.get("revision")).save_pretrained(tmp)
+            del model
+            if self.quantize:
+                qconfig = dynamic_quantization_config()
+                for file_name in sorted(f for f in os.listdir(tmp) if f.endswith(".onnx")):
+                    quantizer = ORTQuantizer.from_pretrained(tmp, file_name=file_name)
+                    quantizer.quantize(save_dir=tmp, quantization_config=qconfig, file_suffix=QUANTIZED_SUFFIX)
+            with open(os.path.join(tmp, MANIFEST), "w") as f:
+                json.dump({
+                    "model_path": self.cfg.model_path,
+                    "seq2seq": self.seq2seq,
+                    "quantize": "int8" if self.quantize else None,
+                    "optimum": optimum.__version__,
+                }, f, indent=2)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp, path)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        logger.info(f"[OnnxRunner] Exported {self.cfg.model_path} to {path} in {time.monotonic() - t_start:.1f}s")
+
+    def _load(self):
+        path = self._export_dir()
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._export(path)
+        provider = (self.cfg.params or {}).get("provider", "CPUExecutionProvider")
+        self.model = self.model_cls.from_pretrained(
+            path,
+            use_cache=True,
+            provider=provider,
+            session_options=self._session_options(),
+            **self._file_names(path),
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+    def unload(self):
+        # InferenceSession освобождает память графов при сборке мусора
+        self.model = None
+        self.tokenizer = None
+        logger.info(f"[OnnxRunner] Unloaded model: {self.cfg.name}")
+
+    def _gen_kwargs(self, gen_kwargs: dict) -> dict:
+        defaults = {
+            "max_new_tokens": gen_kwargs.get("max_new_tokens", 256),
+            "do_sample": True,
+            "temperature": gen_kwargs.get("temperature", getattr(self.cfg, "temperature", 0.7)),
+            "top_p": gen_kwargs.get("top_p", getattr(self.cfg, "top_p", 0.95)),
+            "pad_token_id": self.tokenizer.pad_token_id,
+        }
+        return self.filter_generate_kwargs({**defaults, **gen_kwargs})
+
+    def _decode(self, prompt: str, input_len: int, output_ids) -> str:
+        if self.seq2seq:
+            return self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        # Как pipeline("text-generation"): prompt + продолжение
+        return prompt + self.tokenizer.decode(output_ids[input_len:], skip_special_tokens=True)
+
+    async def generate(self, prompt, cancel_token: Optional[CancellationToken] = None, **gen_kwargs):
+        """Асинхронный вызов модели. Возвращает {"text": generated_text, "usage": runtime-метрики}."""
+        loop = asyncio.get_running_loop()
+        kwargs = self._gen_kwargs(gen_kwargs)
+
+        def sync_gen():
+            if cancel_token:
+                kwargs["stopping_criteria"] = StoppingCriteriaList([CancelOnTokenCriteria(cancel_token)])
+            inputs = self.tokenizer(prompt, return_tensors="pt")
+            t_start = time.monotonic()
+            out = self.model.generate(input_ids=inputs.input_ids, attention_mask=inputs.attention_mask, **kwargs)
+            t_end = time.monotonic()
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            input_len = inputs.input_ids.shape[1]
+            new_tokens = out.shape[1] - (0 if self.seq2seq else input_len)
+            return {
+                "text": self._decode(prompt, input_len, out[0]),
+                "tokens_prompt": int(input_len),
+                "tokens_result": int(new_tokens),
+                "latency_ms": int((t_end - t_start) * 1000),
+            }
+
+        res = await loop.run_in_executor(self.executor, sync_gen)
+
+        try:
+            from services.metrics_service import metrics_service
+            logger.debug(
+                f"[generate] model={self.cfg.name} | latency={res['latency_ms']}ms | tokens={res['tokens_result']}")
+            await metrics_service.record_request(
+                model=self.cfg.name,
+                tokens=res["tokens_result"],
+                latency_ms=res["latency_ms"]
+            )
+        except Exception:
+            pass
+        usage = {k: v for k, v in res.items() if k != "text"}
+        return {"text": res["text"], "usage": usage}
+
+    async def generate_stream(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **gen_kwargs):
+        # Собственный токен: закрытие генератора (клиент ушёл) останавливает model.generate
+        token = CancellationToken()
+        kwargs = self._gen_kwargs(gen_kwargs)
+
+        def sync_stream():
+            # skip_prompt: для seq2seq пропускает decoder_start_token, для causal — prompt
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            inputs = self.tokenizer(prompt, return_tensors="pt")
+            errors = []
+
+            def run_generate():
+                try:
+                    self.model.generate(
+                        input_ids=inputs.input_ids,
+                        attention_mask=inputs.attention_mask,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([CancelOnTokenCriteria(token)]),
+                        **kwargs,
+                    )
+                except Exception as e:
+                    errors.append(e)
+                    # разблокируем итератор стримера
+                    streamer.end()
+
+            t = threading.Thread(target=run_generate, daemon=True)
+            t.start()
+            for text in streamer:
+                if cancel_token and cancel_token.cancelled:
+                    token.cancel()
+                if text:
+                    yield text
+            t.join()
+            if errors:
+                raise errors[0]
+
+        try:
+            async for chunk in stream_from_thread(sync_stream, executor=self.executor):
+                if cancel_token and cancel_token.cancelled:
+                    break
+                yield chunk
+        finally:
+            token.cancel()
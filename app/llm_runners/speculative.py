@@ -0,0 +1,103 @@
+# app/llm_runners/speculative.py
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+
+class ForwardCounter:
+    """
+    Считает forward-вызовы модели, сделанные текущим потоком.
+    Hook вешается один раз при загрузке; считаются только потоки внутри counting().
+    """
+    def __init__(self, model):
+        self._local = threading.local()
+        self._handle = model.register_forward_hook(self._hook)
+
+    def _hook(self, module, args, output):
+        count = getattr(self._local, "count", None)
+        if count is not None:
+            self._local.count = count + 1
+
+    def start(self):
+        self._local.count = 0
+
+    def stop(self) -> int:
+        count = getattr(self._local, "count", None) or 0
+        self._local.count = None
+        return count
+
+    def remove(self):
+        self._handle.remove()
+
+
+class SpeculationStats:
+    """
+    Статистика speculative/assisted decoding одной генерации.
+    Каждый forward основной модели верифицирует черновик и даёт accepted + 1 токен, поэтому:
+      accepted = new_tokens - main_forwards
+      acceptance_rate = accepted / drafted
+      tokens_per_forward = new_tokens / main_forwards (≈ ускорение decode; обычный decode = 1.0)
+      hit_rate = accepted / new_tokens (доля ответа, взятая из черновика)
+    """
+    def __init__(self):
+        self.main_forwards = 0
+        self.drafted = 0
+        self.new_tokens = 0
+
+    @property
+    def accepted(self) -> int:
+        return max(0, self.new_tokens - self.main_forwards)
+
+    def usage(self, prefix: str = "spec") -> Dict[str, Any]:
+        return {
+            f"{prefix}_drafted": self.drafted,
+            f"{prefix}_accepted": self.accepted,
+            f"{prefix}_acceptance_rate": round(self.accepted / self.drafted, 4) if self.drafted else 0.0,
+            f"{prefix}_tokens_per_forward": round(self.new_tokens / self.main_forwards, 4) if self.main_forwards else 0.0,
+            f"{prefix}_hit_rate": round(self.accepted / self.new_tokens, 4) if self.new_tokens else 0.0,
+            f"{prefix}_new_tokens": self.new_tokens,
+        }
+
+
+class CountingPromptLookup:
+    """
+    Обёртка над llama_cpp LlamaPromptLookupDecoding: считает вызовы и предложенные токены
+    по потокам (llama.cpp вызывает черновик один раз на каждый eval основной модели).
+    """
+    def __init__(self, draft):
+        self._draft = draft
+        self._local = threading.local()
+
+    def __call__(self, input_ids, *args, **kwargs):
+        tokens = self._draft(input_ids, *args, **kwargs)
+        if getattr(self._local, "stats", None) is not None:
+            self._local.stats.main_forwards += 1
+            self._local.stats.drafted += len(tokens)
+        return tokens
+
+    @contextmanager
+    def counting(self):
+        stats = SpeculationStats()
+        # Первый eval (prefill) идёт без черновика, но тоже даёт токен
+        stats.main_forwards = 1
+        self._local.stats = stats
+        try:
+            yield stats
+        finally:
+            self._local.stats = None
+
+
+@contextmanager
+def count_speculation(main: ForwardCounter, draft: Optional[ForwardCounter] = None):
+    """Собрать main/draft forward'ы вокруг model.generate(); new_tokens проставляет вызывающий."""
+    stats = SpeculationStats()
+    main.start()
+    if draft:
+        draft.start()
+    try:
+        yield stats
+    finally:
+        stats.main_forwards = main.stop()
+        if draft:
+            # Каждый forward черновой модели предлагает один токен
+            stats.drafted = draft.stop()
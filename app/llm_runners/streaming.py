@@ -0,0 +1,63 @@
+# app/llm_runners/streaming.py
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Iterable
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+_DONE = object()
+
+
+async def stream_from_thread(
+    produce: Callable[[], Iterable],
+    maxsize: int = 64,
+    executor=None,
+) -> AsyncIterator:
+    """
+    Мост sync-генератор (в потоке executor'а) -> async-генератор (в event loop).
+    - Каждый чанк отдаётся сразу, как только producer его выдал (call_soon_threadsafe)
+    - Backpressure: не более maxsize непрочитанных чанков, дальше producer ждёт клиента
+    - Если consumer закрылся раньше (клиент ушёл), producer прекращает итерацию
+    """
+    loop = asyncio.get_running_loop()
+    # +1 слот под финальный маркер, который кладётся без ожидания
+    queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize + 1)
+    slots = threading.Semaphore(maxsize)
+    stopped = threading.Event()
+
+    def put(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # event loop уже закрыт — отдавать некому
+            stopped.set()
+
+    def worker():
+        try:
+            for item in produce():
+                while not slots.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        return
+                if stopped.is_set():
+                    return
+                put(item)
+        except BaseException as e:
+            put(_DONE, e)
+        else:
+            put(_DONE)
+
+    future = loop.run_in_executor(executor, worker)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                break
+            slots.release()
+            yield item
+        await future
+    finally:
+        stopped.set()
@@ -1,35 +1,90 @@
 import asyncio
-from typing import Callable, Optional
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline, TextIteratorStreamer
+from typing import Callable, List, Optional
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, pipeline, TextIteratorStreamer,
+    StoppingCriteria, StoppingCriteriaList,
+)
 import torch
 import time
 from threading import RLock
 from core.logging import get_logger
+from llm_runners.artifact_cache import load_causal_lm
+from llm_runners.batching import ContinuousBatchScheduler
+from llm_runners.cancellation import CancellationToken
+from llm_runners.compiled import DEFAULT_CACHE_BUCKETS, DecodeTimer, StaticCachePool, cache_bucket, enable_compile
+from llm_runners.kv_prefix_cache import PrefixKVCache
+from llm_runners.speculative import ForwardCounter, count_speculation
+from llm_runners.streaming import stream_from_thread
+from llm_runners.weight_registry import weight_key, weight_registry
 logger = get_logger(__name__)
+
+
+class CancelOnTokenCriteria(StoppingCriteria):
+    """Останавливает model.generate на ближайшем decode-шаге после отмены токена."""
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.token.cancelled, dtype=torch.bool, device=input_ids.device)
+
+
 class TransformersRunner:
     """
     Production-ready HuggingFace runner:
     - Асинхронный (через run_in_executor)
-    - Поддерживает hot-reload модели по сигналу
+    - Hot-reload: LLMService грузит новый экземпляр в фоне и подменяет его атомарно (double buffering)
     - Самооптимизация quantization для low VRAM
     - Логирование и интеграция с метриками
-    - Thread-safe reload
+    - Continuous batching (params.continuous_batching: true, params.max_batch_size)
+    - Кэш past_key_values общих префиксов prompt'а (params.prefix_cache, prefix_cache_mb,
+      prefix_cache_prefixes); сбрасывается при reload
+    - Speculative decoding с черновой моделью (params.draft_model, draft_num_tokens)
+    - Prompt lookup decoding без черновой модели (params.prompt_lookup_num_tokens, prompt_lookup_max_ngram)
+    - Общие веса: конфиги с одинаковыми model_path и params загрузки (разные sampling-параметры)
+      используют одну модель и токенизатор (WeightRegistry, refcount)
+    - torch.compile decode-шага со static KV-кэшем (params.compile: true, compile_buckets, compile_mode);
+      компиляция — в warm-up при загрузке, не на первом запросе
+    - generate_batch: prompt'ы с одинаковыми параметрами — один batched forward (LLMService.generate_batch)
+    - Свой executor и доля ядер CPU от CpuBudgetManager (LLMService выставляет executor/cpu_allocation)
     """
+    # params.trust_remote_code переопределяет
+    trust_remote_code = False
+    # None — default executor event loop'а (runner создан вне LLMService)
+    executor = None
+    cpu_allocation = None
+
     def __init__(self, cfg):
         self.cfg = cfg
         self.model = None
         self.tokenizer = None
         self.text_generator: Optional[Callable] = None
+        self.scheduler: Optional[ContinuousBatchScheduler] = None
+        self.prefix_cache: Optional[PrefixKVCache] = None
+        self.draft_model = None
+        self.draft_tokenizer = None
+        self._draft_same_vocab = True
+        self.prompt_lookup_tokens = None
+        self.prompt_lookup_max_ngram = None
+        self._main_counter: Optional[ForwardCounter] = None
+        self._draft_counter: Optional[ForwardCounter] = None
+        self.compiled = False
+        self.static_caches: Optional[StaticCachePool] = None
+        # decode ms/token eager vs compiled, замеряется в warm-up
+        self.compile_report: dict = {}
+        self._weights_key = None
         self.device = self._select_device(cfg)
         self._lock = RLock()
-        self._load_model_and_tokenizer()
-        from core.config import config_store
-        config_store.subscribe(self._on_config_change)
+        try:
+            self._load_model_and_tokenizer()
+            if self.compiled and (cfg.params or {}).get("compile_warmup", True):
+                self.warmup()
+        except Exception:
+            # Отпустить уже взятые общие веса
+            self.unload()
+            raise
         logger.info(
             f"[TransformersRunner] Initialized for model: {getattr(cfg, 'name', '<missing>')} at {cfg.model_path}")
 
-    def _on_config_change(self, _):
-        asyncio.create_task(self.reload())
     def filter_generate_kwargs(self, kwargs: dict) -> dict:
         """
         The function `filter_generate_kwargs` filters and validates input keyword arguments based on a
@@ -52,7 +107,8 @@ class TransformersRunner:
             "early_stopping", "length_penalty", "penalty_alpha",
             "no_repeat_ngram_size", "typical_p", "logits_processor", "bad_words_ids",
             "output_scores", "return_dict_in_generate", "renormalize_logits",
-            "forced_bos_token_id", "forced_eos_token_id", "remove_invalid_values"
+            "forced_bos_token_id", "forced_eos_token_id", "remove_invalid_values",
+            "stopping_criteria",
         }
         filtered = {k: v for k, v in kwargs.items() if k in allowed}
         # Защита от temperature <= 0
@@ -79,14 +135,27 @@ class TransformersRunner:
             return torch.device("mps")
         return torch.device("cpu")
 
-    async def reload(self):
-        """Safe reload (thread/async-safe)."""
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, self._reload_sync)
-
-    def _reload_sync(self):
+    def unload(self):
+        """Освободить веса (вытеснение из RunnerRegistry); после unload runner не используется."""
         with self._lock:
-            self._load_model_and_tokenizer()
+            if self.scheduler:
+                self.scheduler.stop()
+            for counter in (self._main_counter, self._draft_counter):
+                if counter:
+                    counter.remove()
+            if self.prefix_cache:
+                self.prefix_cache.clear()
+            if self.static_caches:
+                self.static_caches.clear()
+            self.scheduler = self.prefix_cache = self.static_caches = None
+            self.compiled = False
+            self._main_counter = self._draft_counter = None
+            self.text_generator = self.model = self.tokenizer = None
+            self.draft_model = self.draft_tokenizer = None
+            if self._weights_key is not None:
+                weight_registry.release(self._weights_key)
+                self._weights_key = None
+        logger.info(f"[TransformersRunner] Unloaded {self.cfg.name}")
 
     def _select_quantization(self, vram_gb, params):
         # Smart quantization: BnB 4bit/8bit для low VRAM
@@ -104,34 +173,60 @@ class TransformersRunner:
                 pass
         return params
 
+    def _vram_gb(self) -> float:
+        if self.device.type == "cuda":
+            return torch.cuda.get_device_properties(self.device.index or 0).total_memory / (1024 ** 3)
+        return 0.0
+
+    @staticmethod
+    def _explicit_load_kwargs(params: dict, load_kwargs: Optional[dict] = None) -> dict:
+        """Поверх автоматического выбора: явные params.torch_dtype, device_map, quantization_config."""
+        load_kwargs = dict(load_kwargs or {})
+        torch_dtype = params.get("torch_dtype", "auto")
+        if isinstance(torch_dtype, str):
+            torch_dtype = {
+                "auto": None,
+                "float16": torch.float16,
+                "bfloat16": torch.bfloat16,
+                "float32": torch.float32,
+            }.get(torch_dtype.lower(), None)
+        if torch_dtype:
+            load_kwargs["torch_dtype"] = torch_dtype
+        if params.get("device_map"):
+            load_kwargs["device_map"] = params["device_map"]
+        if params.get("quantization_config"):
+            load_kwargs["quantization_config"] = params["quantization_config"]
+        return load_kwargs
+
+    def _select_load_kwargs(self, params: dict) -> dict:
+        """
+        kwargs для from_pretrained: квантизация под VRAM + явные params загрузки.
+        Семейства моделей (HFFamilyRunner) переопределяют выбор под свои требования к памяти.
+        """
+        params = self._select_quantization(self._vram_gb(), params)
+        return self._explicit_load_kwargs(params)
+
     def _load_model_and_tokenizer(self):
         with self._lock:
             params = dict(self.cfg.params or {})
-            # Авто-детект VRAM
-            vram_gb = 0
-            if self.device.type == "cuda":
-                vram_gb = torch.cuda.get_device_properties(self.device.index or 0).total_memory / (1024 ** 3)
-            params = self._select_quantization(vram_gb, params)
-            torch_dtype = params.get("torch_dtype", "auto")
-            if isinstance(torch_dtype, str):
-                torch_dtype = {
-                    "auto": None,
-                    "float16": torch.float16,
-                    "bfloat16": torch.bfloat16,
-                    "float32": torch.float32,
-                }.get(torch_dtype.lower(), None)
-            load_kwargs = {}
-            if torch_dtype:
-                load_kwargs["torch_dtype"] = torch_dtype
-            if params.get("device_map"):
-                load_kwargs["device_map"] = params["device_map"]
-            if params.get("quantization_config"):
-                load_kwargs["quantization_config"] = params["quantization_config"]
-            self.tokenizer = AutoTokenizer.from_pretrained(self.cfg.model_path)
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.cfg.model_path,
-                **load_kwargs
-            )
+            load_kwargs = self._select_load_kwargs(params)
+            revision = params.get("revision")
+            trust_remote_code = bool(params.get("trust_remote_code", self.trust_remote_code))
+
+            def load_weights():
+                tokenizer = AutoTokenizer.from_pretrained(
+                    self.cfg.model_path, revision=revision, trust_remote_code=trust_remote_code)
+                model = load_causal_lm(
+                    self.cfg.model_path,
+                    load_kwargs,
+                    revision=revision,
+                    enabled=params.get("artifact_cache"),
+                    trust_remote_code=trust_remote_code,
+                )
+                return model, tokenizer
+
+            self._weights_key = weight_key(self.cfg)
+            self.model, self.tokenizer = weight_registry.acquire(self._weights_key, load_weights)
             device_idx = (
                 0 if self.device.type == "cuda" else
                 -1 if self.device.type == "cpu" else
@@ -144,10 +239,226 @@ class TransformersRunner:
                 device=device_idx,
                 torch_dtype=load_kwargs.get("torch_dtype", None)
             )
+            if self.scheduler:
+                self.scheduler.stop()
+                self.scheduler = None
+            if params.get("continuous_batching"):
+                self.scheduler = ContinuousBatchScheduler(
+                    self.model,
+                    self.tokenizer,
+                    self.device,
+                    max_batch_size=params.get("max_batch_size", 8),
+                    name=self.cfg.name,
+                )
+            # Кэш привязан к весам: после reload строится заново
+            self.prefix_cache = None
+            if params.get("prefix_cache", True):
+                from rag.template import get_static_prefixes
+                self.prefix_cache = PrefixKVCache(
+                    list(params.get("prefix_cache_prefixes") or []) + get_static_prefixes(),
+                    max_bytes=int(params.get("prefix_cache_mb", 256)) * 1024 * 1024,
+                )
+            self._load_draft_model(params, load_kwargs)
+            self._setup_compile(params)
+
+    def _setup_compile(self, params: dict):
+        """params.compile: static KV-кэш + torch.compile decode-шага; при несовместимости остаёмся в eager."""
+        self.compiled = False
+        self.static_caches = None
+        if not params.get("compile"):
+            return
+        if self.scheduler or self._speculative_mode:
+            logger.warning(f"[TransformersRunner] compile is ignored for {self.cfg.name}: "
+                           f"not supported together with continuous batching or speculative decoding")
+            return
+        buckets = sorted(int(b) for b in (params.get("compile_buckets") or DEFAULT_CACHE_BUCKETS))
+        try:
+            enable_compile(self.model, buckets, mode=params.get("compile_mode"))
+        except Exception as e:
+            logger.warning(f"[TransformersRunner] compile is disabled for {self.cfg.name}: {e}")
+            return
+        self.static_caches = StaticCachePool(self.model, buckets)
+        self.compiled = True
+        logger.info(f"[TransformersRunner] Static KV cache + torch.compile for {self.cfg.name}, buckets {buckets}")
+
+    def _compiled_bucket(self, input_len: int, max_new_tokens: int) -> Optional[int]:
+        if not self.compiled:
+            return None
+        return cache_bucket(input_len + max_new_tokens, self.static_caches.buckets)
+
+    def warmup(self, decode_tokens: int = 32):
+        """
+        Компиляция графов decode-шага для всех bucket'ов до первого запроса
+        и замер decode ms/token: eager (DynamicCache) против compiled (StaticCache).
+        """
+        inputs = self.tokenizer("pipeline {\n    agent any\n", return_tensors="pt").to(self.model.device)
+        pad_token_id = self.tokenizer.pad_token_id
+        kwargs = {"max_new_tokens": decode_tokens, "min_new_tokens": decode_tokens, "do_sample": False,
+                  "pad_token_id": self.tokenizer.eos_token_id if pad_token_id is None else pad_token_id}
+
+        def timed(**extra):
+            timer = DecodeTimer()
+            with torch.inference_mode():
+                self.model.generate(input_ids=inputs.input_ids, attention_mask=inputs.attention_mask,
+                                    stopping_criteria=StoppingCriteriaList([timer]), **kwargs, **extra)
+            return timer.ms_per_token
+
+        t_start = time.monotonic()
+        eager_ms = timed()  # DynamicCache: HF не компилирует
+        input_len = inputs.input_ids.shape[1]
+        compiled_ms = None
+        for bucket in self.static_caches.buckets:
+            if input_len + decode_tokens > bucket:
+                continue
+            with self.static_caches.acquire(bucket) as cache:
+                timed(past_key_values=cache)  # первый прогон — компиляция
+            with self.static_caches.acquire(bucket) as cache:
+                ms = timed(past_key_values=cache)
+            if compiled_ms is None:
+                compiled_ms = ms
+        self.compile_report = {
+            "compile_warmup_ms": int((time.monotonic() - t_start) * 1000),
+            "eager_decode_ms_per_token": eager_ms,
+            "compiled_decode_ms_per_token": compiled_ms,
+            "speedup": round(eager_ms / compiled_ms, 3) if eager_ms and compiled_ms else None,
+        }
+        logger.info(f"[TransformersRunner] Compile warm-up for {self.cfg.name}: {self.compile_report}")
+        return self.compile_report
+
+    def _prefix_past(self, prompt: str, input_ids):
+        """(DynamicCache префикса, его длина) или None; ошибки кэша не роняют генерацию."""
+        if not self.prefix_cache:
+            return None
+        try:
+            return self.prefix_cache.lookup(self.model, self.tokenizer, prompt, input_ids[0].tolist())
+        except Exception as e:
+            logger.warning(f"[TransformersRunner] Prefix cache skipped for {self.cfg.name}: {e}")
+            return None
+
+    def _load_draft_model(self, params: dict, load_kwargs: dict):
+        """
+        Черновик для assisted generation:
+        - params.draft_model: путь/HF id causal LM (speculative decoding)
+        - params.prompt_lookup_num_tokens: n-gram copy из prompt'а, без черновой модели
+        """
+        for counter in (self._main_counter, self._draft_counter):
+            if counter:
+                counter.remove()
+        self.draft_model = self.draft_tokenizer = None
+        self._main_counter = self._draft_counter = None
+        self.prompt_lookup_tokens = params.get("prompt_lookup_num_tokens")
+        self.prompt_lookup_max_ngram = params.get("prompt_lookup_max_ngram")
+        draft_path = params.get("draft_model")
+        if self.prompt_lookup_tokens and not draft_path:
+            self._main_counter = ForwardCounter(self.model)
+            logger.info(f"[TransformersRunner] Prompt lookup decoding for {self.cfg.name}: "
+                        f"{self.prompt_lookup_tokens} tokens per draft")
+        if not draft_path:
+            return
+        self.draft_tokenizer = AutoTokenizer.from_pretrained(draft_path)
+        self.draft_model = AutoModelForCausalLM.from_pretrained(
+            draft_path,
+            torch_dtype=load_kwargs.get("torch_dtype"),
+        ).to(self.model.device)
+        if params.get("draft_num_tokens"):
+            self.draft_model.generation_config.num_assistant_tokens = int(params["draft_num_tokens"])
+        # Один словарь — обычный assisted decoding, иначе universal (через оба токенизатора)
+        self._draft_same_vocab = self.draft_tokenizer.get_vocab() == self.tokenizer.get_vocab()
+        self._main_counter = ForwardCounter(self.model)
+        self._draft_counter = ForwardCounter(self.draft_model)
+        logger.info(f"[TransformersRunner] Draft model for {self.cfg.name}: {draft_path} "
+                    f"(same vocab: {self._draft_same_vocab})")
+
+    @property
+    def _speculative_mode(self) -> Optional[str]:
+        if self.draft_model is not None:
+            return "spec"
+        if self.prompt_lookup_tokens:
+            return "lookup"
+        return None
+
+    def _assistant_kwargs(self) -> dict:
+        if self.draft_model is None:
+            if self.prompt_lookup_tokens:
+                kwargs = {"prompt_lookup_num_tokens": int(self.prompt_lookup_tokens)}
+                if self.prompt_lookup_max_ngram:
+                    kwargs["max_matching_ngram_size"] = int(self.prompt_lookup_max_ngram)
+                return kwargs
+            return {}
+        kwargs = {"assistant_model": self.draft_model}
+        if not self._draft_same_vocab:
+            kwargs["tokenizer"] = self.tokenizer
+            kwargs["assistant_tokenizer"] = self.draft_tokenizer
+        return kwargs
+
+    def _generate_compiled(self, prompt: str, gen_kwargs: dict):
+        """
+        model.generate() со StaticCache из пула — decode-шаг идёт скомпилированным графом bucket'а.
+        Возвращает (text, usage) или None, если prompt + max_new_tokens не влезает ни в один bucket.
+        """
+        if not self.compiled:
+            return None
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        bucket = self._compiled_bucket(inputs.input_ids.shape[1], int(gen_kwargs.get("max_new_tokens", 256)))
+        if bucket is None:
+            return None
+        with self.static_caches.acquire(bucket) as cache, torch.inference_mode():
+            out = self.model.generate(
+                input_ids=inputs.input_ids,
+                attention_mask=inputs.attention_mask,
+                past_key_values=cache,
+                **gen_kwargs
+            )
+        new_tokens = out[0, inputs.input_ids.shape[1]:]
+        usage = {"compiled": True, "cache_bucket": bucket}
+        return prompt + self.tokenizer.decode(new_tokens, skip_special_tokens=True), usage
 
-    async def generate(self, prompt, **gen_kwargs):
+    def _generate_direct(self, prompt: str, gen_kwargs: dict):
         """
-        Асинхронный вызов модели. Возвращает generated_text и runtime-метрики.
+        model.generate() в обход pipeline, когда есть что ускорить:
+        - закэшированный past_key_values префикса (prefill только по суффиксу)
+        - черновая модель (speculative / assisted decoding) или prompt lookup
+        Возвращает (text, usage) или None — тогда работает обычный pipeline.
+        """
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        kwargs = dict(gen_kwargs)
+        usage = {"tokens_prefix_cached": 0}
+        mode = self._speculative_mode
+        if mode:
+            # В assisted-режиме кэш префикса не подмешиваем: HF строит кэши кандидатов сам
+            kwargs.update(self._assistant_kwargs())
+        else:
+            found = self._prefix_past(prompt, inputs.input_ids)
+            if found is None:
+                return None
+            kwargs["past_key_values"], usage["tokens_prefix_cached"] = found
+        with torch.inference_mode():
+            if mode:
+                with count_speculation(self._main_counter, self._draft_counter) as spec:
+                    out = self.model.generate(
+                        input_ids=inputs.input_ids,
+                        attention_mask=inputs.attention_mask,
+                        **kwargs
+                    )
+            else:
+                spec = None
+                out = self.model.generate(
+                    input_ids=inputs.input_ids,
+                    attention_mask=inputs.attention_mask,
+                    **kwargs
+                )
+        new_tokens = out[0, inputs.input_ids.shape[1]:]
+        if spec is not None:
+            spec.new_tokens = int(new_tokens.shape[0])
+            usage.update(spec.usage(mode))
+        # Как pipeline("text-generation"): prompt + продолжение
+        return prompt + self.tokenizer.decode(new_tokens, skip_special_tokens=True), usage
+
+    async def generate(self, prompt, cancel_token: Optional[CancellationToken] = None, **gen_kwargs):
+        """
+        Асинхронный вызов модели. Возвращает {"text": generated_text, "usage": runtime-метрики}.
+        При включённом continuous batching запрос уходит в общий батч планировщика.
+        cancel_token прерывает генерацию на ближайшем decode-шаге (GenerationCancelled).
         """
         loop = asyncio.get_running_loop()
         default_gen_kwargs = {
@@ -160,12 +471,28 @@ class TransformersRunner:
         final_gen_kwargs = self.filter_generate_kwargs(final_gen_kwargs)  # Фильтруем!
 
         def sync_gen():
+            kwargs = dict(final_gen_kwargs)
+            criteria = [CancelOnTokenCriteria(cancel_token)] if cancel_token else []
+            # decode ms/token (в speculative-режиме шаг даёт несколько токенов — не меряем)
+            timer = None if self._speculative_mode else DecodeTimer()
+            if timer:
+                criteria.append(timer)
+            if criteria:
+                kwargs["stopping_criteria"] = StoppingCriteriaList(criteria)
             t_start = time.monotonic()
             if not self.text_generator:
                 return 
-            result = self.text_generator(prompt, **final_gen_kwargs)
+            direct = self._generate_compiled(prompt, kwargs) or self._generate_direct(prompt, kwargs)
+            if direct is not None:
+                output, extra_usage = direct
+            else:
+                result = self.text_generator(prompt, **kwargs)
+                output, extra_usage = result[0]["generated_text"], {}
             t_end = time.monotonic()
-            output = result[0]["generated_text"]
+            if timer and timer.ms_per_token is not None:
+                extra_usage["decode_ms_per_token"] = timer.ms_per_token
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
             
             assert hasattr(self.tokenizer, "encode"), "Tokenizer is wrong initialize"
             
@@ -175,13 +502,23 @@ class TransformersRunner:
                 "text": output,
                 "tokens_prompt": prompt_tokens,
                 "tokens_result": result_tokens,
-                "latency_ms": int((t_end - t_start) * 1000)
+                "latency_ms": int((t_end - t_start) * 1000),
+                **extra_usage,
             }
 
-        # run sync in executor
-        res = await loop.run_in_executor(None, sync_gen)
+        if self.scheduler and ContinuousBatchScheduler.supports(final_gen_kwargs):
+            batched = await asyncio.wrap_future(self.scheduler.submit(prompt, cancel_token=cancel_token, **final_gen_kwargs))
+            res = {"text": batched["text"], **batched["usage"]}
+        else:
+            # run sync in executor
+            res = await loop.run_in_executor(self.executor, sync_gen)
+
+        await self._record_metrics(res)
+        usage = {k: v for k, v in res.items() if k != "text"}
+        return {"text": res["text"], "usage": usage}
 
-        # Интеграция с метриками (если есть)
+    async def _record_metrics(self, res: dict):
+        """Интеграция с метриками (если есть)."""
         try:
             from services.metrics_service import metrics_service
             logger.debug(
@@ -192,12 +529,96 @@ class TransformersRunner:
                 tokens=res["tokens_result"],
                 latency_ms=res["latency_ms"]
             )
+            for kind in ("spec", "lookup"):
+                if f"{kind}_accepted" in res:
+                    await metrics_service.record_speculation(
+                        model=self.cfg.name,
+                        drafted=res[f"{kind}_drafted"],
+                        accepted=res[f"{kind}_accepted"],
+                        tokens_per_forward=res[f"{kind}_tokens_per_forward"],
+                        # Только сгенерированные токены: tokens_result здесь считается вместе с prompt
+                        new_tokens=res.get(f"{kind}_new_tokens", 0),
+                        kind=kind,
+                    )
+            if res.get("decode_ms_per_token") is not None:
+                await metrics_service.record_decode(
+                    model=self.cfg.name,
+                    ms_per_token=res["decode_ms_per_token"],
+                    compiled=res.get("compiled", False),
+                )
         except Exception:
             pass
-        return res["text"]
 
-    async def generate_stream(self, prompt: str, **gen_kwargs):
+    async def generate_batch(self, prompts: List[str], cancel_token: Optional[CancellationToken] = None, **gen_kwargs):
+        """
+        Несколько prompt'ов с одинаковыми параметрами генерации — один batched model.generate (left padding).
+        Результаты как у generate, в порядке prompts. С continuous batching, speculative decoding
+        или static KV-кэшем (compile) — по одному generate на prompt.
+        """
+        final_gen_kwargs = self.filter_generate_kwargs({
+            "max_new_tokens": gen_kwargs.get("max_new_tokens", 256),
+            "do_sample": True,
+            "temperature": gen_kwargs.get("temperature", getattr(self.cfg, "temperature", 0.7)),
+            "top_p": gen_kwargs.get("top_p", getattr(self.cfg, "top_p", 0.95)),
+            **gen_kwargs,
+        })
+        # Как в generate: планировщик проверяет уже отфильтрованные kwargs, а не params модели целиком
+        if len(prompts) < 2 or self._speculative_mode or self.compiled or (
+                self.scheduler and ContinuousBatchScheduler.supports(final_gen_kwargs)):
+            return list(await asyncio.gather(*(self.generate(p, cancel_token=cancel_token, **gen_kwargs)
+                                               for p in prompts)))
         loop = asyncio.get_running_loop()
+
+        def sync_batch():
+            kwargs = dict(final_gen_kwargs)
+            timer = DecodeTimer()
+            criteria = [CancelOnTokenCriteria(cancel_token)] if cancel_token else []
+            kwargs["stopping_criteria"] = StoppingCriteriaList(criteria + [timer])
+            pad_token_id = self.tokenizer.pad_token_id
+            if pad_token_id is None:
+                pad_token_id = self.tokenizer.eos_token_id
+            kwargs.setdefault("pad_token_id", pad_token_id)
+            # Left padding вручную: у части токенизаторов нет pad_token, а padding_side токенизатора общий
+            encoded = [self.tokenizer.encode(p) for p in prompts]
+            width = max(len(ids) for ids in encoded)
+            input_ids = torch.full((len(prompts), width), pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(prompts), width), dtype=torch.long)
+            for i, ids in enumerate(encoded):
+                input_ids[i, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+                attention_mask[i, width - len(ids):] = 1
+            t_start = time.monotonic()
+            with torch.inference_mode():
+                out = self.model.generate(
+                    input_ids=input_ids.to(self.model.device),
+                    attention_mask=attention_mask.to(self.model.device),
+                    **kwargs
+                )
+            latency_ms = int((time.monotonic() - t_start) * 1000)
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            results = []
+            for i, prompt in enumerate(prompts):
+                output = prompt + self.tokenizer.decode(out[i, width:], skip_special_tokens=True)
+                results.append({
+                    "text": output,
+                    "tokens_prompt": len(encoded[i]),
+                    # Только новые токены, как у планировщика и ONNX; хвост раньше закончивших строк — pad
+                    "tokens_result": int((out[i, width:] != pad_token_id).sum()),
+                    "latency_ms": latency_ms,
+                    "batch_size": len(prompts),
+                    "decode_ms_per_token": timer.ms_per_token,
+                })
+            return results
+
+        results = await loop.run_in_executor(self.executor, sync_batch)
+        for res in results:
+            await self._record_metrics(res)
+        return [{"text": res["text"], "usage": {k: v for k, v in res.items() if k != "text"}} for res in results]
+
+    async def generate_stream(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **gen_kwargs):
+        # Собственный токен: закрытие генератора (клиент ушёл) останавливает model.generate
+        token = CancellationToken()
+
         def sync_stream():
             streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True)
             inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
@@ -208,14 +629,48 @@ class TransformersRunner:
                 "do_sample": gen_kwargs.get("do_sample", True),
                 "temperature": gen_kwargs.get("temperature", getattr(self.cfg, "temperature", 0.7)),
                 "top_p": gen_kwargs.get("top_p", getattr(self.cfg, "top_p", 0.95)),
-                "streamer": streamer
+                "streamer": streamer,
+                "stopping_criteria": StoppingCriteriaList([CancelOnTokenCriteria(token)]),
             }
+            bucket = self._compiled_bucket(inputs.input_ids.shape[1], gen_kwargs_full["max_new_tokens"])
+            if self._speculative_mode:
+                gen_kwargs_full.update(self._assistant_kwargs())
+            elif bucket is None:
+                found = self._prefix_past(prompt, inputs.input_ids)
+                if found is not None:
+                    gen_kwargs_full["past_key_values"] = found[0]
+            errors = []
+
+            def run_generate():
+                if self.cpu_allocation:
+                    self.cpu_allocation.apply()
+                try:
+                    if bucket is not None:
+                        with self.static_caches.acquire(bucket) as cache:
+                            self.model.generate(**gen_kwargs_full, past_key_values=cache)
+                    else:
+                        self.model.generate(**gen_kwargs_full)
+                except Exception as e:
+                    errors.append(e)
+                    # разблокируем итератор стримера
+                    streamer.end()
+
             import threading
-            t = threading.Thread(target=self.model.generate, kwargs=gen_kwargs_full)
+            t = threading.Thread(target=run_generate, daemon=True)
             t.start()
             for text in streamer:
-                yield text
+                if cancel_token and cancel_token.cancelled:
+                    token.cancel()
+                if text:
+                    yield text
             t.join()
-        # yield-им чанк в event loop
-        for chunk in await loop.run_in_executor(None, lambda: list(sync_stream())):
-            yield chunk
\ No newline at end of file
+            if errors:
+                raise errors[0]
+        # yield-им каждый чанк в event loop сразу, как его выдал streamer
+        try:
+            async for chunk in stream_from_thread(sync_stream, executor=self.executor):
+                if cancel_token and cancel_token.cancelled:
+                    break
+                yield chunk
+        finally:
+            token.cancel()
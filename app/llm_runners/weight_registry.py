@@ -0,0 +1,86 @@
+# app/llm_runners/weight_registry.py
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from core.config import RUNTIME_PARAMS, SERVICE_PARAMS
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def weight_key(cfg) -> Tuple[str, str, str]:
+    """
+    Ключ общих весов: (type, model_path, params загрузки).
+    Конфиги, отличающиеся только sampling/сервисными полями ("precise"/"creative" варианты), получают один ключ.
+    """
+    load_params = {k: v for k, v in (cfg.params or {}).items() if k not in RUNTIME_PARAMS and k not in SERVICE_PARAMS}
+    return cfg.type.lower(), cfg.model_path, json.dumps(load_params, sort_keys=True, default=str)
+
+
+class _Shared:
+    def __init__(self, value, close: Optional[Callable[[Any], None]]):
+        self.value = value
+        self.close = close
+        self.refs = 1
+
+
+class WeightRegistry:
+    """
+    Загруженные веса (модель + токенизатор), общие для runner'ов с одинаковым weight_key.
+    acquire() грузит при первом обращении и увеличивает refcount, release() уменьшает;
+    на нуле веса отпускаются (close, если задан). Одновременные acquire одного ключа грузят один раз.
+    """
+    def __init__(self):
+        self._entries: Dict[Hashable, _Shared] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable, loader: Callable[[], Any], close: Optional[Callable[[Any], None]] = None):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refs += 1
+                    logger.info(f"[WeightRegistry] Reusing weights of {key[1]} ({entry.refs} runners)")
+                    return entry.value
+            value = loader()
+            with self._lock:
+                self._entries[key] = _Shared(value, close)
+            return value
+
+    def release(self, key: Hashable) -> bool:
+        """Отпустить ссылку; True — это была последняя и веса выгружены."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry.refs -= 1
+            if entry.refs > 0:
+                return False
+            del self._entries[key]
+        if entry.close:
+            try:
+                entry.close(entry.value)
+            except Exception as e:
+                logger.warning(f"[WeightRegistry] Failed to close weights of {key[1]}: {e}")
+        logger.info(f"[WeightRegistry] Released weights of {key[1]}")
+        return True
+
+    def refcount(self, key: Hashable) -> int:
+        entry = self._entries.get(key)
+        return entry.refs if entry else 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"weights": [{"type": key[0], "model_path": key[1], "refs": e.refs}
+                                for key, e in self._entries.items()]}
+
+
+# Singleton
+weight_registry = WeightRegistry()
@@ -0,0 +1,402 @@
+# app/llm_runners/worker_pool.py
+import asyncio
+import itertools
+import multiprocessing as mp
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from core.logging import get_logger
+from llm_runners.cancellation import CancellationToken, GenerationCancelled
+
+logger = get_logger(__name__)
+
+# Как часто монитор проверяет процессы и шлёт ping
+HEARTBEAT_SEC = 5.0
+# Сколько ждать pong от загруженного воркера, прежде чем считать его зависшим
+DEFAULT_HEARTBEAT_TIMEOUT_SEC = 60.0
+# Как часто пробрасывать отмену (CancellationToken — threading.Event, без await)
+CANCEL_POLL_SEC = 0.1
+# Backoff перезапуска воркера, который падает не успев загрузиться
+RESTART_BACKOFF_SEC = 1.0
+MAX_RESTART_BACKOFF_SEC = 60.0
+SHUTDOWN_TIMEOUT_SEC = 10.0
+# Сколько ждать загрузки модели хотя бы одним воркером (hot-swap)
+DEFAULT_LOAD_TIMEOUT_SEC = 1800.0
+
+
+class WorkerError(RuntimeError):
+    """Генерация упала внутри процесса-воркера."""
+
+
+class WorkerCrashedError(WorkerError):
+    """Процесс воркера умер, не ответив на запрос."""
+
+
+def _worker_main(runner_cls, cfg, conn):
+    """
+    Точка входа процесса-воркера: свой runner, свой event loop и свой GIL.
+    Протокол (кортежи по pipe):
+      parent -> worker: ("generate"|"stream", req_id, prompt, kwargs), ("cancel", req_id), ("ping",), ("shutdown",)
+      worker -> parent: (kind, req_id, payload), kind: ready|result|chunk|end|cancelled|error|pong|fatal
+    """
+    from core.logging import setup_logging
+    from services.cpu_budget import apply_cpu_params
+    setup_logging()
+    # Доля ядер от CpuBudgetManager родителя (params.cpu_threads / cpu_set), до загрузки модели
+    apply_cpu_params(cfg.params or {})
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    send_lock = threading.Lock()
+    tokens: Dict[int, CancellationToken] = {}
+
+    def send(msg):
+        with send_lock:
+            conn.send(msg)
+
+    try:
+        runner = runner_cls(cfg)
+    except Exception as e:
+        send(("fatal", None, f"{type(e).__name__}: {e}"))
+        raise
+
+    async def handle(op, req_id, prompt, kwargs):
+        token = tokens[req_id]
+        try:
+            if op == "generate":
+                send(("result", req_id, await runner.generate(prompt, cancel_token=token, **kwargs)))
+            else:
+                async for chunk in runner.generate_stream(prompt, cancel_token=token, **kwargs):
+                    if token.cancelled:
+                        break
+                    send(("chunk", req_id, chunk))
+                send(("cancelled" if token.cancelled else "end", req_id, None))
+        except GenerationCancelled:
+            send(("cancelled", req_id, None))
+        except Exception as e:
+            logger.exception(f"[Worker {cfg.name}] Request {req_id} failed")
+            send(("error", req_id, f"{type(e).__name__}: {e}"))
+        finally:
+            tokens.pop(req_id, None)
+
+    def reader():
+        # Pipe читаем в отдельном потоке: event loop занят генерацией
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                msg = ("shutdown",)
+            op = msg[0]
+            if op == "ping":
+                send(("pong", None, None))
+            elif op == "cancel":
+                token = tokens.get(msg[1])
+                if token:
+                    token.cancel()
+            elif op == "shutdown":
+                loop.call_soon_threadsafe(loop.stop)
+                return
+            else:
+                _, req_id, prompt, kwargs = msg
+                tokens[req_id] = CancellationToken()
+                loop.call_soon_threadsafe(loop.create_task, handle(op, req_id, prompt, kwargs))
+
+    send(("ready", None, None))
+    threading.Thread(target=reader, name=f"worker-reader-{cfg.name}", daemon=True).start()
+    loop.run_forever()
+
+
+class _Worker:
+    """Родительская сторона одного процесса: pipe, запросы в полёте, heartbeat."""
+    def __init__(self, pool: "ProcessWorkerPool", index: int):
+        self.pool = pool
+        self.index = index
+        self.inflight: Dict[int, asyncio.Queue] = {}
+        self.ready = False
+        self.dead = False
+        self.started_at = time.monotonic()
+        self.last_pong = self.started_at
+        parent_conn, child_conn = pool._ctx.Pipe()
+        self.conn = parent_conn
+        self.process = pool._ctx.Process(
+            target=_worker_main,
+            args=(pool.runner_cls, pool.cfg, child_conn),
+            name=f"llm-worker-{pool.cfg.name}-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        threading.Thread(target=self._read, name=f"{self.process.name}-reader", daemon=True).start()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid
+
+    def _read(self):
+        loop = self.pool._loop
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                msg = None
+            try:
+                if msg is None:
+                    loop.call_soon_threadsafe(self.pool._on_worker_exit, self)
+                    return
+                loop.call_soon_threadsafe(self._dispatch, msg)
+            except RuntimeError:
+                # event loop уже закрыт (остановка сервера)
+                return
+
+    def _dispatch(self, msg):
+        kind, req_id, payload = msg
+        if kind == "ready":
+            self.ready = True
+            self.last_pong = time.monotonic()
+            self.pool._backoff = RESTART_BACKOFF_SEC
+            logger.info(f"[WorkerPool] {self.process.name} (pid {self.pid}) ready")
+        elif kind == "pong":
+            self.last_pong = time.monotonic()
+        elif kind == "fatal":
+            logger.error(f"[WorkerPool] {self.process.name} failed to load model: {payload}")
+        else:
+            queue = self.inflight.get(req_id)
+            if queue is not None:
+                queue.put_nowait((kind, payload))
+
+    def submit(self, op: str, req_id: int, prompt: str, kwargs: Dict[str, Any]) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self.inflight[req_id] = queue
+        try:
+            self.conn.send((op, req_id, prompt, kwargs))
+        except (OSError, ValueError) as e:
+            queue.put_nowait(("crashed", f"pipe closed: {e}"))
+        return queue
+
+    def send(self, msg) -> bool:
+        try:
+            self.conn.send(msg)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def fail_inflight(self, reason: str):
+        for queue in self.inflight.values():
+            queue.put_nowait(("crashed", reason))
+        self.inflight.clear()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ProcessWorkerPool:
+    """
+    Runner-совместимый фасад (generate / generate_stream) над N процессами-воркерами одной модели:
+    - каждый воркер грузит свой runner (runner_cls(cfg)) и генерирует вне GIL FastAPI-процесса
+    - запросы и чанки stream'а идут по multiprocessing.Pipe
+    - балансировка: воркер с наименьшим числом запросов в полёте
+    - монитор: ping/pong, упавший или зависший воркер перезапускается, его запросы получают WorkerCrashedError
+    Число воркеров — params.workers, таймаут heartbeat — params.worker_heartbeat_timeout_sec.
+    """
+    def __init__(self, cfg, runner_cls, num_workers: int):
+        self.cfg = cfg
+        self.runner_cls = runner_cls
+        self.num_workers = max(1, int(num_workers))
+        self.heartbeat_timeout = float((cfg.params or {}).get("worker_heartbeat_timeout_sec",
+                                                              DEFAULT_HEARTBEAT_TIMEOUT_SEC))
+        # spawn: torch/CUDA и llama.cpp не переживают fork
+        self._ctx = mp.get_context("spawn")
+        self._workers: List[Optional[_Worker]] = [None] * self.num_workers
+        self._ids = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._backoff = RESTART_BACKOFF_SEC
+        self._closed = False
+        self.restarts = 0
+
+    def _ensure_started(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        for i in range(self.num_workers):
+            self._workers[i] = _Worker(self, i)
+        self._monitor = self._loop.create_task(self._monitor_loop())
+        logger.info(f"[WorkerPool] Started {self.num_workers} worker(s) for {self.cfg.name}")
+
+    async def wait_ready(self, timeout: float = DEFAULT_LOAD_TIMEOUT_SEC):
+        """Запустить воркеры и дождаться, пока хотя бы один загрузит модель."""
+        self._ensure_started()
+        deadline = time.monotonic() + timeout
+        while not any(w is not None and w.ready and not w.dead for w in self._workers):
+            if time.monotonic() > deadline:
+                self.shutdown()
+                raise WorkerError(f"No worker for {self.cfg.name} loaded the model within {timeout:.0f}s")
+            await asyncio.sleep(0.5)
+
+    def _pick(self) -> _Worker:
+        alive = [w for w in self._workers if w is not None and not w.dead]
+        if not alive:
+            raise WorkerCrashedError(f"No live workers for model {self.cfg.name}")
+        # Загруженные воркеры в приоритете, затем наименее занятый
+        return min(alive, key=lambda w: (not w.ready, len(w.inflight), w.index))
+
+    def _on_worker_exit(self, worker: _Worker):
+        if worker.dead:
+            return
+        worker.dead = True
+        # EOF по pipe приходит чуть раньше, чем процесс становится reapable
+        worker.process.join(0.5)
+        code = worker.process.exitcode
+        worker.fail_inflight(f"worker {worker.process.name} exited (code {code})")
+        worker.kill()
+        if self._closed:
+            return
+        logger.error(f"[WorkerPool] {worker.process.name} (pid {worker.pid}) died, exit code {code}; restarting")
+        # Воркер, не успевший загрузиться, перезапускаем с растущей паузой
+        delay = 0.0 if worker.ready else self._backoff
+        if not worker.ready:
+            self._backoff = min(self._backoff * 2, MAX_RESTART_BACKOFF_SEC)
+        self._loop.call_later(delay, self._restart, worker.index)
+
+    def _restart(self, index: int):
+        if self._closed:
+            return
+        self.restarts += 1
+        self._workers[index] = _Worker(self, index)
+
+    async def _monitor_loop(self):
+        while not self._closed:
+            await asyncio.sleep(HEARTBEAT_SEC)
+            now = time.monotonic()
+            for worker in list(self._workers):
+                if worker is None or worker.dead:
+                    continue
+                if not worker.process.is_alive():
+                    self._on_worker_exit(worker)
+                elif worker.ready and now - worker.last_pong > self.heartbeat_timeout:
+                    logger.error(f"[WorkerPool] {worker.process.name} missed heartbeat for "
+                                 f"{now - worker.last_pong:.0f}s; killing")
+                    worker.process.terminate()
+                    self._on_worker_exit(worker)
+                else:
+                    worker.send(("ping",))
+
+    async def _forward_cancel(self, worker: _Worker, req_id: int, token: CancellationToken):
+        while not token.cancelled:
+            await asyncio.sleep(CANCEL_POLL_SEC)
+        worker.send(("cancel", req_id))
+
+    @staticmethod
+    def _raise_for(kind: str, payload):
+        if kind == "cancelled":
+            raise GenerationCancelled()
+        if kind == "crashed":
+            raise WorkerCrashedError(payload)
+        raise WorkerError(payload)
+
+    async def generate(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **kwargs):
+        from services.metrics_service import metrics_service
+        self._ensure_started()
+        worker = self._pick()
+        req_id = next(self._ids)
+        queue = worker.submit("generate", req_id, prompt, kwargs)
+        watcher = asyncio.create_task(self._forward_cancel(worker, req_id, cancel_token)) if cancel_token else None
+        try:
+            kind, payload = await queue.get()
+        finally:
+            worker.inflight.pop(req_id, None)
+            if watcher:
+                watcher.cancel()
+        if kind != "result":
+            if kind != "cancelled":
+                await metrics_service.record_error(model=self.cfg.name)
+            self._raise_for(kind, payload)
+        # Метрики runner'а остались в процессе воркера — пишем их здесь по usage
+        usage = payload.get("usage", {}) if isinstance(payload, dict) else {}
+        await metrics_service.record_request(
+            model=self.cfg.name,
+            tokens=usage.get("tokens_prompt", 0) + usage.get("tokens_result", 0),
+            latency_ms=usage.get("latency_ms", 0),
+        )
+        for spec_kind in ("spec", "lookup"):
+            if f"{spec_kind}_accepted" in usage:
+                await metrics_service.record_speculation(
+                    model=self.cfg.name,
+                    drafted=usage[f"{spec_kind}_drafted"],
+                    accepted=usage[f"{spec_kind}_accepted"],
+                    tokens_per_forward=usage[f"{spec_kind}_tokens_per_forward"],
+                    new_tokens=usage.get(f"{spec_kind}_new_tokens", 0),
+                    kind=spec_kind,
+                )
+        if usage.get("decode_ms_per_token") is not None:
+            await metrics_service.record_decode(
+                model=self.cfg.name,
+                ms_per_token=usage["decode_ms_per_token"],
+                compiled=usage.get("compiled", False),
+            )
+        return payload
+
+    async def generate_stream(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **kwargs):
+        self._ensure_started()
+        worker = self._pick()
+        req_id = next(self._ids)
+        queue = worker.submit("stream", req_id, prompt, kwargs)
+        watcher = asyncio.create_task(self._forward_cancel(worker, req_id, cancel_token)) if cancel_token else None
+        finished = False
+        try:
+            while True:
+                kind, payload = await queue.get()
+                if kind == "chunk":
+                    yield payload
+                    continue
+                finished = True
+                if kind == "end":
+                    return
+                self._raise_for(kind, payload)
+        finally:
+            worker.inflight.pop(req_id, None)
+            if watcher:
+                watcher.cancel()
+            if not finished:
+                # Клиент ушёл посреди stream'а — воркер должен перестать генерировать
+                worker.send(("cancel", req_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": [
+                {
+                    "pid": w.pid,
+                    "alive": not w.dead and w.process.is_alive(),
+                    "ready": w.ready,
+                    "inflight": len(w.inflight),
+                }
+                for w in self._workers if w is not None
+            ],
+            "restarts": self.restarts,
+        }
+
+    def unload(self):
+        self.shutdown()
+
+    def shutdown(self):
+        """Остановить все процессы (reload конфига / остановка сервера)."""
+        self._closed = True
+        if self._monitor:
+            self._monitor.cancel()
+        workers = [w for w in self._workers if w is not None]
+        for worker in workers:
+            worker.dead = True
+            worker.fail_inflight("worker pool shut down")
+            worker.send(("shutdown",))
+        if workers:
+            # join в отдельном потоке, чтобы не блокировать event loop
+            threading.Thread(target=self._join, args=(workers,), daemon=True).start()
+
+    def _join(self, workers: List[_Worker]):
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SEC
+        for worker in workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            worker.kill()
+        logger.info(f"[WorkerPool] Stopped {len(workers)} worker(s) for {self.cfg.name}")
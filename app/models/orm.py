@@ -41,4 +41,28 @@ class RAGHistory(SQLModel, table=True):
     question: str
     context_docs_json: str  # json.dumps([...])
     answer: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class LLMCacheEntry(SQLModel, table=True):
+    """Персистентный (второй) уровень кэша генераций."""
+    key: str = Field(primary_key=True)  # sha256 от (модель, версия конфига, prompt, sampling params)
+    model: str = Field(index=True)
+    response_json: str  # json.dumps({"text", "usage"})
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime
+
+class LLMJob(SQLModel, table=True):
+    """Фоновая генерация (/llm/jobs): очередь, состояние и результат переживают рестарт."""
+    id: str = Field(primary_key=True)  # uuid4 hex
+    model: str
+    prompt: str
+    params: Optional[str] = None  # json.dumps(runtime params)
+    user_id: Optional[str] = None
+    status: str = Field(default="queued", index=True)  # queued | running | done | failed | cancelled
+    result: Optional[str] = None
+    usage_json: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -138,11 +138,29 @@ class BatchGenerateResponseItem(BaseModel):
     result: str
     usage: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    # Позиция в BatchGenerateRequest.requests (в NDJSON-стриме элементы приходят по мере готовности)
+    index: Optional[int] = None
 
 class BatchGenerateResponse(BaseModel):
     results: List[BatchGenerateResponseItem]
     
     
+# --- Фоновые задачи (/llm/jobs) ---
+
+class JobResponse(BaseModel):
+    id: str
+    model: str
+    status: str  # queued | running | done | failed | cancelled
+    result: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    user_id: Optional[str] = None
+    attempts: int = 0
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
 # --- RAG (Retrieval-Augmented Generation) ---
 class RAGRequest(BaseModel):
     model: str
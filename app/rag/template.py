@@ -22,6 +22,22 @@ PROMPT_TEMPLATES = {
     # Можно добавить свои шаблоны для deepseek, mistral и т.д.
 }
 
+# Инструкция, с которой начинаются prompt'ы build_prompt() моделей-генераторов Jenkinsfile
+JENKINS_INSTRUCTION = "Generate a Jenkins pipeline for the given project configuration"
+
+def get_static_prefixes() -> List[str]:
+    """
+    Неизменяемые начала prompt'ов (всё до первого плейсхолдера шаблона + инструкция Jenkins).
+    Раннеры кэшируют по ним prefill (KV/state), чтобы платить только за уникальный суффикс.
+    """
+    prefixes = []
+    for template in PROMPT_TEMPLATES.values():
+        head = template.split("{", 1)[0]
+        if head and head not in prefixes:
+            prefixes.append(head)
+    prefixes.append(JENKINS_INSTRUCTION)
+    return prefixes
+
 def get_prompt_template(model_name):
     for key in PROMPT_TEMPLATES:
         if key in model_name.lower():
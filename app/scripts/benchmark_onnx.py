@@ -0,0 +1,119 @@
+# scripts/benchmark_onnx.py
+"""
+Сравнение PyTorch (eager, CPU) и ONNX Runtime на одной модели и одних prompt'ах:
+
+    python scripts/benchmark_onnx.py --model-path /models/starcoder-1b
+    python scripts/benchmark_onnx.py --model-path codet5p_finetuned --seq2seq --quantize int8
+    python scripts/benchmark_onnx.py --model-path /models/starcoder-1b --threads 8 --runs 5 --max-new-tokens 64
+
+Генерация жадная (do_sample=False), поэтому выводы двух путей должны совпадать —
+для int8 расхождение ожидаемо и тоже печатается. Первый прогон каждого prompt'а — прогрев, в замеры не входит.
+Экспорт ONNX кэшируется в settings.artifact_cache_dir/onnx, так что повторный запуск меряет только инференс.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import torch
+from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer
+
+from core.config import LLMModelConfig
+from core.logging import setup_logging, get_logger
+from llm_runners.onnx_runtime import OnnxRunner
+
+logger = get_logger(__name__)
+
+DEFAULT_PROMPTS = [
+    "pipeline {\n    agent any\n    stages {\n",
+    "Generate a Jenkins declarative pipeline that builds a Maven project and runs unit tests.",
+    "Write a Jenkinsfile stage that builds a Docker image and pushes it to a registry.",
+]
+
+
+def run(name: str, model, tokenizer, prompts, runs: int, gen_kwargs: dict, seq2seq: bool):
+    """Замеры одного пути: латентность запроса и ms на сгенерированный токен."""
+    latencies, per_token, outputs = [], [], []
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        input_len = 0 if seq2seq else inputs.input_ids.shape[1]
+        for i in range(runs + 1):
+            t_start = time.perf_counter()
+            with torch.inference_mode():
+                out = model.generate(input_ids=inputs.input_ids, attention_mask=inputs.attention_mask, **gen_kwargs)
+            elapsed = time.perf_counter() - t_start
+            if i == 0:
+                outputs.append(tokenizer.decode(out[0, input_len:], skip_special_tokens=True))
+                continue
+            new_tokens = max(1, out.shape[1] - input_len)
+            latencies.append(elapsed * 1000)
+            per_token.append(elapsed * 1000 / new_tokens)
+    latencies.sort()
+    return {
+        "name": name,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "ms_per_token": statistics.mean(per_token),
+        "tokens_per_sec": 1000 / statistics.mean(per_token),
+        "outputs": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PyTorch vs ONNX Runtime generation on CPU")
+    parser.add_argument("--model-path", required=True, help="Local model directory or HF id")
+    parser.add_argument("--seq2seq", action="store_true", help="Encoder-decoder model (CodeT5+)")
+    parser.add_argument("--quantize", choices=["none", "int8"], default="none", help="ONNX dynamic quantization")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Intra-op threads for both backends")
+    parser.add_argument("--runs", type=int, default=3, help="Measured runs per prompt (after one warm-up)")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--prompt", action="append", help="Prompt (repeatable; default: built-in set)")
+    args = parser.parse_args()
+
+    setup_logging()
+    prompts = args.prompt or DEFAULT_PROMPTS
+    gen_kwargs = {"max_new_tokens": args.max_new_tokens, "do_sample": False}
+    torch.set_num_threads(args.threads)
+
+    t_start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(args.model_path)
+    model_cls = AutoModelForSeq2SeqLM if args.seq2seq else AutoModelForCausalLM
+    pt_model = model_cls.from_pretrained(args.model_path, torch_dtype=torch.float32).eval()
+    pt_load = time.perf_counter() - t_start
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    gen_kwargs["pad_token_id"] = tokenizer.pad_token_id
+    pytorch = run("pytorch", pt_model, tokenizer, prompts, args.runs, gen_kwargs, args.seq2seq)
+    del pt_model
+
+    t_start = time.perf_counter()
+    runner = OnnxRunner(LLMModelConfig(
+        name="benchmark",
+        type="onnx",
+        model_path=args.model_path,
+        params={
+            "seq2seq": args.seq2seq,
+            "quantize": None if args.quantize == "none" else args.quantize,
+            "n_threads": args.threads,
+        },
+    ))
+    ort_load = time.perf_counter() - t_start
+    onnx = run(f"onnx{'-int8' if runner.quantize else ''}", runner.model, runner.tokenizer,
+               prompts, args.runs, gen_kwargs, args.seq2seq)
+    runner.unload()
+
+    print(f"\nmodel: {args.model_path} | threads: {args.threads} | max_new_tokens: {args.max_new_tokens}")
+    print(f"{'backend':<12}{'load s':>10}{'p50 ms':>12}{'p95 ms':>12}{'ms/token':>12}{'tokens/s':>12}")
+    for res, load in ((pytorch, pt_load), (onnx, ort_load)):
+        print(f"{res['name']:<12}{load:>10.1f}{res['p50_ms']:>12.0f}{res['p95_ms']:>12.0f}"
+              f"{res['ms_per_token']:>12.1f}{res['tokens_per_sec']:>12.1f}")
+    print(f"speedup (tokens/s): x{onnx['tokens_per_sec'] / pytorch['tokens_per_sec']:.2f}")
+    matches = sum(a == b for a, b in zip(pytorch["outputs"], onnx["outputs"]))
+    print(f"greedy outputs identical: {matches}/{len(prompts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# scripts/build_artifacts.py
+"""
+Предсборка кэша квантизованных весов (safetensors) при сборке образа:
+
+    python scripts/build_artifacts.py                      # все HF-модели из models_configuration
+    python scripts/build_artifacts.py deepseek-7b mistral  # только указанные
+    python scripts/build_artifacts.py --cache-dir /artifacts
+
+Модель загружается тем же кодом, что и в сервере (тот же выбор квантизации под железо),
+поэтому собирать нужно на машине с той же конфигурацией CPU/GPU, что и в проде.
+Для моделей type: onnx здесь же выполняется экспорт в ONNX (и int8-квантизация).
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core.config import config_store
+from core.logging import setup_logging, get_logger
+from core.settings import settings
+from services.llm_service import LLM_CLASS_REGISTRY
+
+logger = get_logger(__name__)
+
+
+def build(name: str) -> bool:
+    cfg = config_store.get_model_config(name)
+    runner_cls = LLM_CLASS_REGISTRY.get(cfg.type.lower())
+    if runner_cls is None or runner_cls.__module__.startswith("llm_runners.llama_cpp"):
+        logger.info(f"[build_artifacts] Skipping {name}: type {cfg.type} has no HF weights to quantize")
+        return True
+    try:
+        runner = runner_cls(cfg)
+    except Exception:
+        logger.exception(f"[build_artifacts] Failed to build artifact for {name}")
+        return False
+    if hasattr(runner, "unload"):
+        runner.unload()
+    logger.info(f"[build_artifacts] {name}: done")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-build quantized weight artifacts for HF models")
+    parser.add_argument("models", nargs="*", help="Model names (default: all configured models)")
+    parser.add_argument("--cache-dir", default=settings.artifact_cache_dir, help="Artifact cache directory")
+    args = parser.parse_args()
+
+    setup_logging()
+    settings.artifact_cache_enabled = True
+    settings.artifact_cache_dir = args.cache_dir
+    names = args.models or list(config_store.get_all_model_configs())
+    failed = [name for name in names if not build(name)]
+    if failed:
+        logger.error(f"[build_artifacts] Failed: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# scripts/tune_llama_cpp.py
+"""
+Подбор параметров llama.cpp под текущую машину (замер, а не угадывание):
+
+    python scripts/tune_llama_cpp.py                          # все модели type: llama_cpp
+    python scripts/tune_llama_cpp.py codellama-7b-instruct --dry-run
+    python scripts/tune_llama_cpp.py mistral-7b --threads 4 8 16 --batch 256 512 --pool-sizes 1 2 4
+
+Для каждой модели на типичном Jenkins-prompt'е:
+1. сетка n_threads x n_batch (n_threads_batch = n_threads): prefill tokens/s (до первого токена) и decode tokens/s;
+   n_threads — лучший по decode, n_threads_batch / n_batch — лучшие по prefill
+2. pool_size: суммарный decode tokens/s при p параллельных генерациях (ядра делятся между контекстами)
+3. use_mlock — если модель влезает в RAM и RLIMIT_MEMLOCK позволяет; numa — если NUMA-узлов больше одного
+Результат пишется в params модели в YAML (ConfigStore), сервер подхватит его при перезагрузке конфигов.
+Запускать на узле того же типа, что и прод, без посторонней нагрузки.
+"""
+import argparse
+import glob
+import os
+import platform
+import resource
+import socket
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import psutil
+
+from core.config import config_store
+from core.logging import setup_logging, get_logger
+from rag.template import JENKINS_INSTRUCTION, get_prompt_template
+
+logger = get_logger(__name__)
+
+SAMPLE_CONTEXT = (
+    "**[Pipeline Syntax](https://www.jenkins.io/doc/book/pipeline/syntax/)**\n"
+    "> Declarative Pipeline: pipeline { agent any stages { stage('Build') { steps { sh 'make' } } } }\n"
+    "_Score: 0.91_\n"
+    "**[Using Docker with Pipeline](https://www.jenkins.io/doc/book/pipeline/docker/)**\n"
+    "> agent { docker { image 'maven:3.9-eclipse-temurin-17' } } runs the stage inside a container.\n"
+    "_Score: 0.84_\n"
+)
+SAMPLE_QUESTION = (
+    f"{JENKINS_INSTRUCTION}\n\n"
+    "Project type: java\nBuild tool: maven\nTest frameworks: junit, mockito\nDockerfile present: True\n"
+    "Project files: pom.xml, Dockerfile, src/main/java/App.java, src/test/java/AppTest.java\n"
+    "Dependencies: spring-boot-starter-web, spring-boot-starter-test, lombok\n"
+    "Build (unix): mvn -B package; (windows): mvn.cmd -B package"
+)
+
+
+def sample_prompt(model_name: str) -> str:
+    return get_prompt_template(model_name).format(context_block=SAMPLE_CONTEXT, question=SAMPLE_QUESTION)
+
+
+def numa_nodes() -> int:
+    return len(glob.glob("/sys/devices/system/node/node[0-9]*")) or 1
+
+
+def cpu_name() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def default_thread_grid() -> list:
+    physical = psutil.cpu_count(logical=False) or os.cpu_count() or 4
+    logical = os.cpu_count() or physical
+    return sorted({max(1, physical // 4), max(1, physical // 2), physical, logical})
+
+
+def load(cfg, **overrides):
+    from llama_cpp import Llama
+    params = cfg.params or {}
+    return Llama(
+        model_path=cfg.model_path,
+        n_ctx=params.get("n_ctx", 4096),
+        n_gpu_layers=params.get("n_gpu_layers", 0),
+        use_mmap=True,
+        verbose=False,
+        **overrides,
+    )
+
+
+def measure(llm, prompt: str, decode_tokens: int):
+    """(prefill tokens/s, decode tokens/s) одной генерации с пустым кэшем."""
+    llm.reset()
+    prompt_tokens = len(llm.tokenize(prompt.encode("utf-8")))
+    t_start = time.perf_counter()
+    t_first = None
+    produced = 0
+    for _ in llm(prompt, max_tokens=decode_tokens, temperature=0.0, stream=True):
+        if t_first is None:
+            t_first = time.perf_counter()
+        produced += 1
+    t_end = time.perf_counter()
+    prefill = prompt_tokens / (t_first - t_start) if t_first else 0.0
+    decode = (produced - 1) / (t_end - t_first) if produced > 1 else 0.0
+    return prefill, decode
+
+
+def tune_grid(cfg, prompt: str, threads: list, batches: list, decode_tokens: int, runs: int) -> dict:
+    results = []
+    for n_threads in threads:
+        for n_batch in batches:
+            llm = load(cfg, n_threads=n_threads, n_threads_batch=n_threads, n_batch=n_batch)
+            try:
+                measure(llm, prompt, 4)  # прогрев: page cache, аллокации
+                samples = [measure(llm, prompt, decode_tokens) for _ in range(runs)]
+            finally:
+                llm.close()
+            prefill = statistics.median(s[0] for s in samples)
+            decode = statistics.median(s[1] for s in samples)
+            logger.info(f"[tune] {cfg.name}: n_threads={n_threads} n_batch={n_batch} "
+                        f"prefill={prefill:.1f} tok/s decode={decode:.2f} tok/s")
+            results.append({"n_threads": n_threads, "n_batch": n_batch, "prefill": prefill, "decode": decode})
+    best_decode = max(results, key=lambda r: r["decode"])
+    best_prefill = max(results, key=lambda r: r["prefill"])
+    return {
+        "n_threads": best_decode["n_threads"],
+        "n_threads_batch": best_prefill["n_threads"],
+        "n_batch": best_prefill["n_batch"],
+        "prefill_tps": round(best_prefill["prefill"], 1),
+        "decode_tps": round(best_decode["decode"], 2),
+    }
+
+
+def tune_pool(cfg, prompt: str, best: dict, pool_sizes: list, decode_tokens: int) -> int:
+    """pool_size с максимальным суммарным decode tokens/s при полной загрузке пула."""
+    cores = best["n_threads"]
+    best_size, best_total = 1, 0.0
+    for size in pool_sizes:
+        per_context = max(1, cores // size)
+        contexts = [load(cfg, n_threads=per_context, n_threads_batch=best["n_threads_batch"], n_batch=best["n_batch"])
+                    for _ in range(size)]
+        try:
+            for llm in contexts:
+                measure(llm, prompt, 4)
+            rates = [0.0] * size
+
+            def run(i):
+                rates[i] = measure(contexts[i], prompt, decode_tokens)[1]
+
+            workers = [threading.Thread(target=run, args=(i,)) for i in range(size)]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+        finally:
+            for llm in contexts:
+                llm.close()
+        total = sum(rates)
+        logger.info(f"[tune] {cfg.name}: pool_size={size} (n_threads={per_context} each) "
+                    f"decode total={total:.2f} tok/s, per request={min(rates):.2f} tok/s")
+        if total > best_total:
+            best_size, best_total = size, total
+    return best_size
+
+
+def mlock_fits(cfg) -> bool:
+    size = os.path.getsize(cfg.model_path)
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    limit_ok = soft == resource.RLIM_INFINITY or soft >= size
+    return limit_ok and size * 1.5 < psutil.virtual_memory().total
+
+
+def tune(name: str, args) -> dict:
+    cfg = config_store.get_model_config(name)
+    prompt = sample_prompt(cfg.name)
+    logger.info(f"[tune] {cfg.name}: threads {args.threads}, batches {args.batch}, pool sizes {args.pool_sizes}")
+    best = tune_grid(cfg, prompt, args.threads, args.batch, args.decode_tokens, args.runs)
+    pool_size = tune_pool(cfg, prompt, best, args.pool_sizes, args.decode_tokens)
+    tuned = {
+        "n_threads": max(1, best["n_threads"] // pool_size),
+        "n_threads_batch": best["n_threads_batch"],
+        "n_batch": best["n_batch"],
+        "pool_size": pool_size,
+        "use_mlock": mlock_fits(cfg),
+        "numa": numa_nodes() > 1,
+        # Для какой машины подобрано: на другом типе узла нужен свой прогон
+        "autotune": {
+            "host": socket.gethostname(),
+            "cpu": cpu_name(),
+            "cores": os.cpu_count(),
+            "prefill_tps": best["prefill_tps"],
+            "decode_tps": best["decode_tps"],
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+        },
+    }
+    return tuned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark llama.cpp settings on this host and save the best to YAML")
+    parser.add_argument("models", nargs="*", help="Model names (default: all llama_cpp models)")
+    parser.add_argument("--threads", type=int, nargs="+", default=default_thread_grid(), help="n_threads grid")
+    parser.add_argument("--batch", type=int, nargs="+", default=[128, 256, 512], help="n_batch grid")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 2], help="pool_size grid")
+    parser.add_argument("--decode-tokens", type=int, default=64, help="Tokens generated per measurement")
+    parser.add_argument("--runs", type=int, default=2, help="Measurements per grid point (median)")
+    parser.add_argument("--dry-run", action="store_true", help="Print the result without writing YAML")
+    args = parser.parse_args()
+
+    setup_logging()
+    configs = config_store.get_all_model_configs()
+    names = args.models or [n for n, c in configs.items() if c.type.lower() == "llama_cpp"]
+    for name in names:
+        try:
+            tuned = tune(name, args)
+        except Exception:
+            logger.exception(f"[tune] Failed to tune {name}")
+            continue
+        logger.info(f"[tune] {name}: {tuned}")
+        if not args.dry_run:
+            config_store.update_model_params(name, tuned)
+            logger.info(f"[tune] {name}: saved to YAML")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,11 @@ from api.rag import router as rag_router
 from api.admin import router as admin_router
 from api.history import router as history_router
 from api.metrics import router as metadata_router
+from api.jobs import router as jobs_router
+from services.admission_service import AdmissionError
+from services.llm_service import llm_service
+from services.preload_service import preload_service
+from services.job_service import job_service
 from prometheus_fastapi_instrumentator import Instrumentator
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -42,7 +47,18 @@ async def lifespan(app: FastAPI):
     logger.info("Startup: Starting metrics persist background task.")
     
     task = asyncio.create_task(metrics_persist_task(metrics_service, interval_sec=300))
+    preload_task = None
+    if settings.preload_on_startup:
+        # В фоне: сервер уже отвечает, /readyz отдаёт 503, пока модели не прогреты
+        logger.info("Startup: Preloading and warming up models.")
+        preload_task = preload_service.start()
+    logger.info("Startup: Resuming queued LLM jobs.")
+    await job_service.start()
     yield
+    if preload_task:
+        preload_task.cancel()
+    await job_service.stop()
+    logger.info("Shutdown: Job workers stopped.")
     logger.info("Shutdown: Cancelling metrics persist task.")
     task.cancel()
     try:
@@ -50,6 +66,8 @@ async def lifespan(app: FastAPI):
     except asyncio.CancelledError:
         pass
     logger.info("Shutdown: Persist task stopped.")
+    llm_service.shutdown()
+    logger.info("Shutdown: LLM worker processes stopped.")
 
 app = FastAPI(
     title=settings.app_name,
@@ -77,13 +95,30 @@ app.include_router(llm_router, prefix="/llm", tags=["llm"])
 app.include_router(rag_router, prefix="/llm", tags=["rag"])
 app.include_router(admin_router, prefix="/admin", tags=["admin"])
 app.include_router(history_router, prefix="/llm", tags=["history"])
+app.include_router(jobs_router, prefix="/llm", tags=["jobs"])
 app.include_router(metadata_router, prefix="/metrics", tags=["metadata"])
+@app.exception_handler(AdmissionError)
+async def admission_exception_handler(request: Request, exc: AdmissionError):
+    # Быстрый отказ при перегрузке модели вместо бесконечной очереди
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": str(exc), "model": exc.model},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.exception(f"Unhandled exception: {exc}")
     return JSONResponse(status_code=500, content={"error": str(exc)})
 
 
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Готовность инстанса: 200, когда все preload-модели загружены и прогреты, иначе 503."""
+    status = preload_service.readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
 @app.get("/{full_path:path}")
 async def serve_spa(full_path: str):
     index_path = os.path.join(FRONTEND_DIST, "index.html")
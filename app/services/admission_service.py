@@ -0,0 +1,174 @@
+# app/services/admission_service.py
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Dict, List
+
+from core.logging import get_logger
+from llm_runners.llama_pool import effective_pool_size
+
+logger = get_logger(__name__)
+
+# Лейны приоритета: меньше — раньше
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANE_PRIORITY = {LANE_INTERACTIVE: 0, LANE_BATCH: 1}
+
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_QUEUE_TIMEOUT_SEC = 60.0
+
+
+class AdmissionError(Exception):
+    """Запрос не допущен к модели; status_code отдаётся клиенту как есть."""
+    status_code = 503
+
+    def __init__(self, model: str, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.model = model
+        self.retry_after = retry_after
+
+
+class QueueFullError(AdmissionError):
+    status_code = 429
+
+
+class QueueTimeoutError(AdmissionError):
+    status_code = 503
+
+
+class Ticket:
+    """Занятый слот модели. release() идемпотентен."""
+    def __init__(self, admission: "ModelAdmission", queue_ms: int):
+        self._admission = admission
+        self.queue_ms = queue_ms
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._admission._release()
+
+
+def runner_capacity(params: Dict[str, Any]) -> int:
+    """
+    Лимит одновременных генераций модели: params.max_concurrency, иначе реальная ёмкость runner'а —
+    pool_size контекстов llama.cpp или max_batch_size continuous batching, на каждый процесс-воркер.
+    """
+    if params.get("max_concurrency"):
+        return max(1, int(params["max_concurrency"]))
+    capacity = effective_pool_size(params)
+    if params.get("continuous_batching"):
+        capacity = int(params.get("max_batch_size") or 8)
+    return max(1, capacity) * max(1, int(params.get("workers") or 0))
+
+
+class ModelAdmission:
+    """
+    Bounded очередь одной модели:
+    - не более max_concurrency одновременных генераций
+    - не более max_queue ожидающих, сверх — мгновенный QueueFullError (429)
+    - ожидание дольше queue_timeout_sec — QueueTimeoutError (503)
+    - interactive-лейн обслуживается раньше batch (FIFO внутри лейна)
+    Работает целиком в event loop, поэтому без блокировок.
+    """
+    def __init__(self, model: str, max_concurrency: int = 1, max_queue: int = DEFAULT_MAX_QUEUE,
+                 queue_timeout_sec: float = DEFAULT_QUEUE_TIMEOUT_SEC):
+        self.model = model
+        self.active = 0
+        self._waiters: List[tuple] = []
+        self._seq = itertools.count()
+        self.configure(max_concurrency, max_queue, queue_timeout_sec)
+
+    def configure(self, max_concurrency: int, max_queue: int, queue_timeout_sec: float):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout_sec = float(queue_timeout_sec)
+        self._wake()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, lane: str = LANE_INTERACTIVE) -> Ticket:
+        t_start = time.monotonic()
+        if self.active < self.max_concurrency and not self.queued:
+            self.active += 1
+            return Ticket(self, 0)
+        if self.queued >= self.max_queue:
+            raise QueueFullError(self.model, f"Queue for model {self.model} is full ({self.max_queue})")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (LANE_PRIORITY.get(lane, 0), next(self._seq), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout_sec)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан в момент отмены — возвращаем его
+                self._release()
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise QueueTimeoutError(
+                self.model, f"Timed out after {self.queue_timeout_sec:.0f}s waiting for model {self.model}"
+            )
+        return Ticket(self, int((time.monotonic() - t_start) * 1000))
+
+    def _release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.active < self.max_concurrency:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+class AdmissionService:
+    """Реестр ModelAdmission по именам моделей; лимиты берутся из params в YAML модели."""
+    def __init__(self):
+        self._models: Dict[str, ModelAdmission] = {}
+
+    def for_model(self, cfg) -> ModelAdmission:
+        params = cfg.params or {}
+        name = cfg.name.lower()
+        max_concurrency = runner_capacity(params)
+        max_queue = params.get("max_queue", DEFAULT_MAX_QUEUE)
+        timeout = params.get("queue_timeout_sec", DEFAULT_QUEUE_TIMEOUT_SEC)
+        admission = self._models.get(name)
+        if admission is None:
+            admission = self._models[name] = ModelAdmission(name, max_concurrency, max_queue, timeout)
+        elif (admission.max_concurrency, admission.max_queue, admission.queue_timeout_sec) != (
+                max(1, int(max_concurrency)), max(0, int(max_queue)), float(timeout)):
+            admission.configure(max_concurrency, max_queue, timeout)
+        return admission
+
+    async def acquire(self, cfg, lane: str = LANE_INTERACTIVE) -> Ticket:
+        from services.metrics_service import metrics_service
+        admission = self.for_model(cfg)
+        try:
+            ticket = await admission.acquire(lane)
+        except AdmissionError as e:
+            logger.warning(f"[Admission] Rejected request for model={cfg.name} lane={lane}: {e}")
+            await metrics_service.record_rejection(cfg.name)
+            raise
+        await metrics_service.record_queue_time(cfg.name, ticket.queue_ms)
+        return ticket
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: a.stats() for name, a in self._models.items()}
+
+
+# Singleton
+admission_service = AdmissionService()
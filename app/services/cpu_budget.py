@@ -0,0 +1,176 @@
+# app/services/cpu_budget.py
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from core.config import config_store
+from core.logging import get_logger
+from core.settings import settings
+from llm_runners.llama_pool import effective_pool_size
+
+logger = get_logger(__name__)
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def apply_cpu_params(params: Dict[str, Any]):
+    """
+    Применить к текущему потоку (или процессу-воркеру) params.cpu_set и params.cpu_threads:
+    привязка к ядрам и torch.set_num_threads. Дочерние потоки (OpenMP, ggml) наследуют affinity.
+    torch.set_num_threads действует на весь процесс, поэтому cpu_threads задаётся только там,
+    где процесс принадлежит одному runner'у (процессы-воркеры, params.workers).
+    """
+    cores = params.get("cpu_set")
+    if cores and hasattr(os, "sched_setaffinity"):
+        try:
+            # pid 0 — вызывающий поток
+            os.sched_setaffinity(0, cores)
+        except OSError as e:
+            logger.warning(f"[CpuBudget] Failed to pin thread to cores {cores}: {e}")
+    threads = params.get("cpu_threads")
+    torch = sys.modules.get("torch")
+    if threads and torch is not None and torch.get_num_threads() != int(threads):
+        torch.set_num_threads(int(threads))
+
+
+class CpuAllocation:
+    """
+    Ядра, число потоков и executor одного runner'а.
+    isolated — число потоков действительно своё: процессы-воркеры (torch в своём процессе),
+    n_threads llama.cpp и ONNX Runtime. Runner'ы на torch внутри процесса сервера делят
+    одно process-wide значение torch.get_num_threads(), им достаётся только affinity.
+    """
+    def __init__(self, manager: "CpuBudgetManager", name: str, cores: List[int], concurrency: int, pinned: bool,
+                 isolated: bool):
+        self.manager = manager
+        self.name = name
+        self.cores = cores
+        self.concurrency = concurrency
+        self.pinned = pinned
+        self.isolated = isolated
+        # Потоки одной генерации: ядра делятся между одновременными генерациями runner'а
+        self.threads = max(1, len(cores) // concurrency)
+        # affinity ставится один раз на поток executor'а
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"llm-{name}",
+                                           initializer=self.apply)
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        params = {}
+        if self.isolated:
+            params["cpu_threads"] = self.threads
+        if self.pinned:
+            params["cpu_set"] = list(self.cores)
+        return params
+
+    def apply(self):
+        """Привязать текущий поток к ядрам runner'а (settings.cpu_pinning); число потоков torch не трогает."""
+        if self.pinned:
+            apply_cpu_params({"cpu_set": list(self.cores)})
+
+    def configure(self, cfg):
+        """
+        Копия конфига с потоками из бюджета: cpu_threads/cpu_set для процессов-воркеров,
+        n_threads (llama.cpp, ONNX Runtime) и n_threads_batch (llama.cpp); явные значения из YAML урезаются до бюджета.
+        """
+        params = dict(cfg.params or {})
+        params.update(self.params)
+        keys = {"llama_cpp": ("n_threads", "n_threads_batch"), "onnx": ("n_threads",)}.get(cfg.type.lower(), ())
+        for key in keys:
+            params[key] = min(int(params.get(key) or self.threads), self.threads)
+        return cfg.model_copy(update={"params": params})
+
+    def release(self):
+        self.executor.shutdown(wait=False)
+        self.manager.release(self)
+
+
+class CpuBudgetManager:
+    """
+    Раздел ядер CPU между загруженными runner'ами:
+    - каждому runner'у — свой набор ядер (params.cpu_cores или равная доля на settings.cpu_partitions моделей;
+      0 — по числу загруженных runner'ов вместе с новым, но не меньше числа моделей, загружаемых при старте),
+      выбираются наименее занятые ядра
+    - число потоков = ядра / одновременные генерации runner'а (workers, pool_size для llama.cpp, иначе max_concurrency);
+      своё оно только у процессов-воркеров, llama.cpp и ONNX Runtime (CpuAllocation.isolated)
+    - свой ThreadPoolExecutor того же размера; settings.cpu_pinning — привязка его потоков к ядрам
+    """
+    # Runner'ы, которые сами задают число потоков в своём процессе
+    ISOLATED_TYPES = ("llama_cpp", "onnx")
+
+    def __init__(self):
+        self.cores = available_cores()
+        self._load: Dict[int, int] = {core: 0 for core in self.cores}
+        self._allocations: List[CpuAllocation] = []
+        self._lock = threading.Lock()
+        self._shared_torch_logged = False
+
+    def _partitions(self, name: str) -> int:
+        if settings.cpu_partitions:
+            return settings.cpu_partitions
+        # Загруженные runner'ы и новый; новая версия при hot-swap не считается отдельной моделью
+        with self._lock:
+            loaded = {a.name for a in self._allocations} | {name}
+        configs = config_store.get_all_model_configs()
+        preload = {n for n, c in configs.items() if (c.params or {}).get("preload")}
+        default = config_store.get_default_model()
+        if default:
+            preload.add(default.lower())
+        return max(1, len(loaded), len(preload))
+
+    def allocate(self, name: str, cfg) -> Optional[CpuAllocation]:
+        if not settings.cpu_budget_enabled:
+            return None
+        params = cfg.params or {}
+        wanted = int(params.get("cpu_cores") or len(self.cores) // self._partitions(name))
+        wanted = max(1, min(wanted, len(self.cores)))
+        # Одновременные генерации, делящие ядра: процессы-воркеры, контексты llama.cpp или слоты admission
+        pool_size = effective_pool_size(params) if params.get("pool_size") else None
+        concurrency = int(params.get("workers") or pool_size or params.get("max_concurrency") or 1)
+        isolated = bool(params.get("workers")) or cfg.type.lower() in self.ISOLATED_TYPES
+        with self._lock:
+            # Наименее занятые ядра; при равной занятости — подряд (соседние ядра делят кэш)
+            cores = sorted(sorted(self.cores, key=lambda c: self._load[c])[:wanted])
+            for core in cores:
+                self._load[core] += 1
+            allocation = CpuAllocation(self, name, cores, max(1, min(concurrency, wanted)), settings.cpu_pinning,
+                                       isolated)
+            self._allocations.append(allocation)
+        if isolated:
+            logger.info(f"[CpuBudget] {name}: cores {cores}, {allocation.threads} threads x {allocation.concurrency}")
+        else:
+            logger.info(f"[CpuBudget] {name}: cores {cores}, executor x {allocation.concurrency}; "
+                        f"torch threads are process-wide")
+            if not self._shared_torch_logged:
+                self._shared_torch_logged = True
+                logger.warning("[CpuBudget] torch.set_num_threads is process-wide: in-process torch runners share "
+                               "one thread setting, per-model thread counts apply only with params.workers")
+        return allocation
+
+    def release(self, allocation: CpuAllocation):
+        with self._lock:
+            if allocation not in self._allocations:
+                return
+            self._allocations.remove(allocation)
+            for core in allocation.cores:
+                self._load[core] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cores": len(self.cores),
+                "oversubscribed_cores": sum(1 for n in self._load.values() if n > 1),
+                "runners": [{"model": a.name, "cores": a.cores, "threads": a.threads, "concurrency": a.concurrency,
+                             "isolated": a.isolated}
+                            for a in self._allocations],
+            }
+
+
+# Singleton
+cpu_budget = CpuBudgetManager()
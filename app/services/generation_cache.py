@@ -0,0 +1,151 @@
+# app/services/generation_cache.py
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from core.logging import get_logger
+from core.settings import settings
+
+logger = get_logger(__name__)
+
+# Ключи запроса, управляющие кэшем (в runner не передаются)
+CACHE_PARAM = "cache"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Нормализация, не меняющая смысла: переводы строк, хвостовые пробелы."""
+    lines = prompt.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def config_version(cfg) -> str:
+    """Версия конфига модели: любое изменение YAML инвалидирует старые записи."""
+    raw = json.dumps(cfg.dict(), sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def is_deterministic(params: Dict[str, Any]) -> bool:
+    if params.get("do_sample") is False:
+        return True
+    temperature = params.get("temperature")
+    try:
+        return temperature is not None and float(temperature) <= 0
+    except (TypeError, ValueError):
+        return False
+
+
+def is_cacheable(params: Dict[str, Any]) -> bool:
+    """
+    Кэшируем только детерминированные запросы, либо если клиент явно
+    попросил (params.cache: true). params.cache: false — всегда мимо кэша.
+    """
+    opt = params.get(CACHE_PARAM)
+    if opt is not None:
+        return bool(opt)
+    return is_deterministic(params)
+
+
+class GenerationCache:
+    """
+    Exact-match кэш ответов:
+    - L1: in-memory LRU с TTL (thread-safe)
+    - L2: опционально SQLite (таблица LLMCacheEntry), переживает рестарт
+    Ключ: (модель, версия конфига, нормализованный prompt, sampling params).
+    """
+    def __init__(self, max_entries: int = 1024, ttl_sec: int = 24 * 3600, persist: bool = False):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.persist = persist
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(cfg, prompt: str, params: Dict[str, Any]) -> str:
+        sampling = {k: v for k, v in params.items() if k != CACHE_PARAM}
+        raw = json.dumps({
+            "model": cfg.name.lower(),
+            "config": config_version(cfg),
+            "prompt": normalize_prompt(prompt),
+            "params": sampling,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def _put_memory(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_sec, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_memory(key)
+        if value is not None or not self.persist:
+            return value
+        try:
+            from db.database import get_session
+            from models.orm import LLMCacheEntry
+            async with get_session() as session:
+                entry = await session.get(LLMCacheEntry, key)
+                if entry is None:
+                    return None
+                if entry.expires_at < datetime.utcnow():
+                    await session.delete(entry)
+                    await session.commit()
+                    return None
+                value = json.loads(entry.response_json)
+        except Exception as e:
+            logger.warning(f"[GenerationCache] SQLite lookup failed: {e}")
+            return None
+        # Поднимаем в L1
+        self._put_memory(key, value)
+        return value
+
+    async def put(self, key: str, model: str, value: Dict[str, Any]):
+        self._put_memory(key, value)
+        if not self.persist:
+            return
+        try:
+            from db.database import get_session
+            from models.orm import LLMCacheEntry
+            async with get_session() as session:
+                await session.merge(LLMCacheEntry(
+                    key=key,
+                    model=model,
+                    response_json=json.dumps(value, default=str),
+                    expires_at=datetime.utcnow() + timedelta(seconds=self.ttl_sec),
+                ))
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"[GenerationCache] SQLite store failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Singleton
+generation_cache = GenerationCache(
+    max_entries=settings.generation_cache_size,
+    ttl_sec=settings.generation_cache_ttl_sec,
+    persist=settings.generation_cache_persist,
+)
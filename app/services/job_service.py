@@ -0,0 +1,280 @@
+# app/services/job_service.py
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from core.logging import get_logger
+from core.settings import settings
+from db.database import get_session
+from llm_runners.cancellation import CancellationToken, GenerationCancelled
+from models.orm import LLMJob
+from services.admission_service import AdmissionError, LANE_BATCH, Ticket
+from services.llm_service import llm_service
+
+logger = get_logger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_FINAL = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+# Повтор задачи, не допущенной к модели (очередь admission полна / таймаут)
+JOB_RETRY_SEC = 5.0
+# Как часто stream() проверяет задачу, которая ещё ждёт в очереди
+JOB_POLL_SEC = 0.5
+
+
+class _Progress:
+    """Текст выполняющейся задачи для stream(): растёт по чанкам, подписчики ждут на cond."""
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self.cond = asyncio.Condition()
+
+    async def append(self, chunk: str):
+        async with self.cond:
+            self.text += chunk
+            self.cond.notify_all()
+
+    async def finish(self):
+        async with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+
+class JobService:
+    """
+    Очередь фоновых генераций поверх LLMService (/llm/jobs):
+    - submit() пишет задачу в SQLite (LLMJob) и ставит в очередь; клиент опрашивает get() или читает stream()
+    - settings.job_workers воркеров берут задачи по порядку и генерируют через llm_service.generate_stream
+      в lane batch; не допущенная admission задача повторяется через JOB_RETRY_SEC
+    - при старте задачи queued и прерванные рестартом running возвращаются в очередь (генерация с начала)
+    - cancel(): queued и ждущая слот admission — сразу cancelled, running — отмена на ближайшем decode-шаге
+    """
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._tokens: Dict[str, CancellationToken] = {}
+        # Задачи, взятые воркером, но ещё не получившие слот модели: job_id -> событие отмены ожидания
+        self._admitting: Dict[str, asyncio.Event] = {}
+        self._progress: Dict[str, _Progress] = {}
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        from sqlmodel import select
+        async with get_session() as session:
+            res = await session.exec(
+                select(LLMJob).where(LLMJob.status.in_([JOB_QUEUED, JOB_RUNNING])).order_by(LLMJob.created_at))
+            jobs = res.all()
+            for job in jobs:
+                if job.status == JOB_RUNNING:
+                    job.status = JOB_QUEUED
+                    job.started_at = None
+                    session.add(job)
+                self._queue.put_nowait(job.id)
+            await session.commit()
+        if jobs:
+            logger.info(f"[JobService] Resumed {len(jobs)} job(s) from the database")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(max(1, settings.job_workers))]
+        logger.info(f"[JobService] Started {len(self._workers)} job worker(s)")
+
+    async def stop(self):
+        """Остановить воркеры; прерванные задачи остаются running и продолжатся после рестарта."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, model: str, prompt: str, params: Optional[Dict[str, Any]] = None,
+                     user_id: Optional[str] = None) -> LLMJob:
+        job = LLMJob(
+            id=uuid.uuid4().hex,
+            model=model,
+            prompt=prompt,
+            params=json.dumps(params or {}),
+            user_id=user_id,
+        )
+        async with get_session() as session:
+            session.add(job)
+            await session.commit()
+            await session.refresh(job)
+        self._queue.put_nowait(job.id)
+        logger.info(f"[JobService] Job {job.id} queued (model={model}, user={user_id})")
+        return job
+
+    async def get(self, job_id: str) -> Optional[LLMJob]:
+        async with get_session() as session:
+            return await session.get(LLMJob, job_id)
+
+    async def cancel(self, job_id: str) -> Optional[LLMJob]:
+        token = self._tokens.get(job_id)
+        if token is not None:
+            token.cancel()
+            admitting = self._admitting.get(job_id)
+            if admitting is None:
+                # Статус cancelled запишет воркер, когда генерация остановится
+                return await self.get(job_id)
+            # Ещё ждёт слот модели: снимаем с ожидания, статус — как у задачи из очереди
+            admitting.set()
+        async with get_session() as session:
+            job = await session.get(LLMJob, job_id)
+            if job is not None and job.status == JOB_QUEUED:
+                job.status = JOB_CANCELLED
+                job.finished_at = datetime.utcnow()
+                session.add(job)
+                await session.commit()
+                await session.refresh(job)
+            return job
+
+    async def stream(self, job_id: str) -> AsyncIterator[str]:
+        """Текст задачи по мере генерации: уже сгенерированное сразу, дальше — новые чанки."""
+        sent = 0
+        while True:
+            progress = self._progress.get(job_id)
+            if progress is None:
+                job = await self.get(job_id)
+                if job is None:
+                    return
+                if job.status in JOB_FINAL:
+                    if job.result and len(job.result) > sent:
+                        yield job.result[sent:]
+                    if job.status == JOB_FAILED:
+                        yield f"\n[ERROR]: {job.error}"
+                    return
+                await asyncio.sleep(JOB_POLL_SEC)
+                continue
+            async with progress.cond:
+                await progress.cond.wait_for(lambda: len(progress.text) > sent or progress.done)
+                chunk = progress.text[sent:]
+            if chunk:
+                yield chunk
+                sent += len(chunk)
+            # done: воркер уже убрал progress, итоговый статус (и текст ошибки) — из базы на следующей итерации
+
+    async def _update(self, job_id: str, **fields) -> Optional[LLMJob]:
+        async with get_session() as session:
+            job = await session.get(LLMJob, job_id)
+            if job is None:
+                return None
+            for key, value in fields.items():
+                setattr(job, key, value)
+            session.add(job)
+            await session.commit()
+            await session.refresh(job)
+            return job
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"[JobService] Job {job_id} crashed")
+
+    @staticmethod
+    async def _admit(job: LLMJob, cancelled: asyncio.Event) -> Optional[Ticket]:
+        """Слот модели для задачи; None — задачу отменили раньше, чем слот освободился."""
+        admit = asyncio.ensure_future(llm_service.admit(job.model, LANE_BATCH))
+        waiter = asyncio.ensure_future(cancelled.wait())
+        try:
+            done, _ = await asyncio.wait({admit, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if not admit.done():
+                # Слот, выданный в момент отмены, ModelAdmission вернёт сам
+                admit.cancel()
+        if admit not in done:
+            return None
+        return admit.result()
+
+    async def _run(self, job_id: str):
+        # Токен регистрируется до чтения статуса: cancel() с этого момента не разминётся с воркером
+        token = CancellationToken()
+        cancelled = asyncio.Event()
+        self._tokens[job_id] = token
+        self._admitting[job_id] = cancelled
+        try:
+            job = await self.get(job_id)
+            if job is None or job.status != JOB_QUEUED or token.cancelled:
+                # Отменена, пока ждала в очереди
+                self._tokens.pop(job_id, None)
+                return
+            ticket = await self._admit(job, cancelled)
+        except AdmissionError as e:
+            self._tokens.pop(job_id, None)
+            if token.cancelled:
+                await self._update(job_id, status=JOB_CANCELLED, finished_at=datetime.utcnow())
+                return
+            logger.info(f"[JobService] Job {job_id} not admitted ({e}), retrying in {JOB_RETRY_SEC:.0f}s")
+            asyncio.get_running_loop().call_later(JOB_RETRY_SEC, self._queue.put_nowait, job_id)
+            return
+        except Exception as e:
+            # Неизвестная модель и т.п. — повтор не поможет
+            self._tokens.pop(job_id, None)
+            await self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=datetime.utcnow())
+            return
+        finally:
+            self._admitting.pop(job_id, None)
+        if ticket is None or token.cancelled:
+            # Отменена, пока ждала слот модели (или в момент его выдачи)
+            if ticket is not None:
+                ticket.release()
+            self._tokens.pop(job_id, None)
+            await self._update(job_id, status=JOB_CANCELLED, finished_at=datetime.utcnow())
+            logger.info(f"[JobService] Job {job_id} cancelled before it got model {job.model}")
+            return
+        progress = _Progress()
+        self._progress[job_id] = progress
+        params = json.loads(job.params or "{}")
+        t_start = time.monotonic()
+        chunks = 0
+        try:
+            await self._update(job_id, status=JOB_RUNNING, started_at=datetime.utcnow(), attempts=job.attempts + 1)
+            async for chunk in llm_service.generate_stream(job.model, job.prompt, params=params, user_id=job.user_id,
+                                                           cancel_token=token, ticket=ticket):
+                chunks += 1
+                await progress.append(chunk)
+            if token.cancelled:
+                raise GenerationCancelled()
+            usage = {"chunks": chunks, "latency_ms": int((time.monotonic() - t_start) * 1000),
+                     "queue_ms": ticket.queue_ms}
+            await self._update(job_id, status=JOB_DONE, result=progress.text, usage_json=json.dumps(usage),
+                               finished_at=datetime.utcnow())
+            await llm_service.add_history(job.model, job.prompt, progress.text, job.user_id, params)
+            logger.info(f"[JobService] Job {job_id} done in {usage['latency_ms']}ms")
+        except GenerationCancelled:
+            await self._update(job_id, status=JOB_CANCELLED, result=progress.text, finished_at=datetime.utcnow())
+            logger.info(f"[JobService] Job {job_id} cancelled")
+        except asyncio.CancelledError:
+            # Остановка сервера: задача остаётся running и продолжится после рестарта
+            raise
+        except Exception as e:
+            logger.exception(f"[JobService] Job {job_id} failed")
+            await self._update(job_id, status=JOB_FAILED, result=progress.text, error=f"{type(e).__name__}: {e}",
+                               finished_at=datetime.utcnow())
+        finally:
+            # Статус в базе уже итоговый: stream() дочитает остаток оттуда
+            ticket.release()
+            self._tokens.pop(job_id, None)
+            self._progress.pop(job_id, None)
+            await progress.finish()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            # Взяты воркером, но ждут слот модели в admission
+            "admitting": len(self._admitting),
+            # Прошли admission и генерируют (_progress заводится после получения слота)
+            "running": len(self._progress),
+        }
+
+
+# Singleton
+job_service = JobService()
@@ -1,19 +1,39 @@
 # app/services/llm_service.py
 
-from typing import Optional, Dict, Any
-from core.config import config_store
+import asyncio
+import time
+from typing import Optional, Dict, Any, List
+from core.config import config_store, load_affecting_changes, SERVICE_PARAMS
+from core.logging import get_logger
+from core.settings import settings
+from llm_runners.cancellation import CancellationToken
+from services.cpu_budget import cpu_budget
+from services.admission_service import admission_service, runner_capacity, LANE_BATCH, LANE_INTERACTIVE, Ticket
+from services.generation_cache import generation_cache, is_cacheable, CACHE_PARAM
+from services.metrics_service import metrics_service
+from services.semantic_cache import semantic_cache
 from llm_runners.llama_cpp import LlamaCppRunner
 from llm_runners.transformers import TransformersRunner
+from llm_runners.onnx_runtime import OnnxRunner
 from llm_runners.deepseek import DeepSeekModel
 from llm_runners.mistral import MistralModel
 from llm_runners.codellama import CodeLlamaModel
 from llm_runners.starcoder import StarCoderModel
 from llm_runners.llama2 import Llama2Model
+from llm_runners.worker_pool import ProcessWorkerPool
+from services.runner_registry import RunnerRegistry, RunnerCapacityError, estimate_runner_bytes
 from db.database import get_session
 from models.orm import LLMHistory
 import json
 from datetime import datetime
 
+logger = get_logger(__name__)
+
+# Как часто проверять, не отключился ли клиент
+DISCONNECT_POLL_SEC = 0.25
+# Prompt'ов в одном batched forward, если у модели не задан params.max_batch_size
+DEFAULT_BATCH_CHUNK = 8
+
 LLM_CLASS_REGISTRY = {
     "deepseek": DeepSeekModel,
     "mistral": MistralModel,
@@ -22,60 +42,366 @@ LLM_CLASS_REGISTRY = {
     "llama2": Llama2Model,
     "llama_cpp": LlamaCppRunner,
     "transformers": TransformersRunner,
+    "onnx": OnnxRunner,
 }
 
 class LLMService:
     def __init__(self):
-        self.runners: Dict[str, Any] = {}
-        self.reload_all_runners()
-        config_store.subscribe(self.reload_all_runners)
+        budget_mb = settings.runner_memory_budget_mb
+        # Загруженные runners с LRU-вытеснением по бюджету RAM
+        self.runners = RunnerRegistry(budget_mb * 1024 * 1024 if budget_mb else None)
+        # model -> идущий hot-swap
+        self._reloads: Dict[str, asyncio.Task] = {}
+        config_store.subscribe(self.on_config_change)
+
+    @staticmethod
+    def _runner_key(model_name: str) -> str:
+        return model_name.strip().lower()  # <-- normalize
+
+    @staticmethod
+    def _runner_factory(cfg):
+        model_type = cfg.type.lower()
+        runner_cls = LLM_CLASS_REGISTRY.get(model_type)
+        if not runner_cls:
+            raise RuntimeError(f"Unknown model type: {model_type}")
+
+        def factory():
+            # Доля ядер CPU: число потоков (torch / llama.cpp / ORT), свой executor, опционально affinity
+            allocation = cpu_budget.allocate(cfg.name.lower(), cfg)
+            load_cfg = allocation.configure(cfg) if allocation else cfg
+            try:
+                # params.workers > 0: модель живёт в отдельных процессах, вне GIL сервера
+                workers = int((cfg.params or {}).get("workers", 0) or 0)
+                if workers > 0:
+                    runner = ProcessWorkerPool(load_cfg, runner_cls, workers)
+                else:
+                    runner = runner_cls(load_cfg)
+                    if allocation:
+                        runner.executor = allocation.executor
+            except Exception:
+                if allocation:
+                    allocation.release()
+                raise
+            runner.cpu_allocation = allocation
+            return runner
+        return factory
 
     def get_runner(self, model_name: str):
-        model_name = model_name.strip().lower()  # <-- normalize
+        model_name = self._runner_key(model_name)
         cfg = config_store.get_model_config(model_name)
-        model_type = cfg.type.lower()
-        if model_name not in self.runners:
-            runner_cls = LLM_CLASS_REGISTRY.get(model_type)
-            if not runner_cls:
-                raise RuntimeError(f"Unknown model type: {model_type}")
-            self.runners[model_name] = runner_cls(cfg)
-        return self.runners[model_name]
-
-    def reload_all_runners(self, *_):
-        """Полный reset всех runners (напр., при изменении конфига моделей)."""
-        self.runners = {}
-
-    async def generate(self, model: str, prompt: str, params: Optional[Dict[str, Any]] = None, user_id: Optional[str] = None):
-        cfg = config_store.get_model_config(model)
-        runner = self.get_runner(model)
+        return self.runners.get(model_name, cfg, self._runner_factory(cfg))
+
+    async def get_runner_async(self, model_name: str):
+        """get_runner() для event loop: загрузка модели не блокирует loop."""
+        model_name = self._runner_key(model_name)
+        cfg = config_store.get_model_config(model_name)
+        return await self.runners.get_async(model_name, cfg, self._runner_factory(cfg))
+
+    def on_config_change(self, *_):
+        """
+        Точечный reload по diff старого и нового LLMModelConfig загруженных моделей:
+        - модель удалена из конфига — выгружается после текущих генераций
+        - изменились model_path/type или params загрузки — hot-swap (_hot_swap)
+        - только runtime-поля (temperature, top_p, sampling/сервисные params) — применяются без reload
+        """
+        configs = config_store.get_all_model_configs()
+        for name, runner in self.runners.items():
+            old = self.runners.config_of(name)
+            new = configs.get(name)
+            if new is None:
+                logger.info(f"Model {name} removed from config, unloading")
+                self.runners.retire(name)
+                continue
+            changed = load_affecting_changes(old, new)
+            if changed:
+                logger.info(f"Config of {name} changed ({', '.join(sorted(changed))}), reloading weights")
+                self._schedule_reload(name)
+            elif old != new:
+                logger.info(f"Config of {name} changed (runtime only), applying without reload")
+                allocation = getattr(runner, "cpu_allocation", None)
+                runner.cfg = allocation.configure(new) if allocation else new
+                self.runners.update_config(name, new)
+
+    def _schedule_reload(self, name: str):
+        if name in self._reloads:
+            # Идущий hot-swap после загрузки сверит конфиг и подхватит последнюю версию
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop фоновую загрузку не запустить — следующий запрос загрузит модель заново
+            self.runners.retire(name)
+            return
+        self._reloads[name] = loop.create_task(self._hot_swap(name))
+
+    async def _hot_swap(self, name: str):
+        """
+        Double-buffered reload: новая версия грузится в фоне, старая обслуживает запросы до атомарного swap,
+        затем дорабатывает свои генерации и выгружается. Ошибка загрузки оставляет старую версию.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                cfg = config_store.get_all_model_configs().get(name)
+                if cfg is None or name not in self.runners:
+                    return
+                cfg = cfg.model_copy(deep=True)
+                needed = estimate_runner_bytes(cfg)
+                try:
+                    await loop.run_in_executor(None, self.runners.make_room, name, needed)
+                except RunnerCapacityError:
+                    logger.warning(f"Not enough memory to double-buffer {name}; it will be reloaded on next request")
+                    self.runners.retire(name)
+                    return
+                await metrics_service.record_reload_start(name)
+                try:
+                    runner = await loop.run_in_executor(None, self._runner_factory(cfg))
+                    if isinstance(runner, ProcessWorkerPool):
+                        await runner.wait_ready()
+                except Exception:
+                    logger.exception(f"Hot-swap of {name} failed, keeping the current version")
+                    await metrics_service.record_reload(name, ok=False)
+                    return
+                self.runners.swap(name, runner, cfg, needed)
+                await metrics_service.record_reload(name, ok=True)
+                current = config_store.get_all_model_configs().get(name)
+                if current is None or not load_affecting_changes(cfg, current):
+                    return
+        finally:
+            self._reloads.pop(name, None)
+
+    def shutdown(self):
+        """Выгрузить все runners и остановить процессы-воркеры."""
+        for task in self._reloads.values():
+            task.cancel()
+        self.runners.clear()
+
+    def worker_stats(self) -> Dict[str, Any]:
+        return {name: r.stats() for name, r in self.runners.items() if isinstance(r, ProcessWorkerPool)}
+
+    async def _watch_disconnect(self, request, token: CancellationToken):
+        """Отменить генерацию, как только клиент закрыл соединение."""
+        while not token.cancelled:
+            if await request.is_disconnected():
+                logger.info("Client disconnected, cancelling generation")
+                token.cancel()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SEC)
 
-        # Merge runtime params: model config < request params
-        runtime_params = dict(cfg.params or {})
+    def _runtime_params(self, cfg, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Merge runtime params: model config < request params (без сервисных ключей)."""
+        runtime_params = {k: v for k, v in (cfg.params or {}).items() if k not in SERVICE_PARAMS}
         if params:
             runtime_params.update(params)
         if "temperature" not in runtime_params and hasattr(cfg, "temperature"):
             runtime_params["temperature"] = cfg.temperature
         if "top_p" not in runtime_params and hasattr(cfg, "top_p"):
             runtime_params["top_p"] = cfg.top_p
+        return runtime_params
 
-        result = await runner.generate(prompt, **runtime_params)
-        await self.add_history(model, prompt, result, user_id, runtime_params)
+    async def admit(self, model: str, lane: str = LANE_INTERACTIVE) -> Ticket:
+        """
+        Занять слот модели (bounded очередь с приоритетами).
+        Бросает QueueFullError / QueueTimeoutError — API отдаёт их как 429 / 503.
+        """
+        cfg = config_store.get_model_config(model)
+        return await admission_service.acquire(cfg, lane)
+
+    async def generate(self, model: str, prompt: str, params: Optional[Dict[str, Any]] = None, user_id: Optional[str] = None,
+                       request=None, cancel_token: Optional[CancellationToken] = None, lane: str = LANE_INTERACTIVE):
+        cfg = config_store.get_model_config(model)
+        runtime_params = self._runtime_params(cfg, params)
+
+        # Exact-match кэш: только для детерминированных запросов или по params.cache
+        use_cache = settings.generation_cache_enabled and is_cacheable(runtime_params)
+        runtime_params.pop(CACHE_PARAM, None)
+        cache_key = None
+        embedding = None
+        if use_cache:
+            t_start = time.monotonic()
+            cache_key = generation_cache.make_key(cfg, prompt, runtime_params)
+            cached = await generation_cache.get(cache_key)
+            await metrics_service.record_cache("exact", hit=cached is not None)
+            if cached is not None:
+                cached.setdefault("usage", {}).update({
+                    "cache": "exact",
+                    "latency_ms": int((time.monotonic() - t_start) * 1000),
+                })
+                await self.add_history(model, prompt, cached.get("text", ""), user_id, runtime_params)
+                return cached
+            # Семантический кэш: почти одинаковые prompt'ы (например, другой случайный префикс)
+            if settings.semantic_cache_enabled:
+                try:
+                    cached, similarity, embedding = await semantic_cache.lookup(cfg, prompt, runtime_params)
+                except Exception as e:
+                    logger.warning(f"Semantic cache lookup failed: {e}")
+                    cached = None
+                await metrics_service.record_cache("semantic", hit=cached is not None)
+                if cached is not None:
+                    cached.setdefault("usage", {}).update({
+                        "cache": "semantic",
+                        "similarity": round(similarity, 4),
+                        "latency_ms": int((time.monotonic() - t_start) * 1000),
+                    })
+                    await self.add_history(model, prompt, cached.get("text", ""), user_id, runtime_params)
+                    return cached
+
+        token = cancel_token or CancellationToken()
+        ticket = await self.admit(model, lane)
+        watcher = asyncio.create_task(self._watch_disconnect(request, token)) if request is not None else None
+        try:
+            # get_runner_async возвращает загруженный runner без await, сразу берём in_use:
+            # hot-swap не выгрузит его посреди генерации
+            runner = await self.get_runner_async(model)
+            with self.runners.in_use(self._runner_key(model)):
+                result = await runner.generate(prompt, cancel_token=token, **runtime_params)
+        finally:
+            ticket.release()
+            if watcher:
+                watcher.cancel()
+        # runner может вернуть строку или {"text", "usage"}
+        text = result.get("text", "") if isinstance(result, dict) else result
+        if cache_key:
+            usage = result.get("usage", {}) if isinstance(result, dict) else {}
+            await generation_cache.put(cache_key, cfg.name, {"text": text, "usage": dict(usage)})
+            if embedding is not None:
+                semantic_cache.add(cfg, runtime_params, embedding, {"text": text, "usage": dict(usage)})
+        if isinstance(result, dict) and ticket.queue_ms:
+            result.setdefault("usage", {})["queue_ms"] = ticket.queue_ms
+        await self.add_history(model, prompt, text, user_id, runtime_params)
         return result
 
-    async def generate_stream(self, model: str, prompt: str, params: Optional[Dict[str, Any]] = None, user_id: Optional[str] = None):
+    async def generate_batch(self, items: List[Dict[str, Any]], request=None, lane: str = LANE_BATCH):
+        """
+        Пакетная генерация, items — [{"model", "prompt", "params", "user_id"}]:
+        - exact-match кэш проверяется поэлементно, попадания отдаются сразу
+        - остальное группируется по (модель, runtime params) и режется на части по params.max_batch_size;
+          часть — один runner.generate_batch (batched forward), если runner его умеет, иначе generate на prompt
+        - части одной модели идут не более чем в max_concurrency слотов admission
+        Async-генератор: (index, result | Exception) по мере готовности частей.
+        """
+        token = CancellationToken()
+        watcher = asyncio.create_task(self._watch_disconnect(request, token)) if request is not None else None
+        workers = []
+        try:
+            groups: Dict[tuple, tuple] = {}
+            for i, item in enumerate(items):
+                try:
+                    cfg = config_store.get_model_config(item["model"])
+                except Exception as e:
+                    yield i, e
+                    continue
+                runtime_params = self._runtime_params(cfg, item.get("params"))
+                use_cache = settings.generation_cache_enabled and is_cacheable(runtime_params)
+                runtime_params.pop(CACHE_PARAM, None)
+                cache_key = None
+                if use_cache:
+                    cache_key = generation_cache.make_key(cfg, item["prompt"], runtime_params)
+                    cached = await generation_cache.get(cache_key)
+                    await metrics_service.record_cache("exact", hit=cached is not None)
+                    if cached is not None:
+                        cached.setdefault("usage", {})["cache"] = "exact"
+                        await self.add_history(item["model"], item["prompt"], cached.get("text", ""),
+                                               item.get("user_id"), runtime_params)
+                        yield i, cached
+                        continue
+                key = (self._runner_key(item["model"]), json.dumps(runtime_params, sort_keys=True, default=str))
+                groups.setdefault(key, (cfg, runtime_params, []))[2].append((i, cache_key))
+
+            done: asyncio.Queue = asyncio.Queue()
+            pending = 0
+            for (name, _), (cfg, runtime_params, members) in groups.items():
+                params = cfg.params or {}
+                size = max(1, int(params.get("max_batch_size") or DEFAULT_BATCH_CHUNK))
+                chunks = [members[start:start + size] for start in range(0, len(members), size)]
+                pending += len(chunks)
+                slots = runner_capacity(params)
+                for _ in range(min(slots, len(chunks))):
+                    workers.append(asyncio.create_task(
+                        self._batch_worker(name, cfg, runtime_params, chunks, items, token, lane, done)))
+            while pending:
+                for pair in await done.get():
+                    yield pair
+                pending -= 1
+        finally:
+            token.cancel()
+            for worker in workers:
+                worker.cancel()
+            if watcher:
+                watcher.cancel()
+
+    async def _batch_worker(self, name, cfg, runtime_params, chunks, items, token, lane, done: asyncio.Queue):
+        # Каждая взятая часть обязательно попадает в done, иначе generate_batch ждёт её вечно
+        while chunks:
+            chunk = chunks.pop(0)
+            try:
+                results = await self._generate_chunk(name, cfg, runtime_params, chunk, items, token, lane)
+            except Exception as e:
+                logger.exception(f"Batch chunk of {name} failed")
+                results = [(i, e) for i, _ in chunk]
+            await done.put(results)
+
+    async def _generate_chunk(self, name, cfg, runtime_params, chunk, items, token, lane):
+        """Одна часть батча под одним слотом admission; ошибка части — ошибка каждого её элемента."""
+        prompts = [items[i]["prompt"] for i, _ in chunk]
+        try:
+            ticket = await self.admit(name, lane)
+            try:
+                runner = await self.get_runner_async(name)
+                with self.runners.in_use(name):
+                    if hasattr(runner, "generate_batch"):
+                        results = await runner.generate_batch(prompts, cancel_token=token, **runtime_params)
+                    else:
+                        results = await asyncio.gather(
+                            *(runner.generate(p, cancel_token=token, **runtime_params) for p in prompts),
+                            return_exceptions=True)
+            finally:
+                ticket.release()
+        except Exception as e:
+            return [(i, e) for i, _ in chunk]
+        out = []
+        for (i, cache_key), result in zip(chunk, results):
+            if not isinstance(result, Exception):
+                text = result.get("text", "") if isinstance(result, dict) else result
+                # В кэш — usage без queue_ms этого запроса
+                usage = dict(result.get("usage", {})) if isinstance(result, dict) else {}
+                if isinstance(result, dict) and ticket.queue_ms:
+                    result.setdefault("usage", {})["queue_ms"] = ticket.queue_ms
+                # Ошибка кэша/истории не отменяет готовый результат
+                try:
+                    if cache_key:
+                        await generation_cache.put(cache_key, cfg.name, {"text": text, "usage": usage})
+                    await self.add_history(items[i]["model"], items[i]["prompt"], text, items[i].get("user_id"),
+                                           runtime_params)
+                except Exception as e:
+                    logger.warning(f"Failed to record batch item {i} of {name} in cache/history: {e}")
+            out.append((i, result))
+        return out
+
+    async def generate_stream(self, model: str, prompt: str, params: Optional[Dict[str, Any]] = None, user_id: Optional[str] = None,
+                              request=None, cancel_token: Optional[CancellationToken] = None, ticket: Optional[Ticket] = None):
+        """
+        ticket можно занять заранее через admit(), чтобы отклонить запрос до начала стрима.
+        """
         cfg = config_store.get_model_config(model)
-        runner = self.get_runner(model)
-        runtime_params = dict(cfg.params or {})
-        if params:
-            runtime_params.update(params)
-        if "temperature" not in runtime_params and hasattr(cfg, "temperature"):
-            runtime_params["temperature"] = cfg.temperature
-        if "top_p" not in runtime_params and hasattr(cfg, "top_p"):
-            runtime_params["top_p"] = cfg.top_p
+        runtime_params = self._runtime_params(cfg, params)
+        runtime_params.pop(CACHE_PARAM, None)
 
+        token = cancel_token or CancellationToken()
+        if ticket is None:
+            ticket = await self.admit(model, LANE_INTERACTIVE)
+        watcher = asyncio.create_task(self._watch_disconnect(request, token)) if request is not None else None
         # Stream через async-генератор
-        async for chunk in runner.generate_stream(prompt, **runtime_params):
-            yield chunk
+        try:
+            runner = await self.get_runner_async(model)
+            with self.runners.in_use(self._runner_key(model)):
+                async for chunk in runner.generate_stream(prompt, cancel_token=token, **runtime_params):
+                    yield chunk
+        finally:
+            token.cancel()
+            ticket.release()
+            if watcher:
+                watcher.cancel()
 
     async def add_history(self, model, prompt, response, user_id, params):
         record = LLMHistory(
@@ -2,6 +2,7 @@
 import asyncio
 from collections import defaultdict
 import json
+import time
 from typing import Dict, Any
 from datetime import datetime
 
@@ -25,16 +26,37 @@ class MetricsService:
             "errors": 0,
             "tokens": 0
         })
-        self.models_stats = defaultdict(lambda: {
+        self.models_stats = defaultdict(self._new_model_stats)
+        # cache -> hits/misses ("exact", ...)
+        self.cache_stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        # model -> monotonic-время начала идущего hot-swap (не персистится)
+        self.reloads_in_progress: Dict[str, float] = {}
+        self.last_reset = datetime.utcnow()
+
+    @staticmethod
+    def _new_model_stats() -> Dict[str, Any]:
+        return {
             "requests": 0,
             "tokens": 0,
             "total_latency_ms": 0,
             "total_queue_time_ms": 0,
             "avg_latency_ms": 0.0,
-            "errors": 0
-        })
-        self.last_reset = datetime.utcnow()
-        
+            "errors": 0,
+            "queued": 0,
+            "rejected": 0,
+            # speculative (черновая модель) и lookup (prompt-lookup / n-gram copy)
+            **{f"{kind}_{key}": 0 for kind in ("spec", "lookup")
+               for key in ("drafted", "accepted", "tokens", "generations")},
+            "spec_tokens_per_forward_sum": 0.0,
+            "lookup_tokens_per_forward_sum": 0.0,
+            # decode ms/token: compiled (params.compile) и eager
+            **{f"decode_{mode}_{key}": 0 for mode in ("compiled", "eager") for key in ("ms_sum", "generations")},
+            "reloads": 0,
+            "reload_failures": 0,
+            "last_reload_ms": 0,
+            "total_reload_ms": 0,
+        }
+
     async def record_error(self, model: str = None, user: str = None):
         async with self._lock:
             self.total_errors += 1
@@ -47,6 +69,55 @@ class MetricsService:
         async with self._lock:
             self.total_queue_time_ms += queue_time_ms
             self.models_stats[model]["total_queue_time_ms"] += queue_time_ms
+            self.models_stats[model]["queued"] += 1
+
+    async def record_rejection(self, model: str):
+        """Запрос отклонён admission control (очередь полна / таймаут ожидания)."""
+        async with self._lock:
+            self.models_stats[model]["rejected"] += 1
+
+    async def record_speculation(self, model: str, drafted: int, accepted: int, tokens_per_forward: float,
+                                 new_tokens: int = 0, kind: str = "spec"):
+        """
+        Speculative/prompt-lookup decoding: предложено/принято токенов черновика
+        и токенов на forward основной модели. kind: "spec" | "lookup".
+        """
+        async with self._lock:
+            stats = self.models_stats[model]
+            stats[f"{kind}_drafted"] += drafted
+            stats[f"{kind}_accepted"] += accepted
+            stats[f"{kind}_tokens"] += new_tokens
+            stats[f"{kind}_generations"] += 1
+            stats[f"{kind}_tokens_per_forward_sum"] += tokens_per_forward
+
+    async def record_decode(self, model: str, ms_per_token: float, compiled: bool = False):
+        """Среднее время decode-шага генерации (без prefill); compiled — torch.compile + static KV cache."""
+        async with self._lock:
+            mode = "compiled" if compiled else "eager"
+            stats = self.models_stats[model]
+            stats[f"decode_{mode}_ms_sum"] += ms_per_token
+            stats[f"decode_{mode}_generations"] += 1
+
+    async def record_reload_start(self, model: str):
+        async with self._lock:
+            self.reloads_in_progress[model] = time.monotonic()
+
+    async def record_reload(self, model: str, ok: bool):
+        """Hot-swap модели завершён (ok) или провалился; длительность — от record_reload_start."""
+        async with self._lock:
+            started = self.reloads_in_progress.pop(model, None)
+            duration_ms = int((time.monotonic() - started) * 1000) if started else 0
+            stats = self.models_stats[model]
+            if ok:
+                stats["reloads"] += 1
+                stats["last_reload_ms"] = duration_ms
+                stats["total_reload_ms"] += duration_ms
+            else:
+                stats["reload_failures"] += 1
+
+    async def record_cache(self, cache: str, hit: bool):
+        async with self._lock:
+            self.cache_stats[cache]["hits" if hit else "misses"] += 1
 
     async def record_user(self, user: str, tokens: int):
         async with self._lock:
@@ -93,6 +164,11 @@ class MetricsService:
                 "total_tokens": self.total_tokens,
                 "avg_latency_ms": avg_latency_ms,
                 "models_stats": dict(self.models_stats),
+                "cache_stats": {name: dict(c) for name, c in self.cache_stats.items()},
+                "reloads_in_progress": {
+                    name: int((time.monotonic() - started) * 1000)
+                    for name, started in self.reloads_in_progress.items()
+                },
                 "last_reset": self.last_reset.isoformat(),
             }
 
@@ -126,7 +202,11 @@ class MetricsService:
                 self.total_tokens = snap.total_tokens
                 self.total_errors = snap.total_errors
                 self.total_latency_ms = int(snap.avg_latency_ms * snap.total_requests)  # грубо
-                self.models_stats = json.loads(snap.models_stats_json or '{}')
+                # Мержим со свежим шаблоном: в старых snapshot'ах может не быть новых счётчиков
+                restored = json.loads(snap.models_stats_json or '{}')
+                self.models_stats = defaultdict(self._new_model_stats, {
+                    name: {**self._new_model_stats(), **stats} for name, stats in restored.items()
+                })
                 self.users_stats = json.loads(snap.users_stats_json or '{}')
                 self.last_reset = snap.timestamp
             # Если нет snapshot — просто reset()
@@ -0,0 +1,131 @@
+# app/services/preload_service.py
+import asyncio
+import os
+import time
+from typing import Any, Dict, List
+
+from core.config import config_store
+from core.logging import get_logger
+from llm_runners.worker_pool import ProcessWorkerPool
+from services.runner_registry import weight_files
+
+logger = get_logger(__name__)
+
+# Состояния загрузки модели для /readyz
+STATE_PENDING = "pending"
+STATE_LOADING = "loading"
+STATE_WARMING = "warming"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+WARMUP_PROMPT = "pipeline {\n    agent any\n"
+WARMUP_TOKENS = 8
+# Кусок для чтения файла, если posix_fadvise недоступен
+PREFETCH_CHUNK = 16 * 1024 * 1024
+
+
+def prefetch_weights(cfg) -> int:
+    """
+    Подтянуть файлы весов в page cache до загрузки модели (readahead ядра параллельно с импортами/инициализацией).
+    Возвращает суммарный размер файлов в байтах.
+    """
+    total = 0
+    for path in weight_files(cfg):
+        try:
+            size = os.path.getsize(path)
+            with open(path, "rb") as f:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(f.fileno(), 0, size, os.POSIX_FADV_WILLNEED)
+                else:
+                    while f.read(PREFETCH_CHUNK):
+                        pass
+            total += size
+        except OSError as e:
+            logger.warning(f"[Preload] Failed to prefetch {path}: {e}")
+    return total
+
+
+class PreloadService:
+    """
+    Стартовая загрузка моделей:
+    - AppConfig.default_model и все модели с params.preload: true
+    - prefetch весов в page cache, загрузка runner'а через LLMService (RunnerRegistry)
+    - короткая warm-up генерация (первый inference: аллокации, JIT/кэши ядер)
+    Состояния моделей отдаются в /readyz; ready — когда все целевые модели прогреты.
+    """
+    def __init__(self):
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self.started = False
+        self.finished = False
+
+    def targets(self) -> List[str]:
+        configs = config_store.get_all_model_configs()
+        names = []
+        default = config_store.get_default_model()
+        if default:
+            if default.lower() in configs:
+                names.append(default.lower())
+            else:
+                logger.warning(f"[Preload] Default model {default} has no config, skipping")
+        names += [name for name, cfg in configs.items() if (cfg.params or {}).get("preload") and name not in names]
+        return names
+
+    def start(self) -> asyncio.Task:
+        self.started = True
+        return asyncio.create_task(self.preload_all())
+
+    async def preload_all(self):
+        names = self.targets()
+        for name in names:
+            self.states[name] = {"state": STATE_PENDING}
+        logger.info(f"[Preload] Preloading models: {names}")
+        # По одной: параллельная загрузка нескольких моделей только конкурирует за диск и RAM
+        for name in names:
+            await self.preload(name)
+        self.finished = True
+
+    async def preload(self, name: str):
+        from services.llm_service import llm_service
+        loop = asyncio.get_running_loop()
+        state = self.states.setdefault(name, {"state": STATE_PENDING})
+        try:
+            cfg = config_store.get_model_config(name)
+            state["state"] = STATE_LOADING
+            t_start = time.monotonic()
+            prefetched = await loop.run_in_executor(None, prefetch_weights, cfg)
+            runner = await llm_service.get_runner_async(name)
+            if isinstance(runner, ProcessWorkerPool):
+                await runner.wait_ready()
+            state["load_ms"] = int((time.monotonic() - t_start) * 1000)
+            state["prefetched_bytes"] = prefetched
+
+            state["state"] = STATE_WARMING
+            t_start = time.monotonic()
+            # Напрямую в runner: warm-up не должен попадать в кэши и историю
+            with llm_service.runners.in_use(name):
+                await runner.generate(WARMUP_PROMPT, max_new_tokens=WARMUP_TOKENS, temperature=0.0, do_sample=False)
+            state["warmup_ms"] = int((time.monotonic() - t_start) * 1000)
+            # params.compile: графы скомпилированы при загрузке, здесь — замер eager vs compiled
+            if getattr(runner, "compile_report", None):
+                state["compile"] = runner.compile_report
+            state["state"] = STATE_READY
+            logger.info(f"[Preload] {name} ready: load {state['load_ms']}ms, warm-up {state['warmup_ms']}ms")
+        except Exception as e:
+            state["state"] = STATE_FAILED
+            state["error"] = str(e)
+            logger.exception(f"[Preload] Failed to preload {name}")
+
+    def readiness(self) -> Dict[str, Any]:
+        from services.llm_service import llm_service
+        loaded = {name for name, _ in llm_service.runners.items()}
+        models = {name: dict(state) for name, state in self.states.items()}
+        # Модель, выгруженная после прогрева (вытеснение, удаление из конфига), уже не тёплая
+        for name, state in models.items():
+            if state["state"] == STATE_READY and name not in loaded:
+                state["state"] = STATE_PENDING
+        ready = (self.finished or not self.started) and all(s["state"] == STATE_READY for s in models.values())
+        return {"ready": ready, "models": models}
+
+
+# Singleton
+preload_service = PreloadService()
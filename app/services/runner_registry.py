@@ -0,0 +1,334 @@
+# app/services/runner_registry.py
+import asyncio
+import gc
+import glob
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psutil
+
+from core.logging import get_logger
+from llm_runners.weight_registry import weight_key, weight_registry
+from services.admission_service import AdmissionError
+
+logger = get_logger(__name__)
+
+# Если размер весов не определить (HF id без локальных файлов и без params.memory_mb)
+DEFAULT_RUNNER_MEMORY_MB = 8192
+# Доля физической RAM, если бюджет не задан явно
+AUTO_BUDGET_FRACTION = 0.9
+WEIGHT_PATTERNS = ("*.safetensors", "*.bin", "*.gguf", "*.pt", "*.onnx")
+
+
+class RunnerCapacityError(AdmissionError):
+    """Новая модель не помещается в бюджет RAM, а все загруженные заняты или закреплены."""
+    status_code = 503
+
+
+def weight_files(cfg) -> List[str]:
+    """Локальные файлы весов модели (пусто для HF id, которого нет на диске)."""
+    if os.path.isfile(cfg.model_path):
+        return [cfg.model_path]
+    if os.path.isdir(cfg.model_path):
+        return [f for pattern in WEIGHT_PATTERNS
+                for f in glob.glob(os.path.join(cfg.model_path, "**", pattern), recursive=True)]
+    return []
+
+
+def estimate_runner_bytes(cfg) -> int:
+    """
+    Оценка резидентной памяти runner'а до загрузки:
+    params.memory_mb, иначе размер весов на диске (файл или каталог), иначе DEFAULT_RUNNER_MEMORY_MB.
+    Для params.workers > 0 умножается на число процессов.
+    """
+    params = cfg.params or {}
+    if params.get("memory_mb"):
+        size = int(params["memory_mb"]) * 1024 * 1024
+    else:
+        size = sum(os.path.getsize(f) for f in weight_files(cfg))
+    size = size or DEFAULT_RUNNER_MEMORY_MB * 1024 * 1024
+    return size * max(1, int(params.get("workers", 0) or 0))
+
+
+def _rss() -> int:
+    return psutil.Process().memory_info().rss
+
+
+class _Entry:
+    def __init__(self, runner, cfg, nbytes: int):
+        self.runner = runner
+        # Копия: ConfigStore.set_model_param меняет объект конфига на месте
+        self.cfg = cfg.model_copy(deep=True)
+        self.nbytes = nbytes
+        self.pinned = bool((cfg.params or {}).get("pinned", False))
+        # Процессы-воркеры грузят свои копии весов
+        self.weight_key = None if (cfg.params or {}).get("workers") else weight_key(cfg)
+        self.active = 0
+        self.last_used = time.monotonic()
+        # Заменён новой версией (hot-swap), выгружается после последней генерации
+        self.draining = False
+
+
+class _Loading:
+    """Идущая загрузка модели: место в бюджете уже зарезервировано, остальные ждут future."""
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+        self.future: Future = Future()
+
+
+class RunnerRegistry:
+    """
+    Загруженные runners с глобальным бюджетом RAM:
+    - перед загрузкой новой модели выгружаются LRU-простаивающие runners, пока она не поместится
+    - простаивает = нет генераций в полёте (in_use); params.pinned: true защищает от вытеснения
+    - если освободить место нельзя — RunnerCapacityError (503 + Retry-After)
+    Размер runner'а: оценка до загрузки, после — max(оценка, прирост RSS процесса).
+    Runner на уже загруженных общих весах (WeightRegistry) стоит только прирост RSS; при выгрузке
+    владельца его размер переходит к оставшемуся runner'у с теми же весами.
+    Hot-swap: swap() подменяет runner атомарно, старый дорабатывает свои генерации и выгружается (drain).
+    Блокировка держится только на время операций со словарями: загрузка (factory()), выгрузка и gc идут
+    вне её, параллельные get() той же модели ждут Future идущей загрузки. Из event loop — get_async().
+    """
+    def __init__(self, budget_bytes: Optional[int] = None):
+        self.budget_bytes = budget_bytes or int(psutil.virtual_memory().total * AUTO_BUDGET_FRACTION)
+        self._entries: Dict[str, _Entry] = {}
+        self._draining: List[Tuple[str, _Entry]] = []
+        self._loading: Dict[str, _Loading] = {}
+        self._lock = threading.RLock()
+        self.evictions = 0
+
+    @property
+    def used_bytes(self) -> int:
+        return (sum(e.nbytes for e in list(self._entries.values()))
+                + sum(e.nbytes for _, e in list(self._draining))
+                + sum(l.nbytes for l in list(self._loading.values())))
+
+    def get(self, name: str, cfg, factory: Callable[[], Any]):
+        """
+        Вернуть runner модели, при необходимости освободив место и загрузив его через factory().
+        Блокирует на время загрузки — вызывать из потока; из event loop — get_async().
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                return entry.runner
+            loading = self._loading.get(name)
+            if loading is not None:
+                owner, victims = False, []
+            else:
+                shared = not (cfg.params or {}).get("workers") and weight_key(cfg) in weight_registry
+                needed = 0 if shared else estimate_runner_bytes(cfg)
+                victims = self._make_room(name, needed)
+                loading = self._loading[name] = _Loading(needed)
+                owner = True
+        if not owner:
+            return loading.future.result()
+        self._release_all(victims)
+        try:
+            rss_before = _rss()
+            runner = factory()
+            loaded = max(0, _rss() - rss_before)
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(name, None)
+            loading.future.set_exception(e)
+            raise
+        nbytes = needed if (cfg.params or {}).get("workers") else max(needed, loaded)
+        with self._lock:
+            self._loading.pop(name, None)
+            self._entries[name] = _Entry(runner, cfg, nbytes)
+        loading.future.set_result(runner)
+        logger.info(f"[RunnerRegistry] Loaded {name}{' (shared weights)' if shared else ''}: "
+                    f"~{nbytes / 2**20:.0f} MB ({self.used_bytes / 2**20:.0f}/{self.budget_bytes / 2**20:.0f} MB used)")
+        return runner
+
+    async def get_async(self, name: str, cfg, factory: Callable[[], Any]):
+        """
+        get() для event loop: загрузка идёт в executor'е, идущая загрузка той же модели ожидается через
+        её Future. Загруженный runner возвращается без await — вызывающий сразу берёт in_use().
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                return entry.runner
+            loading = self._loading.get(name)
+            if loading is not None:
+                await asyncio.wrap_future(loading.future)
+            else:
+                await loop.run_in_executor(None, self.get, name, cfg, factory)
+
+    def make_room(self, name: str, needed: int):
+        """Освободить место под needed байт (например, под второй буфер при hot-swap)."""
+        with self._lock:
+            victims = self._make_room(name, needed)
+        self._release_all(victims)
+
+    def _make_room(self, name: str, needed: int) -> List[Tuple[str, _Entry]]:
+        """
+        Под блокировкой: убрать из реестра LRU-простаивающие runners, пока needed не поместится;
+        выгружает их вызывающий, уже без блокировки. Если места не хватит и после вытеснения
+        всех простаивающих — RunnerCapacityError, ничего не вытесняя.
+        """
+        excess = self.used_bytes + needed - self.budget_bytes
+        if excess <= 0:
+            return []
+        idle = sorted(((n, e) for n, e in self._entries.items() if not e.pinned and e.active == 0 and n != name),
+                      key=lambda item: item[1].last_used)
+        victims = []
+        for victim, entry in idle:
+            if excess <= 0:
+                break
+            victims.append((victim, entry))
+            excess -= entry.nbytes
+        if excess > 0 and len(victims) < len(self._entries):
+            raise RunnerCapacityError(
+                name,
+                f"Not enough memory to load model {name}: "
+                f"{needed / 2**20:.0f} MB needed, {self.used_bytes / 2**20:.0f}/"
+                f"{self.budget_bytes / 2**20:.0f} MB used by busy or pinned models",
+                retry_after=5,
+            )
+        for victim, _ in victims:
+            logger.info(f"[RunnerRegistry] Evicting idle model {victim} to load {name}")
+            self._entries.pop(victim)
+            self.evictions += 1
+        if excess > 0:
+            logger.warning(f"[RunnerRegistry] Model {name} (~{needed / 2**20:.0f} MB) exceeds "
+                           f"memory budget {self.budget_bytes / 2**20:.0f} MB; loading anyway")
+        return victims
+
+    def _release_all(self, victims: List[Tuple[str, _Entry]]):
+        for victim, entry in victims:
+            self._release(victim, entry)
+
+    @contextmanager
+    def in_use(self, name: str):
+        """
+        Пометить runner занятым на время генерации (занятые не вытесняются).
+        Вызывается только из event loop, поэтому счётчик active меняется без блокировки:
+        потоки загрузки его лишь читают при выборе жертв вытеснения.
+        """
+        entry = self._entries.get(name)
+        if entry is not None:
+            entry.active += 1
+            entry.last_used = time.monotonic()
+        try:
+            yield
+        finally:
+            drained = False
+            if entry is not None:
+                entry.active -= 1
+                entry.last_used = time.monotonic()
+                if entry.draining and entry.active == 0 and (name, entry) in self._draining:
+                    self._draining.remove((name, entry))
+                    drained = True
+            if drained:
+                logger.info(f"[RunnerRegistry] Old version of {name} drained")
+                self._release(name, entry)
+
+    def swap(self, name: str, runner, cfg, nbytes: int):
+        """Атомарно подменить runner модели; старый выгружается, когда закончатся его генерации."""
+        with self._lock:
+            old = self._entries.get(name)
+            self._entries[name] = _Entry(runner, cfg, nbytes)
+        if old is not None:
+            self._retire(name, old)
+        logger.info(f"[RunnerRegistry] Swapped in new version of {name}")
+
+    def retire(self, name: str):
+        """Убрать модель из реестра без прерывания идущих генераций (следующий get загрузит заново)."""
+        with self._lock:
+            entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._retire(name, entry)
+
+    def _retire(self, name: str, entry: _Entry):
+        with self._lock:
+            if self._entries.get(name) is entry:
+                self._entries.pop(name)
+            if entry.active > 0:
+                entry.draining = True
+                self._draining.append((name, entry))
+                return
+        self._release(name, entry)
+
+    def unload(self, name: str):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._release(name, entry)
+
+    def _release(self, name: str, entry: _Entry):
+        unload = getattr(entry.runner, "unload", None)
+        if unload:
+            try:
+                unload()
+            except Exception as e:
+                logger.warning(f"[RunnerRegistry] Failed to unload {name}: {e}")
+        allocation = getattr(entry.runner, "cpu_allocation", None)
+        if allocation is not None:
+            allocation.release()
+        if entry.weight_key is not None and entry.weight_key in weight_registry:
+            # Веса остались у другого runner'а — их размер теперь числится за ним
+            with self._lock:
+                heir = next((e for e in list(self._entries.values()) + [e for _, e in self._draining]
+                             if e.weight_key == entry.weight_key), None)
+                if heir is not None:
+                    heir.nbytes += entry.nbytes
+        del entry
+        gc.collect()
+        # torch может быть не импортирован (только llama.cpp модели)
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def config_of(self, name: str):
+        """Конфиг, с которым runner был загружен (или последний применённый через update_config)."""
+        entry = self._entries.get(name)
+        return entry.cfg if entry else None
+
+    def update_config(self, name: str, cfg):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return
+            entry.cfg = cfg.model_copy(deep=True)
+            entry.pinned = bool((cfg.params or {}).get("pinned", False))
+            # У runner'а на чужих общих весах своя доля — только прирост RSS
+            if entry.weight_key is None or weight_registry.refcount(entry.weight_key) <= 1:
+                entry.nbytes = max(entry.nbytes, estimate_runner_bytes(cfg))
+
+    def clear(self):
+        for name in list(self._entries):
+            self.unload(name)
+
+    def items(self):
+        return [(n, e.runner) for n, e in list(self._entries.items())]
+
+    def values(self):
+        return [e.runner for e in list(self._entries.values())]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def stats(self) -> Dict[str, Any]:
+        # Без блокировки (читается из event loop): снимки словарей, значения могут отставать на одну операцию
+        return {
+            "budget_bytes": self.budget_bytes,
+            "used_bytes": self.used_bytes,
+            "evictions": self.evictions,
+            "runners": {
+                n: {"bytes": e.nbytes, "pinned": e.pinned, "active": e.active}
+                for n, e in list(self._entries.items())
+            },
+            "loading": {n: {"bytes": l.nbytes} for n, l in list(self._loading.items())},
+            "draining": [{"model": n, "bytes": e.nbytes, "active": e.active} for n, e in list(self._draining)],
+        }
@@ -0,0 +1,100 @@
+# app/services/semantic_cache.py
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.logging import get_logger
+from core.settings import settings
+from services.generation_cache import config_version, normalize_prompt, CACHE_PARAM
+
+logger = get_logger(__name__)
+
+
+class _Partition:
+    """Эмбеддинги и ответы одной (модель, версия конфига, sampling params)."""
+    def __init__(self):
+        self.embeddings: Optional[np.ndarray] = None  # [N, D], L2-нормированные
+        self.values: List[Dict[str, Any]] = []
+
+
+class SemanticCache:
+    """
+    Кэш по смыслу prompt'а:
+    - prompt эмбеддится SentenceTransformer'ом из RetrieverService (без второй модели в памяти)
+    - эмбеддинги прошлых prompt'ов лежат в NumPy-матрице, поиск — cosine через dot product
+    - ответ возвращается, если лучшая похожесть >= threshold
+    Разделён по модели/версии конфига/sampling params, FIFO-вытеснение сверх max_entries.
+    """
+    def __init__(self, threshold: float = 0.97, max_entries: int = 2048):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._partitions: Dict[str, _Partition] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _partition_key(cfg, params: Dict[str, Any]) -> str:
+        sampling = {k: v for k, v in params.items() if k != CACHE_PARAM}
+        raw = json.dumps({"model": cfg.name.lower(), "config": config_version(cfg), "params": sampling},
+                         sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _embed(prompt: str) -> np.ndarray:
+        from services.retriever_service import retriever_service
+        vec = retriever_service.embedder.encode([normalize_prompt(prompt)], normalize_embeddings=True)
+        return np.asarray(vec[0], dtype=np.float32)
+
+    async def embed(self, prompt: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._embed, prompt)
+
+    def _search(self, key: str, embedding: np.ndarray) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            part = self._partitions.get(key)
+            if part is None or part.embeddings is None:
+                return None
+            scores = part.embeddings @ embedding
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None
+            return copy.deepcopy(part.values[best]), similarity
+
+    async def lookup(self, cfg, prompt: str, params: Dict[str, Any],
+                     embedding: Optional[np.ndarray] = None) -> Tuple[Optional[Dict[str, Any]], float, np.ndarray]:
+        """Возвращает (ответ или None, similarity, эмбеддинг prompt'а для последующего add)."""
+        if embedding is None:
+            embedding = await self.embed(prompt)
+        found = self._search(self._partition_key(cfg, params), embedding)
+        if found is None:
+            return None, 0.0, embedding
+        value, similarity = found
+        return value, similarity, embedding
+
+    def add(self, cfg, params: Dict[str, Any], embedding: np.ndarray, value: Dict[str, Any]):
+        key = self._partition_key(cfg, params)
+        with self._lock:
+            part = self._partitions.setdefault(key, _Partition())
+            row = embedding.reshape(1, -1)
+            part.embeddings = row if part.embeddings is None else np.vstack([part.embeddings, row])
+            part.values.append(copy.deepcopy(value))
+            overflow = len(part.values) - self.max_entries
+            if overflow > 0:
+                part.embeddings = part.embeddings[overflow:]
+                part.values = part.values[overflow:]
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+
+# Singleton
+semantic_cache = SemanticCache(
+    threshold=settings.semantic_cache_threshold,
+    max_entries=settings.semantic_cache_size,
+)
@@ -0,0 +1,21 @@
+"""Shared setup for tests of the LLM server in app/.
+
+The app modules import each other as top-level packages (core, services,
+llm_runners, ...) and read their configuration relative to app/, so the
+tests run with app/ on sys.path and as the working directory. The SQLite
+database and the log file are redirected to a temporary directory before
+any app module is imported.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+APP_ROOT: str = str(Path(__file__).resolve().parent.parent.parent / "app")
+TMP_DIR: str = tempfile.mkdtemp(prefix="llm-server-tests-")
+
+os.environ.setdefault("DB_URL", f"sqlite+aiosqlite:///{TMP_DIR}/test.sqlite")
+os.environ.setdefault("LOG_PATH", os.path.join(TMP_DIR, "app.log"))
+if APP_ROOT not in sys.path:
+    sys.path.insert(0, APP_ROOT)
+os.chdir(APP_ROOT)
@@ -0,0 +1,76 @@
+"""Tests for per-model admission control (app/services/admission_service.py).
+
+Example:
+    $ pytest tests/app/test_admission.py
+"""
+import asyncio
+
+import pytest
+
+from services.admission_service import (
+    LANE_BATCH,
+    LANE_INTERACTIVE,
+    ModelAdmission,
+    QueueFullError,
+    QueueTimeoutError,
+    runner_capacity,
+)
+
+
+@pytest.mark.parametrize("params, expected", [
+    ({}, 1),
+    ({"max_concurrency": 3}, 3),
+    ({"pool_size": 4}, 4),
+    ({"continuous_batching": True, "max_batch_size": 16}, 16),
+    ({"continuous_batching": True}, 8),
+    ({"workers": 2}, 2),
+    ({"workers": 2, "pool_size": 2}, 4),
+    ({"max_concurrency": 1, "pool_size": 4}, 1),
+    ({"pool_size": 4, "n_gpu_layers": 20}, 1),
+    ({"pool_size": 4, "n_gpu_layers": 0}, 4),
+])
+def test_runner_capacity(params, expected):
+    assert runner_capacity(params) == expected
+
+
+def test_slots_queue_and_lane_priority():
+    async def scenario():
+        admission = ModelAdmission("m", max_concurrency=1, max_queue=4, queue_timeout_sec=5)
+        first = await admission.acquire()
+        order = []
+
+        async def wait(lane, tag):
+            ticket = await admission.acquire(lane)
+            order.append(tag)
+            ticket.release()
+
+        batch = asyncio.create_task(wait(LANE_BATCH, "batch"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(wait(LANE_INTERACTIVE, "interactive"))
+        await asyncio.sleep(0)
+        assert admission.stats()["queued"] == 2
+        first.release()
+        await asyncio.gather(batch, interactive)
+        return order, admission.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["interactive", "batch"]
+    assert stats["active"] == 0 and stats["queued"] == 0
+
+
+def test_queue_full_and_timeout():
+    async def scenario():
+        admission = ModelAdmission("m", max_concurrency=1, max_queue=1, queue_timeout_sec=0.05)
+        ticket = await admission.acquire()
+        waiter = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await admission.acquire()
+        with pytest.raises(QueueTimeoutError):
+            await waiter
+        ticket.release()
+        ticket.release()  # idempotent
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["active"] == 0
@@ -0,0 +1,67 @@
+"""Tests for LLMService.generate_batch (app/services/llm_service.py).
+
+A batch must always finish: failures while recording results or in a
+whole chunk are reported per item instead of leaving the caller waiting.
+
+Example:
+    $ pytest tests/app/test_batch_generate.py
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlmodel")
+pytest.importorskip("aiosqlite")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from core.config import LLMModelConfig, config_store
+from core.settings import settings
+from services.llm_service import llm_service
+
+
+class FakeRunner:
+    async def generate_batch(self, prompts, cancel_token=None, **kwargs):
+        return [{"text": p.upper(), "usage": {"tokens_result": 1}} for p in prompts]
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    cfg = LLMModelConfig(name="fake", type="fake", model_path="/models/fake", params={"max_batch_size": 2})
+    runner = FakeRunner()
+
+    async def get_runner_async(name):
+        return runner
+
+    monkeypatch.setattr(settings, "generation_cache_enabled", False)
+    monkeypatch.setattr(config_store, "get_model_config", lambda name: cfg)
+    monkeypatch.setattr(llm_service, "get_runner_async", get_runner_async)
+    return cfg
+
+
+def run_batch(prompts):
+    items = [{"model": "fake", "prompt": p, "params": {}} for p in prompts]
+
+    async def collect():
+        return [pair async for pair in llm_service.generate_batch(items)]
+
+    return dict(asyncio.run(asyncio.wait_for(collect(), timeout=10)))
+
+
+def test_history_failure_does_not_hang_batch(fake_model, monkeypatch):
+    async def broken_history(*args, **kwargs):
+        raise RuntimeError("history db is down")
+
+    monkeypatch.setattr(llm_service, "add_history", broken_history)
+    results = run_batch(["a", "b", "c"])
+    assert {i: r["text"] for i, r in results.items()} == {0: "A", 1: "B", 2: "C"}
+
+
+def test_failed_chunk_is_reported_per_item(fake_model, monkeypatch):
+    async def broken_chunk(*args, **kwargs):
+        raise RuntimeError("chunk failed")
+
+    monkeypatch.setattr(llm_service, "_generate_chunk", broken_chunk)
+    results = run_batch(["a", "b", "c"])
+    assert sorted(results) == [0, 1, 2]
+    assert all(isinstance(r, RuntimeError) for r in results.values())
@@ -0,0 +1,223 @@
+"""Tests for continuous batching (app/llm_runners/batching.py).
+
+A tiny randomly initialised Llama model is driven through
+ContinuousBatchScheduler and compared with sequential greedy
+model.generate, including sequences admitted while others are decoding
+and sequences evicted at different steps.
+
+Example:
+    $ pytest tests/app/test_batching.py
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from llm_runners.batching import ContinuousBatchScheduler
+
+VOCAB = 64
+EOS = VOCAB - 1
+PAD = 0
+
+
+class IdTokenizer:
+    """Prompt "5 17 3" <-> token ids [5, 17, 3]; enough for the scheduler."""
+    eos_token_id = EOS
+    pad_token_id = PAD
+
+    def encode(self, text):
+        return [int(t) for t in text.split()]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(f" {i}" for i in ids if not (skip_special_tokens and i == EOS))
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=VOCAB,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=256,
+        eos_token_id=EOS,
+        pad_token_id=PAD,
+        attn_implementation="eager",
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+def sequential_greedy(model, prompt, max_new_tokens):
+    ids = torch.tensor([IdTokenizer().encode(prompt)])
+    with torch.inference_mode():
+        out = model.generate(
+            input_ids=ids,
+            attention_mask=torch.ones_like(ids),
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            eos_token_id=EOS,
+            pad_token_id=PAD,
+        )
+    return prompt + IdTokenizer().decode(out[0, ids.shape[1]:].tolist())
+
+
+@pytest.fixture
+def scheduler(model):
+    sched = ContinuousBatchScheduler(model, IdTokenizer(), torch.device("cpu"), max_batch_size=4, name="tiny")
+    yield sched
+    sched.stop()
+
+
+def test_batched_greedy_matches_sequential(model, scheduler):
+    requests = [("1 2 3 4 5", 6), ("7 8", 12), ("9 10 11 12 13 14 15", 3), ("20 21 22", 9)]
+    futures = [scheduler.submit(p, max_new_tokens=n, do_sample=False) for p, n in requests]
+    results = [f.result(timeout=60)["text"] for f in futures]
+    assert results == [sequential_greedy(model, p, n) for p, n in requests]
+
+
+def test_admission_mid_decode_and_eviction(model, scheduler):
+    admitted_while_active = []
+    original_admit = scheduler._admit
+
+    def spy_admit(seqs):
+        admitted_while_active.append(len(scheduler._active))
+        original_admit(seqs)
+
+    scheduler._admit = spy_admit
+    first = scheduler.submit("3 1 4 1 5", max_new_tokens=24, do_sample=False)
+    deadline = time.monotonic() + 30
+    while not scheduler._active and time.monotonic() < deadline:
+        time.sleep(0.001)
+    # Short and long sequences join the running batch and leave it at different steps
+    late = [("2 7 1 8", 2), ("6 6", 15), ("1 1 2 3 5 8", 7)]
+    late_futures = [scheduler.submit(p, max_new_tokens=n, do_sample=False) for p, n in late]
+
+    assert first.result(timeout=60)["text"] == sequential_greedy(model, "3 1 4 1 5", 24)
+    for (p, n), f in zip(late, late_futures):
+        assert f.result(timeout=60)["text"] == sequential_greedy(model, p, n)
+    assert any(active > 0 for active in admitted_while_active)
+
+
+def test_running_sequences_decode_while_new_ones_arrive(scheduler):
+    """A steady stream of arrivals must not starve the sequences already in the batch."""
+    first = scheduler.submit("4 4 4", max_new_tokens=20, do_sample=False)
+    stop = threading.Event()
+
+    def arrivals():
+        while not stop.is_set():
+            scheduler.submit("5 5", max_new_tokens=1, do_sample=False)
+            time.sleep(0.0005)
+
+    feeder = threading.Thread(target=arrivals, daemon=True)
+    feeder.start()
+    try:
+        assert first.result(timeout=60)["usage"]["tokens_result"] == 20
+    finally:
+        stop.set()
+        feeder.join()
+
+
+def test_sampling_params_and_routing():
+    assert ContinuousBatchScheduler.supports({"temperature": 0.7, "top_k": 20, "repetition_penalty": 1.1})
+    assert not ContinuousBatchScheduler.supports({"temperature": 0.7, "no_repeat_ngram_size": 3})
+
+
+def test_top_k_one_is_greedy(model, scheduler):
+    sampled = scheduler.submit("8 9 10", max_new_tokens=8, do_sample=True, temperature=1.0, top_k=1)
+    assert sampled.result(timeout=60)["text"] == sequential_greedy(model, "8 9 10", 8)
+
+
+def test_unsupported_params_are_rejected(scheduler):
+    with pytest.raises(ValueError):
+        scheduler.submit("1 2", max_new_tokens=2, no_repeat_ngram_size=2)
+
+
+def make_hf_runner(model, monkeypatch, name, **params):
+    """TransformersRunner over the tiny model; weights are not read from disk."""
+    from core.config import LLMModelConfig
+    from llm_runners import transformers as hf
+
+    monkeypatch.setattr(hf, "load_causal_lm", lambda *args, **kwargs: model)
+    monkeypatch.setattr(hf.AutoTokenizer, "from_pretrained", lambda *args, **kwargs: IdTokenizer())
+    monkeypatch.setattr(hf, "pipeline", lambda *args, **kwargs: None)
+    cfg = LLMModelConfig(name=name, type="transformers", model_path=f"/models/{name}",
+                         params={"device": "cpu", "prefix_cache": False, **params})
+    return hf.TransformersRunner(cfg)
+
+
+@pytest.fixture
+def hf_runner(model, monkeypatch):
+    runner = make_hf_runner(model, monkeypatch, "tiny-cb", continuous_batching=True, max_batch_size=4, max_queue=8)
+    yield runner
+    runner.unload()
+
+
+def test_service_batch_goes_through_scheduler(model, hf_runner, monkeypatch):
+    """LLMService passes the model's full params; generate_batch must still route them to the scheduler."""
+    pytest.importorskip("sqlmodel")
+    pytest.importorskip("aiosqlite")
+
+    from core.config import config_store
+    from core.settings import settings
+    from services.llm_service import llm_service
+
+    prompts = ["1 2 3", "7 8", "9 10 11 12"]
+    expected = [sequential_greedy(model, p, 5) for p in prompts]
+    submitted = []
+    original_submit = hf_runner.scheduler.submit
+
+    def spy_submit(prompt, **kwargs):
+        submitted.append(prompt)
+        return original_submit(prompt, **kwargs)
+
+    def padded_generate(*args, **kwargs):
+        raise AssertionError("padded model.generate ran next to the scheduler")
+
+    async def get_runner_async(name):
+        return hf_runner
+
+    async def add_history(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(hf_runner.scheduler, "submit", spy_submit)
+    monkeypatch.setattr(model, "generate", padded_generate)
+    monkeypatch.setattr(settings, "generation_cache_enabled", False)
+    monkeypatch.setattr(config_store, "get_model_config", lambda name: hf_runner.cfg)
+    monkeypatch.setattr(llm_service, "get_runner_async", get_runner_async)
+    monkeypatch.setattr(llm_service, "add_history", add_history)
+
+    items = [{"model": "tiny-cb", "prompt": p, "params": {"do_sample": False, "max_new_tokens": 5}} for p in prompts]
+
+    async def collect():
+        return [pair async for pair in llm_service.generate_batch(items)]
+
+    results = dict(asyncio.run(asyncio.wait_for(collect(), timeout=60)))
+    assert sorted(submitted) == sorted(prompts)
+    assert [results[i]["text"] for i in range(len(prompts))] == expected
+
+
+def test_padded_batch_reports_only_new_tokens(model, hf_runner, monkeypatch):
+    """tokens_result of a padded model.generate batch matches the scheduler for the same prompts."""
+    padded = make_hf_runner(model, monkeypatch, "tiny-padded")
+    prompts = ["1 2 3", "7 8 9 10 11 12", "40 41"]
+    params = {"do_sample": False, "max_new_tokens": 6}
+
+    async def both():
+        return (await padded.generate_batch(prompts, **params),
+                await hf_runner.generate_batch(prompts, **params))
+
+    try:
+        batched, scheduled = asyncio.run(both())
+    finally:
+        padded.unload()
+    assert [r["usage"]["batch_size"] for r in batched] == [3, 3, 3]
+    assert [r["usage"]["tokens_prompt"] for r in batched] == [3, 6, 2]
+    assert [r["usage"]["tokens_result"] for r in batched] == [r["usage"]["tokens_result"] for r in scheduled]
+    assert all(0 < r["usage"]["tokens_result"] <= 6 for r in batched)
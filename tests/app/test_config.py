@@ -0,0 +1,28 @@
+"""Tests for service/runtime params classification (app/core/config.py).
+
+Example:
+    $ pytest tests/app/test_config.py
+"""
+import pytest
+
+pytest.importorskip("pydantic")
+
+from core.config import LLMModelConfig, SERVICE_PARAMS, load_affecting_changes
+from llm_runners.weight_registry import weight_key
+
+
+def model_cfg(**params):
+    return LLMModelConfig(name="m", type="llama_cpp", model_path="/models/m.gguf",
+                          params={"n_ctx": 4096, "n_batch": 512, **params})
+
+
+def test_autotune_report_is_not_a_load_param():
+    old = model_cfg(autotune={"host": "a", "decode_tps": 10.0})
+    new = model_cfg(autotune={"host": "b", "decode_tps": 12.5})
+    assert load_affecting_changes(old, new) == set()
+    assert weight_key(old) == weight_key(new) == weight_key(model_cfg())
+    assert "autotune" in SERVICE_PARAMS
+
+
+def test_load_params_still_trigger_reload():
+    assert load_affecting_changes(model_cfg(), model_cfg(n_batch=1024)) == {"params.n_batch"}
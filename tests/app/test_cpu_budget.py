@@ -0,0 +1,64 @@
+"""Tests for splitting CPU cores between runners (app/services/cpu_budget.py).
+
+Example:
+    $ pytest tests/app/test_cpu_budget.py
+"""
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("pydantic_settings")
+
+from core.config import LLMModelConfig, config_store
+from core.settings import settings
+from services.cpu_budget import CpuBudgetManager
+
+
+def model_cfg(name, type_="transformers", **params):
+    return LLMModelConfig(name=name, type=type_, model_path=f"/models/{name}", params=params)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(settings, "cpu_budget_enabled", True)
+    monkeypatch.setattr(settings, "cpu_partitions", 0)
+    monkeypatch.setattr(settings, "cpu_pinning", False)
+    monkeypatch.setattr(config_store, "get_all_model_configs", lambda: {})
+    monkeypatch.setattr(config_store, "get_default_model", lambda: None)
+    budget = CpuBudgetManager()
+    budget.cores = list(range(8))
+    budget._load = {core: 0 for core in budget.cores}
+    yield budget
+    for allocation in list(budget._allocations):
+        allocation.release()
+
+
+def test_default_partitions_follow_loaded_runners(manager):
+    first = manager.allocate("a", model_cfg("a", "llama_cpp"))
+    assert len(first.cores) == 8
+    second = manager.allocate("b", model_cfg("b", "llama_cpp"))
+    assert len(second.cores) == 4
+    # A new version of a loaded model (hot-swap) is not counted as another model
+    swapped = manager.allocate("b", model_cfg("b", "llama_cpp"))
+    assert len(swapped.cores) == 4
+
+
+def test_thread_counts_only_where_isolated(manager):
+    llama = manager.allocate("llama", model_cfg("llama", "llama_cpp", n_threads=32, pool_size=2))
+    workers = manager.allocate("workers", model_cfg("workers", workers=2))
+    in_process = manager.allocate("torch", model_cfg("torch"))
+
+    # Only runner loaded so far: all 8 cores, split between the 2 contexts of the pool
+    assert llama.isolated and llama.threads == 4
+    assert llama.configure(model_cfg("llama", "llama_cpp", n_threads=32)).params["n_threads"] == 4
+    assert workers.isolated and workers.params["cpu_threads"] == workers.threads
+    assert not in_process.isolated
+    assert "cpu_threads" not in in_process.configure(model_cfg("torch")).params
+
+
+def test_in_process_runner_does_not_touch_torch_threads(manager):
+    torch = pytest.importorskip("torch")
+    before = torch.get_num_threads()
+    allocation = manager.allocate("torch", model_cfg("torch", cpu_cores=1))
+    allocation.executor.submit(lambda: None).result()
+    allocation.apply()
+    assert torch.get_num_threads() == before
@@ -0,0 +1,203 @@
+"""Tests for the /llm/jobs queue (app/services/job_service.py, app/api/jobs.py)
+and its alembic migration 8d2f4c6a1e93.
+
+Generation is replaced by a fake llm_service.generate_stream; jobs go
+through the real JobService, API router and SQLite persistence.
+
+Example:
+    $ pytest tests/app/test_jobs.py
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("sqlmodel")
+pytest.importorskip("aiosqlite")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.jobs import router as jobs_router
+from core.config import LLMModelConfig, config_store
+from db.database import engine, get_session, init_db
+from models.orm import LLMJob
+from services.job_service import JOB_CANCELLED, JOB_DONE, JOB_FINAL, JOB_QUEUED, JOB_RUNNING, job_service
+from services.llm_service import llm_service
+
+from conftest import APP_ROOT
+
+MODEL = "fake"
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await init_db()
+    await job_service.start()
+    yield
+    await job_service.stop()
+    # Соединения пула привязаны к event loop этого TestClient
+    await engine.dispose()
+
+
+def make_client() -> TestClient:
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(jobs_router, prefix="/llm")
+    return TestClient(app)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    cfg = LLMModelConfig(name=MODEL, type="fake", model_path="/models/fake", params={})
+    calls = {"stream": 0}
+
+    def get_model_config(name):
+        if name.lower() != MODEL:
+            raise KeyError(name)
+        return cfg
+
+    async def generate_stream(model, prompt, params=None, user_id=None, cancel_token=None, ticket=None, **kwargs):
+        calls["stream"] += 1
+        for word in prompt.split():
+            yield word.upper() + " "
+
+    async def add_history(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(config_store, "get_model_config", get_model_config)
+    monkeypatch.setattr(llm_service, "generate_stream", generate_stream)
+    monkeypatch.setattr(llm_service, "add_history", add_history)
+    return calls
+
+
+def wait_for_status(client, job_id, statuses, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/llm/jobs/{job_id}").json()
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} stuck in {job['status']}")
+
+
+def test_submit_poll_and_persist(fake_llm):
+    with make_client() as client:
+        resp = client.post("/llm/jobs", json={"model": MODEL, "prompt": "hello jobs", "user_id": "u1"})
+        assert resp.status_code == 202
+        job_id = resp.json()["id"]
+        assert resp.json()["status"] in (JOB_QUEUED, JOB_RUNNING, JOB_DONE)
+        job = wait_for_status(client, job_id, JOB_FINAL)
+        assert job["status"] == JOB_DONE
+        assert job["result"] == "HELLO JOBS "
+        assert job["usage"]["chunks"] == 2 and job["attempts"] == 1
+        assert client.get(f"/llm/jobs/{job_id}/stream").text == "HELLO JOBS "
+        assert client.post("/llm/jobs", json={"model": "missing", "prompt": "x"}).status_code == 404
+        assert client.get("/llm/jobs/unknown").status_code == 404
+
+    # A new server process reads the same job back from SQLite
+    with make_client() as client:
+        job = client.get(f"/llm/jobs/{job_id}").json()
+        assert job["status"] == JOB_DONE and job["result"] == "HELLO JOBS " and job["user_id"] == "u1"
+
+
+def test_interrupted_job_resumes_after_restart(fake_llm):
+    async def insert_running_job():
+        async with get_session() as session:
+            session.add(LLMJob(id="interrupted", model=MODEL, prompt="again please", params="{}",
+                               status=JOB_RUNNING, attempts=1))
+            await session.commit()
+        await engine.dispose()
+
+    asyncio.run(init_db())
+    asyncio.run(insert_running_job())
+    with make_client() as client:
+        job = wait_for_status(client, "interrupted", JOB_FINAL)
+    assert job["status"] == JOB_DONE and job["result"] == "AGAIN PLEASE " and job["attempts"] == 2
+
+
+def test_cancel_while_waiting_for_admission(fake_llm, monkeypatch):
+    admitting = []
+
+    async def busy_admit(model, lane):
+        admitting.append(model)
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(llm_service, "admit", busy_admit)
+    with make_client() as client:
+        job_id = client.post("/llm/jobs", json={"model": MODEL, "prompt": "never runs"}).json()["id"]
+        deadline = time.monotonic() + 10
+        while not admitting and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert admitting, "job never asked for a model slot"
+        # Waiting for a slot is not running
+        assert job_service.stats() == {"queued": 0, "admitting": 1, "running": 0}
+        resp = client.post(f"/llm/jobs/{job_id}/cancel")
+        assert resp.status_code == 200 and resp.json()["status"] == JOB_CANCELLED
+        job = wait_for_status(client, job_id, JOB_FINAL)
+        assert job["status"] == JOB_CANCELLED and job["started_at"] is None
+        assert job_service.stats() == {"queued": 0, "admitting": 0, "running": 0}
+    assert fake_llm["stream"] == 0
+
+
+def test_generating_job_counts_as_running(fake_llm, monkeypatch):
+    release = threading.Event()
+
+    async def slow_stream(model, prompt, **kwargs):
+        yield "first "
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        yield "second"
+
+    monkeypatch.setattr(llm_service, "generate_stream", slow_stream)
+    with make_client() as client:
+        job_id = client.post("/llm/jobs", json={"model": MODEL, "prompt": "slow"}).json()["id"]
+        wait_for_status(client, job_id, {JOB_RUNNING})
+        assert job_service.stats() == {"queued": 0, "admitting": 0, "running": 1}
+        release.set()
+        assert wait_for_status(client, job_id, JOB_FINAL)["result"] == "first second"
+        assert job_service.stats()["running"] == 0
+
+
+def test_cancel_queued_job(fake_llm, monkeypatch):
+    monkeypatch.setattr(job_service, "_worker", lambda: asyncio.sleep(3600))
+    with make_client() as client:
+        job_id = client.post("/llm/jobs", json={"model": MODEL, "prompt": "stays queued"}).json()["id"]
+        assert client.post(f"/llm/jobs/{job_id}/cancel").json()["status"] == JOB_CANCELLED
+        assert client.get(f"/llm/jobs/{job_id}").json()["status"] == JOB_CANCELLED
+
+
+def test_llm_jobs_migration(tmp_path):
+    pytest.importorskip("alembic")
+    from alembic import command
+    from alembic.config import Config
+
+    db_path = os.path.join(str(tmp_path), "migrate.sqlite")
+    cfg = Config()
+    cfg.set_main_option("script_location", os.path.join(APP_ROOT, "alembic"))
+    cfg.set_main_option("sqlalchemy.url", f"sqlite+aiosqlite:///{db_path}")
+
+    def schema():
+        with sqlite3.connect(db_path) as conn:
+            tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+            indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(llmjob)")}
+        return tables, indexes, columns
+
+    command.upgrade(cfg, "8d2f4c6a1e93")
+    tables, indexes, columns = schema()
+    assert "llmjob" in tables
+    assert {"ix_llmjob_status", "ix_llmjob_created_at"} <= indexes
+    assert columns == set(LLMJob.__fields__)
+
+    command.downgrade(cfg, "3c9e5b7a2d41")
+    tables, indexes, _ = schema()
+    assert "llmjob" not in tables and "llmcacheentry" in tables
+    assert not {"ix_llmjob_status", "ix_llmjob_created_at"} & indexes
@@ -0,0 +1,118 @@
+"""Tests for the llama.cpp context pool (app/llm_runners/llama_pool.py).
+
+A stub factory stands in for llama_cpp.Llama: contexts are checked out
+exclusively, checkout blocks once pool_size are busy, and GPU offload
+caps the pool at one context.
+
+Example:
+    $ pytest tests/app/test_llama_pool.py
+"""
+import threading
+import time
+
+import pytest
+
+from llm_runners.llama_pool import LlamaContextPool, effective_pool_size
+
+
+class StubLlama:
+    """Records how many threads use the context at once."""
+    created = 0
+
+    def __init__(self):
+        StubLlama.created += 1
+        self.users = 0
+        self.max_users = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def generate(self):
+        with self._lock:
+            self.users += 1
+            self.max_users = max(self.max_users, self.users)
+        time.sleep(0.01)
+        with self._lock:
+            self.users -= 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def reset_created():
+    StubLlama.created = 0
+
+
+def test_contexts_are_exclusive_and_checkout_blocks_at_pool_size():
+    pool = LlamaContextPool(StubLlama, effective_pool_size({"pool_size": 2}))
+    assert StubLlama.created == 2
+    busy = threading.Barrier(3)
+    release = threading.Event()
+    holders = []
+
+    def hold():
+        with pool.checkout() as ctx:
+            holders.append(ctx)
+            busy.wait(5)
+            release.wait(5)
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for t in threads:
+        t.start()
+    busy.wait(5)
+    assert holders[0] is not holders[1]
+    assert pool.stats()["busy"] == 2
+    with pytest.raises(TimeoutError):
+        with pool.checkout(timeout=0.05):
+            pass
+
+    # A third request waits until a context is returned and then gets one of the same two
+    got = []
+
+    def wait_for_context():
+        with pool.checkout(timeout=5) as ctx:
+            got.append(ctx)
+
+    waiter = threading.Thread(target=wait_for_context)
+    waiter.start()
+    time.sleep(0.05)
+    assert not got
+    release.set()
+    waiter.join(5)
+    for t in threads:
+        t.join(5)
+    assert got and got[0] in holders
+    assert pool.stats()["waits"] == 2
+
+
+def test_no_context_is_shared_between_threads():
+    pool = LlamaContextPool(StubLlama, 3)
+
+    def work():
+        for _ in range(10):
+            with pool.checkout() as ctx:
+                ctx.generate()
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    contexts = list(pool._contexts)
+    assert all(ctx.max_users == 1 for ctx in contexts)
+    assert pool.stats()["busy"] == 0
+    pool.close()
+    assert all(ctx.closed for ctx in contexts) and pool.primary is None
+
+
+@pytest.mark.parametrize("params, expected", [
+    ({}, 1),
+    ({"pool_size": 4}, 4),
+    ({"pool_size": 4, "n_gpu_layers": 20}, 1),
+    ({"pool_size": 4, "n_gpu_layers": -1}, 1),
+    ({"pool_size": 4, "n_gpu_layers": 0}, 4),
+])
+def test_gpu_offload_caps_pool_at_one_context(params, expected):
+    pool = LlamaContextPool(StubLlama, effective_pool_size(params))
+    assert StubLlama.created == expected
+    assert pool.stats()["size"] == expected
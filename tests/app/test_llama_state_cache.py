@@ -0,0 +1,53 @@
+"""Tests for the on-disk llama.cpp prefix state cache (app/llm_runners/llama_state_cache.py).
+
+Example:
+    $ pytest tests/app/test_llama_state_cache.py
+"""
+import inspect
+import os
+import pickle
+
+import pytest
+
+np = pytest.importorskip("numpy")
+llama_cpp = pytest.importorskip("llama_cpp")
+
+from llm_runners.llama_state_cache import LlamaPrefixStateCache
+
+
+def make_state():
+    raw = bytes(range(256)) * 4
+    fields = {
+        "input_ids": np.arange(12, dtype=np.intc),
+        "scores": np.random.default_rng(0).random((12, 8), dtype=np.single),
+        "n_tokens": 12,
+        "llama_state": raw,
+        "llama_state_size": len(raw),
+        "seed": 42,
+    }
+    accepted = inspect.signature(llama_cpp.LlamaState.__init__).parameters
+    return llama_cpp.LlamaState(**{k: v for k, v in fields.items() if k in accepted})
+
+
+def test_disk_roundtrip_survives_restart(tmp_path):
+    state = make_state()
+    cache = LlamaPrefixStateCache("model.gguf", ram_budget_bytes=1 << 20, cache_dir=str(tmp_path))
+    key = cache.key([1, 2, 3])
+    cache.put(key, state)
+
+    restarted = LlamaPrefixStateCache("model.gguf", ram_budget_bytes=1 << 20, cache_dir=str(tmp_path))
+    loaded = restarted.get(key)
+    assert loaded is not None
+    assert loaded.n_tokens == state.n_tokens
+    assert bytes(loaded.llama_state) == bytes(state.llama_state)
+    assert np.array_equal(loaded.input_ids, state.input_ids)
+    assert np.array_equal(loaded.scores, state.scores)
+
+
+def test_pickled_file_is_not_loaded(tmp_path):
+    cache = LlamaPrefixStateCache("model.gguf", ram_budget_bytes=1 << 20, cache_dir=str(tmp_path))
+    key = cache.key([4, 5])
+    with open(os.path.join(str(tmp_path), f"{key}.llstate"), "wb") as f:
+        pickle.dump(make_state(), f)
+    assert cache.get(key) is None
+    assert cache.misses == 1
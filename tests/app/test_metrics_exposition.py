@@ -0,0 +1,111 @@
+"""Tests for the Prometheus exposition of /metrics/prometheus (app/api/metrics.py).
+
+The output is parsed with prometheus_client's text parser: every family
+must be declared once, with all its labelled samples grouped under it.
+
+Example:
+    $ pytest tests/app/test_metrics_exposition.py
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlmodel")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+parser = pytest.importorskip("prometheus_client.parser")
+
+from api import metrics
+from services.admission_service import admission_service
+from services.metrics_service import MetricsService
+
+
+def model_stats(**overrides):
+    stats = MetricsService._new_model_stats()
+    stats.update(requests=3, tokens=120, avg_latency_ms=41.5)
+    stats.update(overrides)
+    return stats
+
+
+@pytest.fixture
+def metrics_data(monkeypatch):
+    data = {
+        "total_requests": 5,
+        "total_tokens": 200,
+        "avg_latency_ms": 40.0,
+        "models_stats": {
+            "alpha": model_stats(spec_generations=2, spec_drafted=10, spec_accepted=7,
+                                 spec_tokens_per_forward_sum=5.0, decode_eager_generations=2,
+                                 decode_eager_ms_sum=30.0, reloads=1, last_reload_ms=900),
+            "beta": model_stats(spec_generations=1, spec_drafted=4, spec_accepted=1,
+                                spec_tokens_per_forward_sum=1.5, decode_compiled_generations=1,
+                                decode_compiled_ms_sum=8.0, decode_eager_generations=1,
+                                decode_eager_ms_sum=12.0, reload_failures=1),
+        },
+        "cache_stats": {"exact": {"hits": 2, "misses": 3}, "semantic": {"hits": 1, "misses": 4}},
+        "reloads_in_progress": {},
+    }
+
+    async def get_metrics():
+        return data
+
+    monkeypatch.setattr(metrics.metrics_service, "get_metrics", get_metrics)
+    for name in ("alpha", "beta"):
+        admission_service.for_model(SimpleNamespace(name=name, params={}))
+    return data
+
+
+def scrape():
+    return asyncio.run(metrics.prometheus_metrics()).body.decode()
+
+
+def test_each_family_declared_once(metrics_data):
+    text = scrape()
+    declared = [line.split()[2] for line in text.splitlines() if line.startswith("# TYPE ")]
+    assert len(declared) == len(set(declared))
+    assert text.endswith("\n")
+
+
+def test_labelled_samples_grouped_under_family(metrics_data):
+    families = {f.name: f for f in parser.text_string_to_metric_families(scrape())}
+
+    requests = families["llm_model_requests"]
+    assert requests.type == "counter"
+    assert {s.labels["model"]: s.value for s in requests.samples} == {"alpha": 3, "beta": 3}
+
+    decode = families["llm_decode_ms_per_token"]
+    assert {(s.labels["model"], s.labels["mode"]) for s in decode.samples} == {
+        ("alpha", "eager"), ("beta", "compiled"), ("beta", "eager"),
+    }
+    assert {s.labels["cache"] for s in families["llm_cache_hits"].samples} == {"exact", "semantic"}
+    assert {s.labels["model"] for s in families["llm_model_reloads"].samples} == {"alpha", "beta"}
+    assert {s.labels["model"] for s in families["llm_model_active"].samples} >= {"alpha", "beta"}
+    # Families without samples are not emitted at all
+    assert "llm_model_reload_elapsed_ms" not in families
+
+
+def test_lookup_hit_rate_counts_only_generated_tokens(monkeypatch):
+    from llm_runners.speculative import SpeculationStats
+    from llm_runners.transformers import TransformersRunner
+    import services.metrics_service as metrics_module
+
+    fresh = MetricsService()
+    monkeypatch.setattr(metrics_module, "metrics_service", fresh)
+    monkeypatch.setattr(metrics, "metrics_service", fresh)
+    # 10 generated tokens in 4 main-model forwards: 6 of them came from prompt-lookup drafts
+    spec = SpeculationStats()
+    spec.main_forwards, spec.drafted, spec.new_tokens = 4, 8, 10
+    runner = TransformersRunner.__new__(TransformersRunner)
+    runner.cfg = SimpleNamespace(name="gamma")
+    # tokens_result on the HF path also counts the 50 prompt tokens
+    res = {"text": "...", "tokens_prompt": 50, "tokens_result": 60, "latency_ms": 5, **spec.usage("lookup")}
+    asyncio.run(runner._record_metrics(res))
+
+    families = {f.name: f for f in parser.text_string_to_metric_families(scrape())}
+    hit_rate = {s.labels["model"]: s.value for s in families["llm_lookup_hit_rate"].samples}
+    per_forward = {s.labels["model"]: s.value for s in families["llm_lookup_tokens_per_forward"].samples}
+    assert hit_rate == {"gamma": pytest.approx(0.6)}
+    assert per_forward == {"gamma": pytest.approx(2.5)}
+    assert "llm_spec_acceptance_rate" not in families
@@ -0,0 +1,220 @@
+"""Tests for the runner registry (app/services/runner_registry.py).
+
+Runners load without holding the registry lock; hot-swap drains the old
+version after its last generation and a failed reload keeps it.
+
+Example:
+    $ pytest tests/app/test_runner_registry.py
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("psutil")
+pytest.importorskip("pydantic")
+pytest.importorskip("yaml")
+
+from core.config import LLMModelConfig
+from services.runner_registry import RunnerCapacityError, RunnerRegistry
+
+MB = 1024 * 1024
+
+
+def model_cfg(name, memory_mb=100):
+    return LLMModelConfig(name=name, type="llama_cpp", model_path=f"/models/{name}.gguf",
+                          params={"memory_mb": memory_mb})
+
+
+class SlowFactory:
+    def __init__(self, fail=False):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+        self.fail = fail
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(10)
+        if self.fail:
+            raise RuntimeError("load failed")
+        return object()
+
+
+def test_registry_usable_while_loading_and_load_happens_once():
+    registry = RunnerRegistry(budget_bytes=1000 * MB)
+    cfg = model_cfg("slow")
+    factory = SlowFactory()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("slow", cfg, factory)))
+               for _ in range(2)]
+    threads[0].start()
+    assert factory.started.wait(5)
+    threads[1].start()
+
+    # The lock is not held during factory(): other models and bookkeeping don't wait for the load
+    t_start = time.monotonic()
+    stats = registry.stats()
+    registry.get("fast", model_cfg("fast"), object)
+    with registry.in_use("fast"):
+        pass
+    assert time.monotonic() - t_start < 1
+    assert stats["loading"] == {"slow": {"bytes": 100 * MB}}
+    assert stats["used_bytes"] == 100 * MB
+
+    factory.release.set()
+    for t in threads:
+        t.join(5)
+    assert factory.calls == 1
+    assert len(results) == 2 and results[0] is results[1]
+    assert "slow" in registry and not registry.stats()["loading"]
+
+
+def test_get_async_keeps_event_loop_running():
+    registry = RunnerRegistry(budget_bytes=1000 * MB)
+    factory = SlowFactory()
+
+    async def scenario():
+        ticks = 0
+        load = asyncio.create_task(registry.get_async("slow", model_cfg("slow"), factory))
+        while not factory.started.is_set():
+            await asyncio.sleep(0.001)
+        waiter = asyncio.create_task(registry.get_async("slow", model_cfg("slow"), factory))
+        for _ in range(20):
+            await asyncio.sleep(0.001)
+            ticks += 1
+        factory.release.set()
+        return ticks, await load, await waiter
+
+    ticks, runner, same = asyncio.run(scenario())
+    assert ticks == 20
+    assert runner is same and factory.calls == 1
+
+
+def test_failed_load_reaches_waiters_and_can_be_retried():
+    registry = RunnerRegistry(budget_bytes=1000 * MB)
+    cfg = model_cfg("broken")
+    factory = SlowFactory(fail=True)
+    errors = []
+
+    def load():
+        try:
+            registry.get("broken", cfg, factory)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(2)]
+    threads[0].start()
+    assert factory.started.wait(5)
+    threads[1].start()
+    factory.release.set()
+    for t in threads:
+        t.join(5)
+    assert len(errors) == 2 and factory.calls == 1
+    assert registry.stats()["used_bytes"] == 0
+
+    assert registry.get("broken", cfg, object) is not None
+
+
+def test_eviction_happens_outside_the_lock():
+    registry = RunnerRegistry(budget_bytes=150 * MB)
+    unloaded = []
+
+    class Runner:
+        def __init__(self, name):
+            self.name = name
+
+        def unload(self):
+            # Another thread must be able to take the registry lock while a victim unloads
+            free = []
+
+            def probe():
+                if registry._lock.acquire(blocking=False):
+                    registry._lock.release()
+                    free.append(True)
+
+            prober = threading.Thread(target=probe)
+            prober.start()
+            prober.join(5)
+            assert free
+            unloaded.append(self.name)
+
+    registry.get("a", model_cfg("a"), lambda: Runner("a"))
+    with registry.in_use("a"):
+        with pytest.raises(RunnerCapacityError):
+            registry.get("b", model_cfg("b"), lambda: Runner("b"))
+    assert "a" in registry and unloaded == []
+    registry.get("b", model_cfg("b"), lambda: Runner("b"))
+    assert unloaded == ["a"] and "b" in registry and registry.evictions == 1
+
+
+class Unloadable:
+    def __init__(self, name):
+        self.name = name
+        self.unloaded = False
+
+    def unload(self):
+        self.unloaded = True
+
+
+def test_swap_drains_old_runner_after_last_generation():
+    registry = RunnerRegistry(budget_bytes=1000 * MB)
+    cfg = model_cfg("m")
+    old = registry.get("m", cfg, lambda: Unloadable("old"))
+    new = Unloadable("new")
+    with registry.in_use("m"):
+        registry.swap("m", new, cfg, 100 * MB)
+        # New requests get the new version; the old one keeps serving the generation in flight
+        assert registry.get("m", cfg, object) is new
+        assert not old.unloaded
+        assert registry.stats()["draining"] == [{"model": "m", "bytes": 100 * MB, "active": 1}]
+        with registry.in_use("m"):
+            pass
+        assert not old.unloaded
+    assert old.unloaded and not new.unloaded
+    assert registry.stats()["draining"] == []
+    assert registry.stats()["used_bytes"] == 100 * MB
+
+
+def test_swap_of_idle_runner_unloads_it_at_once():
+    registry = RunnerRegistry(budget_bytes=1000 * MB)
+    cfg = model_cfg("m")
+    old = registry.get("m", cfg, lambda: Unloadable("old"))
+    registry.swap("m", Unloadable("new"), cfg, 100 * MB)
+    assert old.unloaded and registry.stats()["draining"] == []
+
+
+def test_failed_hot_swap_keeps_old_entry(monkeypatch):
+    pytest.importorskip("sqlmodel")
+    pytest.importorskip("aiosqlite")
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from core.config import config_store
+    from services.llm_service import llm_service
+    from services.metrics_service import metrics_service
+
+    registry = RunnerRegistry(budget_bytes=1000 * MB)
+    cfg = model_cfg("m")
+    old = registry.get("m", cfg, lambda: Unloadable("old"))
+    changed = model_cfg("m", memory_mb=200)
+
+    def broken_factory():
+        raise RuntimeError("new weights are corrupt")
+
+    monkeypatch.setattr(llm_service, "runners", registry)
+    monkeypatch.setattr(config_store, "get_all_model_configs", lambda: {"m": changed})
+    monkeypatch.setattr(llm_service, "_runner_factory", lambda cfg: broken_factory)
+    failures = metrics_service.models_stats["m"]["reload_failures"]
+
+    async def scenario():
+        with registry.in_use("m"):
+            await llm_service._hot_swap("m")
+            assert registry.get("m", cfg, object) is old
+
+    asyncio.run(scenario())
+    assert not old.unloaded
+    assert registry.config_of("m").params["memory_mb"] == 100
+    assert registry.stats()["draining"] == []
+    assert metrics_service.models_stats["m"]["reload_failures"] == failures + 1
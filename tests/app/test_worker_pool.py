@@ -0,0 +1,112 @@
+"""Tests for the process worker pool (app/llm_runners/worker_pool.py).
+
+Real spawned worker processes run EchoRunner from this module: requests
+and stream chunks round-trip over the pipe, cancellation is forwarded to
+the worker, and a worker that dies mid-request fails it with
+WorkerCrashedError and is restarted.
+
+Example:
+    $ pytest tests/app/test_worker_pool.py
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+pytest.importorskip("sqlmodel")
+pytest.importorskip("aiosqlite")
+
+from core.config import LLMModelConfig
+from llm_runners.cancellation import CancellationToken, GenerationCancelled
+from llm_runners.worker_pool import ProcessWorkerPool, WorkerCrashedError
+
+READY_TIMEOUT_SEC = 60
+
+
+class EchoRunner:
+    """Runner for worker processes: echoes the prompt; "hang" waits for cancel, "die" kills the process."""
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    async def generate(self, prompt, cancel_token=None, **kwargs):
+        if prompt == "die":
+            os._exit(3)
+        if prompt == "hang":
+            while not cancel_token.cancelled:
+                await asyncio.sleep(0.01)
+            raise GenerationCancelled()
+        return {"text": prompt.upper(), "usage": {"tokens_prompt": 1, "tokens_result": 1, "latency_ms": 1,
+                                                  "pid": os.getpid(), **kwargs}}
+
+    async def generate_stream(self, prompt, cancel_token=None, **kwargs):
+        for word in prompt.split():
+            yield word
+
+
+def make_pool(workers=1):
+    cfg = LLMModelConfig(name="echo", type="echo", model_path="/models/echo", params={"workers": workers})
+    return ProcessWorkerPool(cfg, EchoRunner, workers)
+
+
+def run_with_pool(scenario, workers=1):
+    async def main():
+        pool = make_pool(workers)
+        try:
+            await pool.wait_ready(timeout=READY_TIMEOUT_SEC)
+            return await asyncio.wait_for(scenario(pool), timeout=READY_TIMEOUT_SEC)
+        finally:
+            pool.shutdown()
+            # shutdown() joins in a background thread; wait here so no worker outlives the test
+            started = [w for w in pool._workers if w is not None]
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [w.process.join(READY_TIMEOUT_SEC) for w in started])
+
+    return asyncio.run(main())
+
+
+def test_generate_and_stream_round_trip():
+    async def scenario(pool):
+        result = await pool.generate("hello worker", max_new_tokens=7)
+        chunks = [chunk async for chunk in pool.generate_stream("a b c")]
+        return result, chunks, pool.stats()
+
+    result, chunks, stats = run_with_pool(scenario)
+    assert result["text"] == "HELLO WORKER"
+    assert result["usage"]["max_new_tokens"] == 7
+    assert result["usage"]["pid"] != os.getpid()
+    assert chunks == ["a", "b", "c"]
+    assert [w["inflight"] for w in stats["workers"]] == [0]
+
+
+def test_cancel_is_forwarded_to_worker():
+    async def scenario(pool):
+        token = CancellationToken()
+        request = asyncio.ensure_future(pool.generate("hang", cancel_token=token))
+        await asyncio.sleep(0.3)
+        assert not request.done()
+        token.cancel()
+        with pytest.raises(GenerationCancelled):
+            await request
+        # The worker is still usable after the cancelled request
+        return await pool.generate("still alive")
+
+    assert run_with_pool(scenario)["text"] == "STILL ALIVE"
+
+
+def test_crashed_worker_fails_request_and_restarts():
+    async def scenario(pool):
+        first_pid = pool.stats()["workers"][0]["pid"]
+        with pytest.raises(WorkerCrashedError):
+            await pool.generate("die")
+        deadline = time.monotonic() + READY_TIMEOUT_SEC
+        while not (pool.restarts and pool.stats()["workers"][0]["ready"]):
+            assert time.monotonic() < deadline, "worker was not restarted"
+            await asyncio.sleep(0.1)
+        result = await pool.generate("after restart")
+        return first_pid, result, pool.stats()
+
+    first_pid, result, stats = run_with_pool(scenario)
+    assert result["text"] == "AFTER RESTART"
+    assert result["usage"]["pid"] == stats["workers"][0]["pid"] != first_pid
+    assert stats["restarts"] == 1